@@ -1,15 +1,30 @@
-
+import asyncio
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 from cryptography.exceptions import InvalidKey
 
+import environment
+
 SALT_SIZE = 16
 KDF_LENGTH = 32
 KDF_N = 2**14
 KDF_R = 8
 KDF_P = 1
 
+# Scrypt is CPU and memory heavy, so it runs in a process pool off the event loop
+KDF_MAX_WORKERS_DEFAULT = os.cpu_count() or 1
+KDF_MAX_PENDING_DEFAULT = 64
+
+_executor: ProcessPoolExecutor | None = None
+_pending = 0
+
+
+class KdfBusyError(Exception):
+    """Raised when too many password hashes are already queued."""
+
 
 def derive_password(password: str) -> str:
     """Derive a password and return the salt and hash."""
@@ -41,3 +56,60 @@ def verify_password(password: str, salt_and_hash: str) -> bool:
         return False
     return True
 
+
+def max_workers() -> int:
+    """Get the number of processes used for password hashing."""
+    return int(environment.get_optional("KDF_MAX_WORKERS", KDF_MAX_WORKERS_DEFAULT))
+
+
+def max_pending() -> int:
+    """Get the number of password hashes that may be queued or running at once."""
+    return int(environment.get_optional("KDF_MAX_PENDING", KDF_MAX_PENDING_DEFAULT))
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Get the process pool used for password hashing, creating it on first use."""
+    global _executor
+    if _executor is None:
+        # The server is multi-threaded by now, and a forked child could inherit a held lock
+        _executor = ProcessPoolExecutor(max_workers=max_workers(), mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Shut down the password hashing process pool."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def _run_kdf(function, *args):
+    """Run a KDF function in the process pool, refusing work once the queue is full."""
+    global _pending
+    if _pending >= max_pending():
+        raise KdfBusyError("Too many password hashes in progress.")
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), function, *args)
+    finally:
+        _pending -= 1
+
+
+async def derive_password_async(password: str) -> str:
+    """Derive a password in the process pool and return the salt and hash."""
+    return await _run_kdf(derive_password, password)
+
+
+async def verify_password_async(password: str, salt_and_hash: str) -> bool:
+    """Verify a password in the process pool."""
+    return await _run_kdf(verify_password, password, salt_and_hash)
+
+
+def kdf_stats() -> dict:
+    """Get the current load on the password hashing process pool."""
+    return {
+        "pending": _pending,
+        "max_pending": max_pending(),
+        "max_workers": max_workers(),
+    }
@@ -0,0 +1,63 @@
+"""Small in-process caches shared by the backend."""
+
+from threading import Lock
+
+from cachetools import TTLCache
+
+_MISSING = object()
+
+
+class CountingTTLCache:
+    """A thread-safe, size-bounded TTL cache that counts hits and misses."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Get a cached value, counting the lookup as a hit or a miss."""
+        with self._lock:
+            value = self._cache.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value) -> None:
+        """Store a value in the cache."""
+        with self._lock:
+            self._cache[key] = value
+
+    def pop(self, key) -> None:
+        """Remove a single key from the cache, if present."""
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def pop_where(self, predicate) -> int:
+        """Remove every entry whose (key, value) matches the predicate."""
+        with self._lock:
+            keys = [key for key, value in self._cache.items() if predicate(key, value)]
+            for key in keys:
+                self._cache.pop(key, None)
+            return len(keys)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        """Get the current size and hit/miss counters of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "maxsize": self._cache.maxsize,
+                "ttl": self._cache.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,60 @@
+"""Backfill Chroma metadata for vectors added before queries were filtered by user.
+
+Every vector in the clothing_items and outfits collections gets the metadata
+that upload_pipeline attaches to new vectors, read from the SQL tables.
+
+Run this file directly:
+
+    python chroma_backfill.py
+"""
+
+from sqlmodel import select
+
+import database
+from clients import get_registry
+from models import ClothingItem, Outfit
+from upload_pipeline import clothing_item_metadata, outfit_metadata
+
+BATCH_SIZE = 500
+
+
+def backfill_collection(collection, model, metadata_for) -> tuple[int, int]:
+    """Attach metadata to every stored vector of a model. Returns (updated, missing) counts."""
+    updated = 0
+    missing = 0
+    last_id = None
+    with database.get_session() as session:
+        while True:
+            query = select(model).order_by(model.id).limit(BATCH_SIZE)
+            if last_id is not None:
+                query = query.where(model.id > last_id)
+            rows = session.exec(query).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            ids = [str(row.id) for row in rows]
+            stored_ids = set(collection.get(ids=ids, include=[])["ids"])
+            stored_rows = [row for row in rows if str(row.id) in stored_ids]
+            if stored_rows:
+                collection.update(
+                    ids=[str(row.id) for row in stored_rows],
+                    metadatas=[metadata_for(row) for row in stored_rows],
+                )
+            updated += len(stored_rows)
+            missing += len(rows) - len(stored_rows)
+    return updated, missing
+
+
+def backfill():
+    """Backfill metadata for the clothing item and outfit collections."""
+    chroma = get_registry().chroma
+    return {
+        "clothing_items": backfill_collection(chroma.get_or_create_collection("clothing_items"), ClothingItem, clothing_item_metadata),
+        "outfits": backfill_collection(chroma.get_or_create_collection("outfits"), Outfit, outfit_metadata),
+    }
+
+
+if __name__ == "__main__":
+    for name, (updated, missing) in backfill().items():
+        print(f"{name}: updated {updated} vectors, {missing} rows have no vector")
@@ -0,0 +1,144 @@
+"""Application-lifetime clients for S3, Chroma and OpenAI.
+
+Building these clients per request repeats TLS handshakes and credential
+resolution, so one registry is created at startup and shared by every route
+through the get_clients dependency. Each client keeps a pool of keep-alive
+connections.
+
+Local stand-ins can be swapped in through the environment:
+
+    CHROMA_MODE=local       use an embedded Chroma stored in CHROMA_LOCAL_PATH
+    VECTOR_STORE=embedded   search in-process vectors stored in VECTOR_STORE_PATH
+    S3_ENDPOINT_URL=...     talk to an S3-compatible server such as MinIO
+    OPENAI_BASE_URL=...     talk to an OpenAI-compatible server
+
+or by passing any objects with the same interface to set_registry().
+"""
+
+from threading import Lock
+
+import boto3
+import chromadb
+import httpx
+from botocore.config import Config
+from openai import OpenAI
+
+import environment
+from vector_store import ChromaVectorStore, EmbeddedVectorStore, VectorStore
+
+S3_MAX_POOL_CONNECTIONS = 50
+OPENAI_MAX_CONNECTIONS = 50
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+CHROMA_PORT = 8000
+
+
+class ClientRegistry:
+    """Holds one shared client per external service, built on first use."""
+
+    def __init__(self, s3=None, chroma=None, openai=None, vectors: VectorStore | None = None):
+        self._lock = Lock()
+        self._s3 = s3
+        self._chroma = chroma
+        self._openai = openai
+        self._vectors = vectors
+        self._openai_http_client = None
+
+    @property
+    def s3(self):
+        """Get the S3 client."""
+        with self._lock:
+            if self._s3 is None:
+                self._s3 = boto3.client(
+                    "s3",
+                    aws_access_key_id=environment.get("AWS_ACCESS_KEY_ID"),
+                    aws_secret_access_key=environment.get("AWS_SECRET_ACCESS_KEY"),
+                    region_name=environment.get("AWS_DEFAULT_REGION"),
+                    endpoint_url=environment.get_optional("S3_ENDPOINT_URL"),
+                    config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, tcp_keepalive=True),
+                )
+            return self._s3
+
+    @property
+    def chroma(self):
+        """Get the Chroma client."""
+        with self._lock:
+            if self._chroma is None:
+                if environment.get_optional("CHROMA_MODE", "http") == "local":
+                    self._chroma = chromadb.PersistentClient(path=environment.get_optional("CHROMA_LOCAL_PATH", "chroma_data"))
+                else:
+                    self._chroma = chromadb.HttpClient(host=environment.get("CHROMA_DB_ADDRESS"), port=CHROMA_PORT)
+            return self._chroma
+
+    @property
+    def vectors(self) -> VectorStore:
+        """Get the vector store used for similarity search."""
+        if self._vectors is None:
+            if environment.get_optional("VECTOR_STORE", "chroma") == "embedded":
+                vectors = EmbeddedVectorStore(environment.get_optional("VECTOR_STORE_PATH", "vector_data"))
+            else:
+                vectors = ChromaVectorStore(self.chroma)
+            with self._lock:
+                if self._vectors is None:
+                    self._vectors = vectors
+        return self._vectors
+
+    @property
+    def openai(self) -> OpenAI:
+        """Get the OpenAI client."""
+        with self._lock:
+            if self._openai is None:
+                self._openai_http_client = httpx.Client(limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                ))
+                self._openai = OpenAI(
+                    api_key=environment.get("OPENAI_API_KEY"),
+                    base_url=environment.get_optional("OPENAI_BASE_URL"),
+                    http_client=self._openai_http_client,
+                    # model_dispatch retries with its own backoff and deadline
+                    max_retries=0,
+                )
+            return self._openai
+
+    def close(self):
+        """Close the connection pools owned by the registry."""
+        with self._lock:
+            if self._openai_http_client is not None:
+                self._openai_http_client.close()
+                self._openai_http_client = None
+                self._openai = None
+
+
+_registry: ClientRegistry | None = None
+_registry_lock = Lock()
+
+
+def get_registry() -> ClientRegistry:
+    """Get the process-wide client registry, creating it on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ClientRegistry()
+    return _registry
+
+
+def set_registry(registry: ClientRegistry | None):
+    """Replace the process-wide client registry, e.g. with local stand-ins."""
+    global _registry
+    with _registry_lock:
+        _registry = registry
+
+
+def close_registry():
+    """Close the process-wide client registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+            _registry = None
+
+
+def get_clients() -> ClientRegistry:
+    """Get the shared client registry for use with FastAPI."""
+    return get_registry()
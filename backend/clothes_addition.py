@@ -1,12 +1,21 @@
 from openai import OpenAI
-from dotenv import load_dotenv
+from sqlmodel import Session
 #import chromadb
 import asyncio
 import json
 import environment
 import os
 import chromadb
-def parse_clothing_items(url : str):
+import parse_cache
+from clients import get_registry
+from model_dispatch import get_dispatcher
+
+VISION_MODEL = "gpt-4o-mini"
+# Bump these whenever a prompt or its output format changes, so cached parses are not reused
+CLOTHING_PROMPT_VERSION = "clothing_items/1"
+OUTFIT_PROMPT_VERSION = "outfit/2"
+
+def parse_clothing_items(url : str, client : OpenAI | None = None, digest : str | None = None, session : Session | None = None):
     '''
     This function takes in an image url and returns a list of json objects for each clothing item in the image.
     Each json object contains the cloth type, cloth size, clothing color, and clothing description.
@@ -29,15 +38,21 @@ def parse_clothing_items(url : str):
 
     Args:
     url : str : The url of the image to be parsed
+    client : OpenAI : The client to use, defaults to the shared one
+    digest : str : The SHA-256 of the image at url, to reuse an earlier parse of it
+    session : Session : The caller's session for the parse cache, committed before the model call
 
     Returns:
     parsed : A list of json objects for each clothing item in the image
     '''
-    load_dotenv()
-    client = OpenAI()
+    return parse_cache.get_or_parse(digest, VISION_MODEL, CLOTHING_PROMPT_VERSION, lambda: _parse_clothing_items(url, client), session)
+
+def _parse_clothing_items(url : str, client : OpenAI | None = None):
+    client = client or get_registry().openai
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
+    completion = get_dispatcher().call(
+        client.chat.completions.create,
+        model=VISION_MODEL,
         messages=[
             {
                 "role": "user",
@@ -61,19 +76,48 @@ def parse_clothing_items(url : str):
     parsed = [i for i in json.loads(completion.choices[0].message.content)]
     return parsed
 
-def parse_outfit(url : str):
-    load_dotenv()
-    client = OpenAI()
+def parse_outfit(url : str, client : OpenAI | None = None, digest : str | None = None, session : Session | None = None):
+    '''
+    This function takes in an outfit image url and returns the clothing items in it and a description of the whole outfit.
+    Both come from a single model call.
+
+    Example:
+    {
+        "items": [
+            {
+                "cloth_type": "shirt",
+                "cloth_size": "medium",
+                "cloth_color": "blue",
+                "cloth_description": "a blue shirt with a white logo"
+            }
+        ],
+        "description": "a casual outfit with a blue logo shirt"
+    }
+
+    Args:
+    url : str : The url of the image to be parsed
+    client : OpenAI : The client to use, defaults to the shared one
+    digest : str : The SHA-256 of the image at url, to reuse an earlier parse of it
+    session : Session : The caller's session for the parse cache, committed before the model call
+
+    Returns:
+    parsed : A dict with the list of clothing items and the outfit description
+    '''
+    return parse_cache.get_or_parse(digest, VISION_MODEL, OUTFIT_PROMPT_VERSION, lambda: _parse_outfit(url, client), session)
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
+def _parse_outfit(url : str, client : OpenAI | None = None):
+    client = client or get_registry().openai
+
+    completion = get_dispatcher().call(
+        client.chat.completions.create,
+        model=VISION_MODEL,
         messages=[
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": '''What clothes are in this image? Return only a json object describing each clothing item with the cloth type, cloth size, clothing color, and clothing description.
-                        Example:[{"cloth_type": "shirt","cloth_size": "medium","cloth_color": "blue","cloth_description": "a blue shirt with a white logo"}, {"cloth_type": "pants","cloth_size": "large","cloth_color": "black","cloth_description": "black pants with a white stripe"}]
-                        Return nothing except the json object on one line with no quotation marks or text outside of the object. Do not use terms like 'unknown' or 'not specified' to describe the objects. For the descriptions, be as descriptive as possible.
+                    {"type": "text", "text": '''What outfit is in this image? Return a json object with two keys: "items", a list with a json object for each clothing item with the cloth type, cloth size, clothing color, and clothing description, and "description", one or two sentences describing the whole outfit.
+                        Example:{"items": [{"cloth_type": "shirt","cloth_size": "medium","cloth_color": "blue","cloth_description": "a blue shirt with a white logo"}, {"cloth_type": "pants","cloth_size": "large","cloth_color": "black","cloth_description": "black pants with a white stripe"}], "description": "a casual outfit of a blue logo shirt and black striped pants"}
+                        Do not use terms like 'unknown' or 'not specified' to describe the objects. For the descriptions, be as descriptive as possible.
                     '''},
                     {
                         "type": "image_url",
@@ -84,11 +128,12 @@ def parse_outfit(url : str):
                 ],
             }
         ],
-        max_tokens=300,
+        response_format={"type": "json_object"},
+        max_tokens=500,
     )
 
-    parsed = [completion.choices[0].message.content]
-    return parsed
+    parsed = json.loads(completion.choices[0].message.content)
+    return {"items": parsed.get("items", []), "description": parsed.get("description", "")}
 
 
 def upload_to_chroma(parsed : list):
@@ -102,7 +147,7 @@ def upload_to_chroma(parsed : list):
     None
     '''
 
-    client = chromadb.HttpClient()
+    client = get_registry().chroma
 
     collection = client.get_or_create_collection(name="test")
 
@@ -123,7 +168,7 @@ def query_chroma(chroma_db_name : str, query : str, num_items : int):
     Returns:
     list : A list of the top num_items items from the chroma database that match the query
     '''
-    client = chromadb.HttpClient()
+    client = get_registry().chroma
 
     collection = client.get_or_create_collection(name=chroma_db_name)
     results = collection.query(
@@ -137,7 +182,7 @@ def query_chroma(chroma_db_name : str, query : str, num_items : int):
 if __name__ == '__main__':
     # result = parse_clothing_items('https://hack-fitcheck.s3.amazonaws.com/2d773c76-4e55-4fd6-b089-ed05a707ee32_photo.jpg')
     # print(result)
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
+    client = get_registry().chroma
     collection = client.get_or_create_collection(name="clothing_items")
 
     from chromadb.config import Settings
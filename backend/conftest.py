@@ -0,0 +1,126 @@
+"""Shared fixtures for tests.py.
+
+Run the tests from this directory with python -m pytest. They use a
+throwaway SQLite database and local stand-ins for external services, so no
+.env is needed; test_chroma alone talks to the Chroma server at
+CHROMA_DB_ADDRESS.
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="fitcheck-tests-")
+
+# environment.py insists on every variable in .env.template
+for key in ("FRONTEND_URL", "OPENAI_API_KEY", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_DEFAULT_REGION",
+            "FACEBOOK_CATALOG_ID", "PAGE_ACCESS_TOKEN", "FACEBOOK_ACCESS_TOKEN", "EBAY_CLIENT_ID", "EBAY_CLIENT_SECRET",
+            "EBAY_REDIRECT_URI", "EBAY_AUTH_HEADER"):
+    os.environ.setdefault(key, "test")
+os.environ.setdefault("CHROMA_DB_ADDRESS", "localhost")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIRECTORY, 'test.sqlite')}",
+    # A fixed worker ID, so tests do not lease one from the database
+    "ID_WORKER_ID": "1",
+})
+
+import environment
+
+# Never read .env, so the tests cannot reach a real database
+environment.load_dotenv = lambda *args, **kwargs: None
+
+
+@pytest.fixture
+def engine():
+    """The test database, emptied and migrated to the latest schema."""
+    import database
+    import models
+
+    engine = database.Engine()
+    models.reset_database(engine)
+    return engine
+
+
+@pytest.fixture
+def session(engine):
+    """A session on the test database."""
+    import database
+
+    with database.get_session() as session:
+        yield session
+
+
+@pytest.fixture
+def make_user(session):
+    """Create users with placeholder passwords."""
+    import database
+
+    def make(name: str = "Test User", email: str | None = None):
+        user = database.create_user(name, email or f"{name.lower().replace(' ', '.')}@example.com", "salt$hash", session)
+        session.commit()
+        return user
+    return make
+
+
+def fake_embedding(texts: list[str]) -> list[np.ndarray]:
+    """Embed texts as normalized bags of hashed words, so texts sharing words are near each other."""
+    vectors = np.zeros((len(texts), 32), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 32] += 1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(vectors / np.where(norms == 0, 1, norms))
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    """Embed with fake_embedding instead of downloading the model."""
+    import embeddings
+
+    monkeypatch.setattr(embeddings, "embedding_function", lambda: fake_embedding)
+    embeddings.query_cache.clear()
+    yield
+    embeddings.query_cache.clear()
+
+
+@pytest.fixture
+def clients(tmp_path, fake_embeddings):
+    """A client registry with an embedded vector store, which must not call OpenAI."""
+    from clients import ClientRegistry
+    from vector_store import EmbeddedVectorStore
+
+    return ClientRegistry(openai=object(), vectors=EmbeddedVectorStore(str(tmp_path / "vectors")))
+
+
+class FakeEmbeddingFunction:
+    """A Chroma embedding function running fake_embedding."""
+
+    def __call__(self, input):
+        return fake_embedding(input)
+
+
+class FakeEmbeddingChroma:
+    """A Chroma client whose collections embed documents with fake_embedding."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_or_create_collection(self, name: str):
+        return self.client.get_or_create_collection(name=name, embedding_function=FakeEmbeddingFunction())
+
+    def delete_collection(self, name: str):
+        self.client.delete_collection(name=name)
+
+
+@pytest.fixture(params=["embedded", "chroma"])
+def vector_store(request, tmp_path, fake_embeddings):
+    """Each vector store backend, empty."""
+    import chromadb
+    from vector_store import ChromaVectorStore, EmbeddedVectorStore
+
+    if request.param == "embedded":
+        return EmbeddedVectorStore(str(tmp_path / "vectors"))
+    return ChromaVectorStore(FakeEmbeddingChroma(chromadb.PersistentClient(path=str(tmp_path / "chroma"))))
@@ -3,3 +3,20 @@
 MAX_EMAIL_LENGTH = 50
 MAX_PASSWORD_LENGTH = 50
 MAX_NAME_LENGTH = 50
+
+# Login token -> user cache used by enforce_logged_in. Each worker has its own,
+# so this is how long other workers may show a renamed user's old name.
+LOGIN_CACHE_MAX_SIZE = 10_000
+LOGIN_CACHE_TTL_SECONDS = 60
+
+# Search query text -> embedding cache used by the vector stores
+QUERY_EMBEDDING_CACHE_MAX_SIZE = 5_000
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = 3600
+
+# Keyset pagination of list endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# User ID -> closet facet counts cache used by /facets
+FACET_CACHE_MAX_SIZE = 10_000
+FACET_CACHE_TTL_SECONDS = 600
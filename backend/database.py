@@ -1,28 +1,101 @@
 """Interactions with the database."""
 
+from contextlib import contextmanager
+from datetime import datetime
 from functools import cache
+from threading import Lock
+from time import perf_counter
 from uuid import uuid4
-from sqlmodel import Session, select
+from sqlalchemy.orm import object_session
+from sqlalchemy.pool import QueuePool
+from sqlmodel import Session, delete, insert, select, update
 
 import environment
 import models
-from auth import derive_password
 from sqlmodel import create_engine
 
 
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait to check out a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = perf_counter() - start
+            with self._wait_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+def _env_flag(key: str, default: bool) -> bool:
+    """Read a true/false optional environment variable."""
+    value = environment.get_optional(key)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@cache
+def pool_settings() -> dict:
+    """Get the connection pool settings, overridable through the environment."""
+    return {
+        "pool_size": int(environment.get_optional("DB_POOL_SIZE", "5")),
+        "max_overflow": int(environment.get_optional("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(environment.get_optional("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(environment.get_optional("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", True),
+        "echo": _env_flag("DB_ECHO", False),
+    }
+
+
 @cache
 def Engine():
     """Get the database engine."""
-    return create_engine(environment.get("DATABASE_URL"), echo=True)
+    return create_engine(
+        environment.get("DATABASE_URL"),
+        poolclass=TimedQueuePool,
+        **pool_settings(),
+    )
+
+
+def pool_stats() -> dict:
+    """Get the current state of the connection pool."""
+    pool = Engine().pool
+    settings = pool_settings()
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": settings["max_overflow"],
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkouts": pool.checkouts,
+        "wait_seconds_total": pool.wait_seconds_total,
+        "wait_seconds_max": pool.wait_seconds_max,
+        "wait_seconds_avg": pool.wait_seconds_total / pool.checkouts if pool.checkouts else 0.0,
+    }
 
 
 def get_session():
     """Get a database session."""
-    return Session(Engine())
+    return Session(Engine(), expire_on_commit=False)
 
 
 def get_db():
-    """Get a database session for use with FastAPI."""
+    """Get a database session for use with FastAPI.
+
+    FastAPI caches dependencies per request, so every dependency and handler
+    that asks for get_db shares this one session and its connection.
+    """
     db = get_session()
     try:
         yield db
@@ -30,73 +103,101 @@ def get_db():
         db.close()
 
 
+def release_connection(session: Session):
+    """Commit a session's work so far and return its pooled connection while the caller waits on slow I/O, such as a model call.
+
+    The session checks out a connection again the next time it is used.
+    """
+    session.commit()
+
+
+@contextmanager
+def unit_of_work(session: Session | None = None):
+    """Reuse the caller's session, or open a private one that commits on exit.
+
+    Helpers given a request session only flush, leaving the single commit to
+    the caller, so one request costs one connection and one transaction.
+    """
+    if session is not None:
+        yield session
+        session.flush()
+        return
+    with get_session() as own_session:
+        try:
+            yield own_session
+            own_session.commit()
+        except Exception:
+            own_session.rollback()
+            raise
+
+
 ### User functions ###
 
 def remove_sensitive_user_data(user: models.User):
     """Remove sensitive data from a user object."""
+    # Detach first so the blanked fields are never written back by a shared session
+    session = object_session(user)
+    if session is not None:
+        session.expunge(user)
     user.password_salt_and_hash = None
     user.login_token = None
     return user
 
 
-def get_user_by_email(email: str, include_sensitive_data: bool = False):
+def get_user_by_email(email: str, include_sensitive_data: bool = False, session: Session | None = None):
     """Get a user by email."""
-    with get_session() as session:
-        user = session.exec(select(models.User).where(models.User.email == email)).first()
+    with unit_of_work(session) as db:
+        user = db.exec(select(models.User).where(models.User.email == email)).first()
         if user and not include_sensitive_data:
             user = remove_sensitive_user_data(user)
         return user
 
 
-def get_user_by_id(user_id: int, include_sensitive_data: bool = False):
+def get_user_by_id(user_id: int, include_sensitive_data: bool = False, session: Session | None = None):
     """Get a user by ID."""
-    with get_session() as session:
-        user = session.exec(select(models.User).where(models.User.id == user_id)).first()
+    with unit_of_work(session) as db:
+        user = db.exec(select(models.User).where(models.User.id == user_id)).first()
         if user and not include_sensitive_data:
             user = remove_sensitive_user_data(user)
         return user
 
 
-def get_user_by_login_token(login_token: str, include_sensitive_data: bool = False):
+def get_user_by_login_token(login_token: str, include_sensitive_data: bool = False, session: Session | None = None):
     """Get a user by login token."""
-    with get_session() as session:
-        user = session.exec(select(models.User).where(models.User.login_token == login_token)).first()
+    with unit_of_work(session) as db:
+        user = db.exec(select(models.User).where(models.User.login_token == login_token)).first()
         if user and not include_sensitive_data:
             user = remove_sensitive_user_data(user)
         return user
 
 
-def create_user(name: str, email: str, password: str):
-    """Create a user."""
+def create_user(name: str, email: str, password_salt_and_hash: str, session: Session | None = None):
+    """Create a user from an already derived password salt and hash."""
     login_token = str(uuid4())
-    user = models.User(name=name, email=email, password_salt_and_hash=derive_password(password), login_token=login_token)
-    with get_session() as session:
-        session.add(user)
-        session.commit()
-        session.refresh(user)
+    user = models.User(name=name, email=email, password_salt_and_hash=password_salt_and_hash, login_token=login_token)
+    with unit_of_work(session) as db:
+        db.add(user)
     return user
 
 
-def add_clothing_item(user_id: int, description: str, size: str, color: str, s3url: str, style: str, brand: str, category: str):
+def add_clothing_item(user_id: int, description: str, size: str, color: str, s3url: str, style: str, brand: str, category: str, session: Session | None = None):
     from models import ClothingItem
 
-    with get_session() as session:
-        item = ClothingItem(
-            user_id=user_id,
-            description=description,
-            size=size,
-            color=color,
-            s3url=s3url,
-            style=style,
-            brand=brand,
-            category=category,
-        )
-        session.add(item)
-        session.commit()
-        session.refresh(item)
-        return item
+    item = ClothingItem(
+        user_id=user_id,
+        description=description,
+        size=size,
+        color=color,
+        s3url=s3url,
+        style=style,
+        brand=brand,
+        category=category,
+    )
+    with unit_of_work(session) as db:
+        db.add(item)
+    return item
     
-def add_outfit(user_id: int, clothing_item_ids: list[int], description: str, s3url: str):
+def add_outfit(user_id: int, clothing_item_ids: list[int], description: str, s3url: str, session: Session | None = None):
     from models import Outfit
 
     outfit = Outfit(
@@ -105,53 +206,120 @@ def add_outfit(user_id: int, clothing_item_ids: list[int], description: str, s3u
         s3url=s3url,
         user_id=user_id,
     )
-    with get_session() as session:
-        
-        session.add(outfit)
-        session.commit()
-        session.refresh(outfit)
-        return outfit
-
-def add_outfit_item(outfit_id: int, clothing_item_id: str):
+    with unit_of_work(session) as db:
+        db.add(outfit)
+    return outfit
+
+def add_outfit_item(outfit_id: int, clothing_item_id: str, session: Session | None = None):
     from models import OutfitItem
     outfit_item = OutfitItem(
         outfit_id=outfit_id,
         clothing_item_id=clothing_item_id
     )
 
-    with get_session() as session:
-        session.add(outfit_item)
-        session.commit()
-        return outfit_item
+    with unit_of_work(session) as db:
+        db.add(outfit_item)
+    return outfit_item
 
-def mark_clothing_item_worn(clothing_item_id: str):
+def mark_clothing_item_worn(clothing_item_id: str, session: Session | None = None):
     from models import ClothingItem
-    with get_session() as session:
-        clothing_item = session.exec(select(ClothingItem).where(ClothingItem.id == clothing_item_id)).first()
+    with unit_of_work(session) as db:
+        clothing_item = db.exec(select(ClothingItem).where(ClothingItem.id == clothing_item_id)).first()
         clothing_item.worn = True
-        session.add(clothing_item)
-        session.commit()
-        return clothing_item
+        db.add(clothing_item)
+    return clothing_item
+
+def create_outfit_with_items(user_id: int, description: str, s3url: str, clothing_item_ids: list[int], session: Session | None = None) -> models.Outfit:
+    """Create an outfit with its items and mark the items worn, all in one transaction.
+
+    The OutfitItem rows go in with one multi-row INSERT and the worn flags
+    with one UPDATE, instead of a commit per row.
+    """
+    from models import ClothingItem, Outfit, OutfitItem
+
+    outfit = Outfit(
+        description=description,
+        s3url=s3url,
+        user_id=user_id,
+    )
+    with unit_of_work(session) as db:
+        db.add(outfit)
+        db.flush()
+        if clothing_item_ids:
+            db.execute(insert(OutfitItem), [
+                {"id": models.make_id(), "outfit_id": outfit.id, "clothing_item_id": clothing_item_id}
+                for clothing_item_id in clothing_item_ids
+            ])
+            db.execute(
+                update(ClothingItem)
+                .where(ClothingItem.id.in_(clothing_item_ids))
+                .values(worn=True, last_worn=datetime.utcnow())
+            )
+            refresh_outfit_attributes([outfit.id], session=db)
+    return outfit
+
+def get_outfit_ids_containing(clothing_item_ids: list[int], session: Session | None = None) -> list[int]:
+    """Get the IDs of every outfit that contains any of the given clothing items."""
+    from models import OutfitItem
+    if not clothing_item_ids:
+        return []
+    with unit_of_work(session) as db:
+        return list(db.exec(
+            select(OutfitItem.outfit_id).where(OutfitItem.clothing_item_id.in_(clothing_item_ids)).distinct()
+        ).all())
+
+def refresh_outfit_attributes(outfit_ids: list[int], session: Session | None = None):
+    """Rebuild the OutfitAttribute rows of outfits from their current items.
 
-def get_clothing_item_by_id(clothing_item_id: str):
+    Call this in the same transaction as any change to an outfit's items or
+    to the fields of an item that is in an outfit.
+    """
+    from models import OUTFIT_ATTRIBUTE_FIELDS, ClothingItem, Outfit, OutfitAttribute, OutfitItem
+    if not outfit_ids:
+        return
+    with unit_of_work(session) as db:
+        db.execute(delete(OutfitAttribute).where(OutfitAttribute.outfit_id.in_(outfit_ids)))
+        rows = db.exec(
+            select(Outfit.id, Outfit.user_id, *(getattr(ClothingItem, field) for field in OUTFIT_ATTRIBUTE_FIELDS))
+            .join(OutfitItem, OutfitItem.outfit_id == Outfit.id)
+            .join(ClothingItem, ClothingItem.id == OutfitItem.clothing_item_id)
+            .where(Outfit.id.in_(outfit_ids))
+        ).all()
+        attributes = {}
+        for outfit_id, user_id, *values in rows:
+            for field, value in zip(OUTFIT_ATTRIBUTE_FIELDS, values):
+                if value is not None and value != "":
+                    attributes[(outfit_id, field, value)] = user_id
+        if attributes:
+            db.execute(insert(OutfitAttribute), [
+                {"outfit_id": outfit_id, "field": field, "value": value, "user_id": user_id}
+                for (outfit_id, field, value), user_id in attributes.items()
+            ])
+
+def get_clothing_item_by_id(clothing_item_id: str, session: Session | None = None):
     from models import ClothingItem
-    with get_session() as session:
-        clothing_item = session.exec(select(ClothingItem).where(ClothingItem.id == clothing_item_id)).first()
+    with unit_of_work(session) as db:
+        clothing_item = db.exec(select(ClothingItem).where(ClothingItem.id == clothing_item_id)).first()
         return clothing_item
     
-def add_user_selfie(user_id: int, image_url: str, description: str) -> models.UserSelfie:
+def get_user_clothing_items_by_ids(user_id: int, clothing_item_ids: list[int], session: Session | None = None) -> list[models.ClothingItem]:
+    """Get the clothing items with the given IDs that belong to a user, in one query."""
+    from models import ClothingItem
+    if not clothing_item_ids:
+        return []
+    with unit_of_work(session) as db:
+        return list(db.exec(select(ClothingItem).where(
+            ClothingItem.user_id == user_id,
+            ClothingItem.id.in_(clothing_item_ids),
+        )).all())
+    
+def add_user_selfie(user_id: int, image_url: str, description: str, session: Session | None = None) -> models.UserSelfie:
     """Adds a new selfie record to the database."""
     user_selfie = models.UserSelfie(
         user_id=user_id,
         image_url=image_url,
         description=description,
     )
-    with get_session() as session:
-        try:
-            session.add(user_selfie)
-            session.commit()
-            session.refresh(user_selfie)
-            return user_selfie
-        except Exception as e:
-            session.rollback()
-            raise
+    with unit_of_work(session) as db:
+        db.add(user_selfie)
+    return user_selfie
@@ -0,0 +1,50 @@
+"""Text embeddings shared by the vector stores.
+
+This is the same ONNX MiniLM model Chroma's clients use by default, so
+vectors computed here are interchangeable with the ones Chroma computes.
+
+Search queries repeat a lot ("black jeans", "jacket"), so their embeddings
+are cached by exact text and a repeated query skips the model entirely.
+"""
+
+from functools import cache
+
+import numpy as np
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+import constants
+from caching import CountingTTLCache
+
+# Query text -> embedding vector
+query_cache = CountingTTLCache(
+    maxsize=constants.QUERY_EMBEDDING_CACHE_MAX_SIZE,
+    ttl=constants.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+)
+
+
+@cache
+def embedding_function():
+    """Get the embedding function, loading the model on first use."""
+    return DefaultEmbeddingFunction()
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Embed texts into a (len(texts), dim) float32 matrix."""
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(embedding_function()(texts), dtype=np.float32)
+
+
+def embed_queries(texts: list[str]) -> np.ndarray:
+    """Embed search queries, running the model only for texts not in the cache."""
+    vectors = {text: query_cache.get(text) for text in dict.fromkeys(texts)}
+    missing = [text for text, vector in vectors.items() if vector is None]
+    if missing:
+        for text, vector in zip(missing, embed(missing)):
+            # Cached vectors are shared between requests, so keep them read-only
+            vector.flags.writeable = False
+            query_cache.set(text, vector)
+            vectors[text] = vector
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([vectors[text] for text in texts])
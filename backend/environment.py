@@ -15,6 +15,13 @@ def get(key: str) -> str:
         raise KeyError(f"Environment variable is not declared in .env.template: {key}")
     return env[key]
 
+def get_optional(key: str, default: str | None = None) -> str | None:
+    """
+    Get the value of an optional environment variable, which does not need to be declared in .env.template.
+    """
+    __Environment()
+    return os.environ.get(key, default)
+
 def reload() -> None:
     """
     Reload the environment variables from the .env file.
@@ -0,0 +1,70 @@
+"""Distinct values and counts of closet fields, for the filter sidebar.
+
+All fields are counted in one GROUP BY over their combined values, and the
+per-field counts are summed up in Python. CockroachDB has no GROUPING SETS,
+and a closet has far fewer distinct combinations than items.
+
+Results are cached per user and closet version. Anything that creates,
+updates or deletes a clothing item must call invalidate_facets for its owner
+in the same transaction. That bumps User.closet_version, so every process
+stops using its cached counts at once.
+"""
+
+from sqlmodel import Session, func, select, update
+
+import constants
+from caching import CountingTTLCache
+from models import ClothingItem, User
+
+FACET_FIELDS = ("category", "brand", "size", "color", "style")
+
+# (user ID, closet version) -> facet counts
+facet_cache = CountingTTLCache(
+    maxsize=constants.FACET_CACHE_MAX_SIZE,
+    ttl=constants.FACET_CACHE_TTL_SECONDS,
+)
+
+
+def count_facets(user_id: int, session: Session) -> dict[str, list[dict]]:
+    """Count the items with each distinct value of every facet field, most common first."""
+    columns = [getattr(ClothingItem, field) for field in FACET_FIELDS]
+    rows = session.exec(
+        select(*columns, func.count()).where(ClothingItem.user_id == user_id).group_by(*columns)
+    ).all()
+
+    counts: dict[str, dict[str, int]] = {field: {} for field in FACET_FIELDS}
+    for row in rows:
+        *values, count = row
+        for field, value in zip(FACET_FIELDS, values):
+            # Empty values are not useful filters
+            if value is not None and value != "":
+                counts[field][value] = counts[field].get(value, 0) + count
+
+    return {
+        field: [
+            {"value": value, "count": count}
+            for value, count in sorted(values.items(), key=lambda item: (-item[1], item[0]))
+        ]
+        for field, values in counts.items()
+    }
+
+
+def get_facets(user_id: int, session: Session) -> dict[str, list[dict]]:
+    """Get a user's facet counts, from the cache when its closet has not changed since."""
+    closet_version = session.exec(select(User.closet_version).where(User.id == user_id)).first()
+    key = (user_id, closet_version)
+    facets = facet_cache.get(key)
+    if facets is None:
+        facets = count_facets(user_id, session)
+        facet_cache.set(key, facets)
+    return facets
+
+
+def invalidate_facets(user_id: int, session: Session):
+    """Make every process recount a user's facets, once the caller commits."""
+    session.exec(update(User).where(User.id == user_id).values(closet_version=User.closet_version + 1))
+
+
+def clear_facets(session: Session):
+    """Make every process recount every user's facets, once the caller commits."""
+    session.exec(update(User).values(closet_version=User.closet_version + 1))
@@ -0,0 +1,212 @@
+"""Snowflake-style primary key generation.
+
+An ID packs a millisecond timestamp, a worker ID and a per-millisecond
+sequence number, so IDs from different processes never collide and one
+process can issue up to 32 IDs per millisecond.
+
+The layout fits in 53 bits so that IDs stay exact as JavaScript numbers:
+
+    | 40 bits: ms since EPOCH_MS | 8 bits: worker | 5 bits: sequence |
+
+40 bits of milliseconds last until 2059.
+
+Each process needs a worker ID no other running process holds. Set
+ID_WORKER_ID to assign one by hand; otherwise the process leases a free one
+from the IdWorkerLease table and renews the lease in the background.
+"""
+
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+import environment
+
+EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+TIMESTAMP_BITS = 40
+WORKER_BITS = 8
+SEQUENCE_BITS = 5
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+WORKER_LEASE_SECONDS = 600
+WORKER_LEASE_RENEW_SECONDS = 60
+
+
+def configured_worker_id() -> int | None:
+    """Get the worker ID set in ID_WORKER_ID, if any."""
+    configured = environment.get_optional("ID_WORKER_ID")
+    if configured is None:
+        return None
+    worker_id = int(configured)
+    if not 0 <= worker_id <= MAX_WORKER_ID:
+        raise ValueError(f"ID_WORKER_ID must be between 0 and {MAX_WORKER_ID}.")
+    return worker_id
+
+
+class WorkerLease:
+    """A worker ID leased from the database and renewed while the process runs."""
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.lost = False
+        self.worker_id = self._claim()
+        self._stop = Event()
+        Thread(target=self._renew, daemon=True).start()
+
+    def _claim(self) -> int:
+        # Imported here because models imports this module
+        from sqlalchemy.exc import IntegrityError
+        from sqlmodel import select, update
+
+        import database
+        from models import IdWorkerLease
+
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=WORKER_LEASE_SECONDS)
+        with database.get_session() as session:
+            leases = {lease.worker_id: lease for lease in session.exec(select(IdWorkerLease)).all()}
+            for worker_id in range(MAX_WORKER_ID + 1):
+                lease = leases.get(worker_id)
+                if lease is None:
+                    session.add(IdWorkerLease(worker_id=worker_id, owner=self.owner, expires_at=expires_at))
+                    try:
+                        session.commit()
+                        return worker_id
+                    except IntegrityError:
+                        # Another process claimed it first
+                        session.rollback()
+                elif lease.expires_at < now:
+                    # Take over an expired lease, unless another process just did
+                    claimed = session.exec(
+                        update(IdWorkerLease)
+                        .where(IdWorkerLease.worker_id == worker_id, IdWorkerLease.owner == lease.owner)
+                        .values(owner=self.owner, expires_at=expires_at)
+                    )
+                    session.commit()
+                    if claimed.rowcount == 1:
+                        return worker_id
+        raise RuntimeError(f"All {MAX_WORKER_ID + 1} ID worker IDs are leased.")
+
+    def _renew(self):
+        from sqlmodel import update
+
+        import database
+        from models import IdWorkerLease
+
+        while not self._stop.wait(WORKER_LEASE_RENEW_SECONDS):
+            try:
+                with database.get_session() as session:
+                    renewed = session.exec(
+                        update(IdWorkerLease)
+                        .where(IdWorkerLease.worker_id == self.worker_id, IdWorkerLease.owner == self.owner)
+                        .values(expires_at=datetime.utcnow() + timedelta(seconds=WORKER_LEASE_SECONDS))
+                    )
+                    session.commit()
+            except Exception as e:
+                # Retried on the next tick, well before the lease expires
+                print(f"Could not renew ID worker lease {self.worker_id}: {e}")
+                continue
+            if renewed.rowcount != 1:
+                self.lost = True
+                return
+
+    def release(self):
+        """Stop renewing the lease and free the worker ID for other processes."""
+        from sqlmodel import delete
+
+        import database
+        from models import IdWorkerLease
+
+        self._stop.set()
+        with database.get_session() as session:
+            session.exec(delete(IdWorkerLease).where(IdWorkerLease.worker_id == self.worker_id, IdWorkerLease.owner == self.owner))
+            session.commit()
+
+
+class IdGenerator:
+    """Thread-safe generator of Snowflake-style IDs."""
+
+    def __init__(self, worker_id: int | None = None):
+        self._lock = Lock()
+        self._fixed_worker_id = worker_id
+        self._reset()
+
+    def _reset(self):
+        # Forked children must not continue their parent's sequence or share its worker ID
+        self._pid = os.getpid()
+        self._lease: WorkerLease | None = None
+        self.worker_id = self._fixed_worker_id if self._fixed_worker_id is not None else configured_worker_id()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def release(self):
+        """Give up this generator's leased worker ID, if it has one."""
+        with self._lock:
+            if self._lease is not None and self._pid == os.getpid():
+                self._lease.release()
+                self._lease = None
+                self.worker_id = self._fixed_worker_id if self._fixed_worker_id is not None else configured_worker_id()
+
+    def next_id(self) -> int:
+        """Get the next ID."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            if self.worker_id is None or (self._lease is not None and self._lease.lost):
+                self._lease = WorkerLease()
+                self.worker_id = self._lease.worker_id
+
+            now = _now_ms()
+            # Never reuse a timestamp if the clock steps backwards
+            while now < self._last_ms:
+                time.sleep((self._last_ms - now) / 1000)
+                now = _now_ms()
+
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond, wait for the next one
+                    while now <= self._last_ms:
+                        now = _now_ms()
+            else:
+                self._sequence = 0
+            self._last_ms = now
+
+            return (
+                (now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)
+                | self.worker_id << SEQUENCE_BITS
+                | self._sequence
+            )
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+_generator: IdGenerator | None = None
+_generator_lock = Lock()
+
+
+def get_generator() -> IdGenerator:
+    """Get the process-wide ID generator, creating it on first use."""
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = IdGenerator()
+    return _generator
+
+
+def next_id() -> int:
+    """Get the next ID from the process-wide generator."""
+    return get_generator().next_id()
+
+
+def release_worker_id():
+    """Free the process-wide generator's leased worker ID on shutdown."""
+    if _generator is not None:
+        _generator.release()
@@ -0,0 +1,99 @@
+"""Downscaled copies of uploaded photos for the vision model.
+
+Phone photos are several megabytes and often rotated only through EXIF. The
+model needs far less, so each upload gets a derivative that is upright,
+no larger than VISION_MAX_DIMENSION pixels on its longest side and
+re-encoded as VISION_IMAGE_FORMAT (JPEG or WEBP). The model is sent the
+derivative; the original is kept for display.
+
+Decoding and resizing are CPU bound, so they run in a process pool.
+"""
+
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import environment
+
+VISION_MAX_DIMENSION_DEFAULT = 1024
+VISION_IMAGE_FORMAT_DEFAULT = "JPEG"
+VISION_IMAGE_QUALITY = 85
+IMAGE_MAX_WORKERS_DEFAULT = 2
+
+# Output format -> (file extension, content type)
+IMAGE_FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+
+_executor: ProcessPoolExecutor | None = None
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload cannot be decoded as an image."""
+
+
+class VisionImage(NamedTuple):
+    data: bytes
+    extension: str
+    content_type: str
+    width: int
+    height: int
+
+
+def prepare_vision_image(data: bytes, max_dimension: int, image_format: str, quality: int = VISION_IMAGE_QUALITY) -> VisionImage:
+    """Rotate an image upright, shrink it to fit max_dimension and re-encode it."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        # JPEG has no alpha channel, and palette images resize poorly
+        image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise InvalidImageError(str(e))
+
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality, optimize=True)
+    extension, content_type = IMAGE_FORMATS[image_format]
+    return VisionImage(output.getvalue(), extension, content_type, image.width, image.height)
+
+
+def vision_settings() -> tuple[int, str]:
+    """Get the configured max dimension and output format of derivatives."""
+    max_dimension = int(environment.get_optional("VISION_MAX_DIMENSION", VISION_MAX_DIMENSION_DEFAULT))
+    image_format = environment.get_optional("VISION_IMAGE_FORMAT", VISION_IMAGE_FORMAT_DEFAULT).upper()
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"VISION_IMAGE_FORMAT must be one of {', '.join(IMAGE_FORMATS)}, not {image_format}.")
+    return max_dimension, image_format
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Get the process pool used for image processing, creating it on first use."""
+    global _executor
+    if _executor is None:
+        # The server is multi-threaded by now, and a forked child could inherit a held lock
+        _executor = ProcessPoolExecutor(
+            max_workers=int(environment.get_optional("IMAGE_MAX_WORKERS", IMAGE_MAX_WORKERS_DEFAULT)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Shut down the image processing process pool."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def make_vision_image(data: bytes) -> VisionImage:
+    """Prepare the vision model's copy of an uploaded image in the process pool."""
+    max_dimension, image_format = vision_settings()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), prepare_vision_image, data, max_dimension, image_format
+    )
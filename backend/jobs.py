@@ -0,0 +1,245 @@
+"""Background processing of uploaded photos.
+
+Parsing a photo takes longer than Heroku's 30 second router timeout allows,
+so upload routes store the image, record an UploadJob and return at once.
+A bounded pool of worker tasks then runs the job's handler off the event
+loop, and clients poll GET /jobs/{id} for the result.
+
+The broker is in-process: an asyncio queue of job IDs. Job state lives in
+the database, and the queue polls it every JOB_POLL_SECONDS for queued jobs
+it does not hold, so jobs left over from a restart or a backlog larger than
+the queue still run. A job is claimed atomically so it never runs twice.
+"""
+
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, update
+
+import database
+import environment
+import upload_pipeline
+from clients import ClientRegistry, get_registry
+from models import ClothingItem, UploadJob
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+JOB_CONCURRENCY_DEFAULT = 4
+JOB_QUEUE_SIZE_DEFAULT = 256
+# A job still running after this long was abandoned by a crashed worker
+JOB_STALE_AFTER = timedelta(minutes=10)
+JOB_POLL_SECONDS_DEFAULT = 5
+
+
+def process_clothing_job(clients: ClientRegistry, job: UploadJob, session: Session) -> list[dict]:
+    return upload_pipeline.process_clothing_upload(clients, job.user_id, job.s3_url, session, vision_url=job.vision_url)
+
+
+# Job kind -> function that does the work and returns a JSON-serializable result
+JOB_HANDLERS = {
+    "clothing": process_clothing_job,
+}
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue cannot accept more work."""
+
+
+def create_job(user_id: int, kind: str, s3_url: str, session: Session, vision_url: str | None = None) -> UploadJob:
+    """Record a new queued job."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = UploadJob(user_id=user_id, kind=kind, s3_url=s3_url, vision_url=vision_url, status=JOB_QUEUED)
+    session.add(job)
+    session.commit()
+    return job
+
+
+def fail_job(job_id: int, error: str, session: Session):
+    """Mark a job that will not run as failed."""
+    session.exec(
+        update(UploadJob)
+        .where(UploadJob.id == job_id)
+        .values(status=JOB_FAILED, error=error, updated_at=datetime.utcnow())
+    )
+    session.commit()
+
+
+def find_reusable_job(user_id: int, kind: str, s3_url: str, session: Session) -> UploadJob | None:
+    """Get a user's earlier job for the same image whose work still stands, if there is one.
+
+    A failed job is not reused, and neither is a finished clothing job whose
+    items have all been deleted since.
+    """
+    job = session.exec(
+        select(UploadJob)
+        .where(UploadJob.s3_url == s3_url, UploadJob.user_id == user_id, UploadJob.kind == kind, UploadJob.status != JOB_FAILED)
+        .order_by(UploadJob.created_at.desc())
+        .limit(1)
+    ).first()
+    if job is None:
+        return None
+    if job.status == JOB_SUCCEEDED and kind == "clothing":
+        items_left = session.exec(
+            select(ClothingItem.id).where(ClothingItem.s3url == s3_url, ClothingItem.user_id == user_id).limit(1)
+        ).first()
+        if items_left is None:
+            return None
+    return job
+
+
+def run_job(job_id: int, clients: ClientRegistry | None = None) -> bool:
+    """Claim a queued job and run it to completion. Returns False if it was not claimable."""
+    clients = clients or get_registry()
+    with database.get_session() as session:
+        claimed = session.exec(
+            update(UploadJob)
+            .where(UploadJob.id == job_id, UploadJob.status == JOB_QUEUED)
+            .values(status=JOB_RUNNING, attempts=UploadJob.attempts + 1, updated_at=datetime.utcnow())
+        )
+        session.commit()
+        if claimed.rowcount != 1:
+            return False
+
+        job = session.get(UploadJob, job_id)
+        try:
+            result = JOB_HANDLERS[job.kind](clients, job, session)
+        except Exception as e:
+            session.rollback()
+            job = session.get(UploadJob, job_id)
+            job.status = JOB_FAILED
+            job.error = str(e)
+        else:
+            job.status = JOB_SUCCEEDED
+            job.result = json.dumps(result)
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+        return True
+
+
+def recover_jobs(limit: int) -> list[int]:
+    """Requeue stale running jobs and get the IDs of the oldest jobs waiting to run."""
+    with database.get_session() as session:
+        session.exec(
+            update(UploadJob)
+            .where(UploadJob.status == JOB_RUNNING, UploadJob.updated_at < datetime.utcnow() - JOB_STALE_AFTER)
+            .values(status=JOB_QUEUED, updated_at=datetime.utcnow())
+        )
+        session.commit()
+        return list(session.exec(
+            select(UploadJob.id).where(UploadJob.status == JOB_QUEUED).order_by(UploadJob.created_at).limit(limit)
+        ).all())
+
+
+class JobQueue:
+    """An in-process broker drained by a fixed number of worker tasks."""
+
+    def __init__(self, concurrency: int, max_size: int, clients: ClientRegistry | None = None, poll_seconds: float = JOB_POLL_SECONDS_DEFAULT):
+        self.concurrency = concurrency
+        self.clients = clients
+        self.poll_seconds = poll_seconds
+        self._queue: asyncio.Queue[int] = asyncio.Queue(maxsize=max_size)
+        # IDs in the queue, so polling does not queue a job twice
+        self._queued_ids: set[int] = set()
+        self._workers: list[asyncio.Task] = []
+        self._poller: asyncio.Task | None = None
+
+    async def start(self, recover: bool = True):
+        """Start the workers, and unless recover is False, the task polling the database for queued jobs."""
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        if recover:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Stop the workers. Jobs still queued stay queued in the database."""
+        tasks = self._workers + ([self._poller] if self._poller else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._poller = None
+
+    def full(self) -> bool:
+        """Check whether the queue has room for another job."""
+        return self._queue.full()
+
+    def submit(self, job_id: int):
+        """Queue a job for the workers."""
+        if job_id in self._queued_ids:
+            return
+        try:
+            self._queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            raise JobQueueFullError("The upload queue is full.")
+        self._queued_ids.add(job_id)
+
+    async def join(self):
+        """Wait until every queued job has been processed."""
+        await self._queue.join()
+
+    def stats(self) -> dict:
+        """Get the current depth of the queue."""
+        return {
+            "queued": self._queue.qsize(),
+            "max_queued": self._queue.maxsize,
+            "workers": len(self._workers),
+        }
+
+    async def _work(self):
+        while True:
+            job_id = await self._queue.get()
+            self._queued_ids.discard(job_id)
+            try:
+                await run_in_threadpool(run_job, job_id, self.clients)
+            except Exception as e:
+                print(f"Upload job {job_id} crashed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _poll(self):
+        while True:
+            try:
+                room = self._queue.maxsize - self._queue.qsize()
+                if room > 0:
+                    # Jobs already queued here come back too, so ask for enough to fill the room
+                    for job_id in await run_in_threadpool(recover_jobs, room + len(self._queued_ids)):
+                        if self._queue.full():
+                            break
+                        self.submit(job_id)
+            except Exception as e:
+                print(f"Polling for upload jobs failed: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+
+_queue: JobQueue | None = None
+
+
+def get_queue() -> JobQueue:
+    """Get the process-wide job queue, creating it on first use."""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(
+            concurrency=int(environment.get_optional("UPLOAD_JOB_CONCURRENCY", JOB_CONCURRENCY_DEFAULT)),
+            max_size=int(environment.get_optional("UPLOAD_JOB_QUEUE_SIZE", JOB_QUEUE_SIZE_DEFAULT)),
+            poll_seconds=float(environment.get_optional("UPLOAD_JOB_POLL_SECONDS", JOB_POLL_SECONDS_DEFAULT)),
+        )
+    return _queue
+
+
+async def start_queue():
+    """Start the process-wide job queue."""
+    await get_queue().start()
+
+
+async def stop_queue():
+    """Stop the process-wide job queue."""
+    global _queue
+    if _queue is not None:
+        await _queue.stop()
+        _queue = None
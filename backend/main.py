@@ -1,16 +1,37 @@
 """FitCheck Backend Main - Called on startup"""
 
 
+from contextlib import asynccontextmanager
+
+import auth
+import clients
 import environment
+import ids
+import image_processing
+import jobs
 
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pagination import NEXT_CURSOR_HEADER
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up and tear down process-wide resources."""
+    clients.get_registry()
+    await jobs.start_queue()
+    yield
+    await jobs.stop_queue()
+    auth.shutdown_executor()
+    image_processing.shutdown_executor()
+    clients.close_registry()
+    ids.release_worker_id()
 
 # Start FastAPI app
 app = FastAPI(
     title="FitCheck API Docs",
-    version="0.3"
+    version="0.3",
+    lifespan=lifespan,
 )
 
 # CORS configuration
@@ -24,9 +45,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
-from routes import login, user, clothing_item, outfit, resale_listing, wear_history, images, filter, facebookAPI, ebayAPI, outfit_wear_history
+from routes import login, user, clothing_item, outfit, resale_listing, wear_history, images, filter, facebookAPI, ebayAPI, outfit_wear_history, metrics, upload_job
 # Include routes
 app.include_router(login.router)
 app.include_router(user.router)
@@ -39,6 +61,8 @@ app.include_router(images.router)
 app.include_router(filter.router)
 app.include_router(facebookAPI.router)
 app.include_router(ebayAPI.router)
+app.include_router(metrics.router)
+app.include_router(upload_job.router)
 
 @app.get("/")
 def get_root():
@@ -0,0 +1,321 @@
+"""Versioned, additive schema migrations for a live database.
+
+models.py can only drop and recreate every table. The migrations here apply
+changes in place, and each one is recorded in the schema_migrations table so
+it runs once.
+
+Run this file directly:
+
+    python migrations.py upgrade   # apply pending migrations
+    python migrations.py status    # list applied and pending migrations
+    python migrations.py check     # report hot queries that still do full scans
+"""
+
+import sys
+from datetime import datetime
+from typing import Callable, NamedTuple
+
+from sqlalchemy import Connection, Engine, inspect, text
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Register a function as the upgrade step of a migration."""
+    def register(upgrade: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return upgrade
+    return register
+
+
+def create_index(connection: Connection, name: str, table: str, columns: list[str]):
+    """Create an index unless it already exists."""
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({", ".join(columns)})'))
+
+
+def add_column(connection: Connection, table: str, column: str, definition: str):
+    """Add a column unless it already exists."""
+    if column not in {c["name"] for c in inspect(connection).get_columns(table)}:
+        connection.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+
+
+##### Migrations #####
+# Never edit a migration once it has shipped; add a new one instead.
+# Migrations also run right after a reset, so they must be idempotent.
+
+@migration(1, "Indexes on hot lookup columns")
+def add_lookup_indexes(connection: Connection):
+    create_index(connection, "ix_user_login_token", "user", ["login_token"])
+    create_index(connection, "ix_clothingitem_user_id_created_at", "clothingitem", ["user_id", "created_at", "id"])
+    create_index(connection, "ix_outfit_user_id_created_at", "outfit", ["user_id", "created_at", "id"])
+    create_index(connection, "ix_outfititem_outfit_id_clothing_item_id", "outfititem", ["outfit_id", "clothing_item_id"])
+    create_index(connection, "ix_outfititem_clothing_item_id_outfit_id", "outfititem", ["clothing_item_id", "outfit_id"])
+    create_index(connection, "ix_resalelisting_clothing_item_id", "resalelisting", ["clothing_item_id"])
+    create_index(connection, "ix_outfitwearhistory_outfit_id_date", "outfitwearhistory", ["outfit_id", "date"])
+
+
+@migration(2, "Background upload jobs")
+def add_upload_jobs(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS uploadjob ("
+        "id BIGINT PRIMARY KEY, "
+        'user_id BIGINT NOT NULL REFERENCES "user" (id), '
+        "kind VARCHAR NOT NULL, "
+        "status VARCHAR NOT NULL, "
+        "s3_url VARCHAR NOT NULL, "
+        "result VARCHAR, "
+        "error VARCHAR, "
+        "attempts INTEGER NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "updated_at TIMESTAMP NOT NULL)"
+    ))
+    create_index(connection, "ix_uploadjob_status_updated_at", "uploadjob", ["status", "updated_at"])
+
+
+@migration(3, "Trigram indexes for lexical search")
+def add_trigram_indexes(connection: Connection):
+    dialect = connection.dialect.name
+    if dialect == "cockroachdb":
+        # Prefixing user_id keeps each lookup inside one user's closet
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_clothingitem_user_id_description_trgm ON clothingitem USING GIN (user_id, description gin_trgm_ops)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_outfit_user_id_description_trgm ON outfit USING GIN (user_id, description gin_trgm_ops)"))
+    elif dialect == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_clothingitem_description_trgm ON clothingitem USING GIN (description gin_trgm_ops)"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_outfit_description_trgm ON outfit USING GIN (description gin_trgm_ops)"))
+    # Other databases fall back to the per-user index and a filtered scan
+
+
+@migration(4, "Indexes for keyset pagination")
+def add_pagination_indexes(connection: Connection):
+    create_index(connection, "ix_userselfie_user_id_created_at", "userselfie", ["user_id", "created_at", "id"])
+    create_index(connection, "ix_outfitwearhistory_date_id", "outfitwearhistory", ["date", "id"])
+
+
+@migration(5, "Outfit attribute summary for outfit filters")
+def add_outfit_attributes(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS outfitattribute ("
+        "outfit_id BIGINT NOT NULL REFERENCES outfit (id), "
+        "field VARCHAR NOT NULL, "
+        "value VARCHAR NOT NULL, "
+        'user_id BIGINT NOT NULL REFERENCES "user" (id), '
+        "PRIMARY KEY (outfit_id, field, value))"
+    ))
+    create_index(connection, "ix_outfitattribute_user_id_field_value", "outfitattribute", ["user_id", "field", "value", "outfit_id"])
+    # Backfill from the outfits that already exist
+    for field in ("category", "brand", "size", "color", "style"):
+        connection.execute(text(
+            "INSERT INTO outfitattribute (outfit_id, field, value, user_id) "
+            f"SELECT DISTINCT outfit.id, '{field}', clothingitem.{field}, outfit.user_id "
+            "FROM outfit "
+            "JOIN outfititem ON outfititem.outfit_id = outfit.id "
+            "JOIN clothingitem ON clothingitem.id = outfititem.clothing_item_id "
+            f"WHERE clothingitem.{field} IS NOT NULL AND clothingitem.{field} <> '' "
+            "ON CONFLICT DO NOTHING"
+        ))
+
+
+@migration(6, "Downscaled photo URL on upload jobs")
+def add_upload_job_vision_url(connection: Connection):
+    add_column(connection, "uploadjob", "vision_url", "VARCHAR")
+
+
+@migration(7, "Content-addressed image index")
+def add_stored_images(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS storedimage ("
+        "digest VARCHAR PRIMARY KEY, "
+        "s3_url VARCHAR NOT NULL, "
+        "vision_url VARCHAR, "
+        "size INTEGER NOT NULL, "
+        "created_at TIMESTAMP NOT NULL)"
+    ))
+    # Finding earlier uploads of an image, and whether anything still uses it
+    create_index(connection, "ix_clothingitem_s3url", "clothingitem", ["s3url"])
+    create_index(connection, "ix_outfit_s3url", "outfit", ["s3url"])
+    create_index(connection, "ix_userselfie_image_url", "userselfie", ["image_url"])
+    create_index(connection, "ix_uploadjob_s3_url", "uploadjob", ["s3_url"])
+
+
+@migration(8, "Vision parse result cache")
+def add_parse_cache(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS parsecacheentry ("
+        "digest VARCHAR NOT NULL, "
+        "model VARCHAR NOT NULL, "
+        "prompt_version VARCHAR NOT NULL, "
+        "result VARCHAR NOT NULL, "
+        "created_at TIMESTAMP NOT NULL, "
+        "last_used_at TIMESTAMP NOT NULL, "
+        "PRIMARY KEY (digest, model, prompt_version))"
+    ))
+    # Eviction deletes the least recently used entries
+    create_index(connection, "ix_parsecacheentry_last_used_at", "parsecacheentry", ["last_used_at"])
+
+
+@migration(9, "Leased worker IDs for primary key generation")
+def add_id_worker_leases(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS idworkerlease ("
+        "worker_id INTEGER PRIMARY KEY, "
+        "owner VARCHAR NOT NULL, "
+        "expires_at TIMESTAMP NOT NULL)"
+    ))
+
+
+@migration(10, "Owner on outfit wear history")
+def add_wear_history_user_id(connection: Connection):
+    add_column(connection, "outfitwearhistory", "user_id", 'BIGINT REFERENCES "user" (id)')
+    connection.execute(text(
+        "UPDATE outfitwearhistory SET user_id = "
+        "(SELECT outfit.user_id FROM outfit WHERE outfit.id = outfitwearhistory.outfit_id) "
+        "WHERE user_id IS NULL"
+    ))
+    # Each user's history is paged by (date, id)
+    create_index(connection, "ix_outfitwearhistory_user_id_date_id", "outfitwearhistory", ["user_id", "date", "id"])
+
+
+@migration(11, "Closet version for facet cache invalidation")
+def add_user_closet_version(connection: Connection):
+    add_column(connection, "user", "closet_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+##### Runner #####
+
+def ensure_version_table(connection: Connection):
+    """Create the table that records applied migrations."""
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_versions(engine: Engine) -> set[int]:
+    """Get the versions of every migration already applied."""
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_migrations(engine: Engine) -> list[Migration]:
+    """Get the migrations that have not been applied yet, in order."""
+    applied = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def _record(connection: Connection, m: Migration):
+    connection.execute(
+        text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+        {"version": m.version, "description": m.description, "applied_at": datetime.utcnow()},
+    )
+
+
+def upgrade(engine: Engine) -> list[Migration]:
+    """Apply every pending migration, each in its own transaction."""
+    applied = []
+    for m in pending_migrations(engine):
+        with engine.begin() as connection:
+            m.upgrade(connection)
+            _record(connection, m)
+        applied.append(m)
+    return applied
+
+
+def forget_applied(engine: Engine):
+    """Forget every applied migration, so the next upgrade runs them all again."""
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+
+
+def stamp(engine: Engine):
+    """Mark every migration as applied without running it."""
+    for m in pending_migrations(engine):
+        with engine.begin() as connection:
+            _record(connection, m)
+
+
+##### Full scan check #####
+
+def hot_queries() -> dict:
+    """Get the queries the routes run on every request, keyed by name."""
+    from sqlmodel import select
+    from models import User, ClothingItem, Outfit, OutfitItem, ResaleListing, OutfitWearHistory, UserSelfie, OutfitAttribute
+
+    return {
+        "user by login token": select(User).where(User.login_token == "token"),
+        "closet by user": select(ClothingItem).where(ClothingItem.user_id == 0),
+        "outfits by user": select(Outfit).where(Outfit.user_id == 0),
+        "outfit items by outfit": select(OutfitItem).where(OutfitItem.outfit_id == 0),
+        "outfit items by clothing item": select(OutfitItem).where(OutfitItem.clothing_item_id == 0),
+        "resale listing by clothing item": select(ResaleListing).where(ResaleListing.clothing_item_id == 0),
+        "wear history by outfit": select(OutfitWearHistory).where(OutfitWearHistory.outfit_id == 0),
+        "wear history page by user": select(OutfitWearHistory).where(OutfitWearHistory.user_id == 0).order_by(OutfitWearHistory.date, OutfitWearHistory.id).limit(100),
+        "outfit attributes by user": select(OutfitAttribute.outfit_id).where(OutfitAttribute.user_id == 0, OutfitAttribute.field == "color", OutfitAttribute.value.in_(["blue"])),
+        "selfies by user": select(UserSelfie).where(UserSelfie.user_id == 0),
+        "closet text search": select(ClothingItem).where(ClothingItem.user_id == 0, ClothingItem.description.ilike("%jacket%")),
+    }
+
+
+def _is_full_scan(dialect: str, plan: list[str]) -> bool:
+    if dialect == "sqlite":
+        return any(line.startswith("SCAN ") for line in plan)
+    if dialect == "cockroachdb":
+        return any("FULL SCAN" in line for line in plan)
+    return any("Seq Scan" in line for line in plan)
+
+
+def check_full_scans(engine: Engine) -> dict[str, list[str]]:
+    """EXPLAIN every hot query and return the plans of those doing a full table scan."""
+    dialect = engine.dialect.name
+    explain = "EXPLAIN QUERY PLAN" if dialect == "sqlite" else "EXPLAIN"
+    full_scans = {}
+    with engine.connect() as connection:
+        for name, query in hot_queries().items():
+            sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+            rows = connection.execute(text(f"{explain} {sql}")).all()
+            plan = [str(row[-1]) for row in rows]
+            if _is_full_scan(dialect, plan):
+                full_scans[name] = plan
+    return full_scans
+
+
+if __name__ == "__main__":
+    import database
+
+    engine = database.Engine()
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+
+    if command == "upgrade":
+        applied = upgrade(engine)
+        for m in applied:
+            print(f"Applied migration {m.version}: {m.description}")
+        if not applied:
+            print("Database is up to date.")
+    elif command == "status":
+        applied = applied_versions(engine)
+        for m in MIGRATIONS:
+            print(f"[{'x' if m.version in applied else ' '}] {m.version}: {m.description}")
+    elif command == "check":
+        full_scans = check_full_scans(engine)
+        for name, plan in full_scans.items():
+            print(f"FULL SCAN: {name}")
+            for line in plan:
+                print(f"    {line}")
+        if not full_scans:
+            print("No hot query does a full table scan.")
+        # Postgres may still choose a sequential scan on tiny tables
+        exit(1 if full_scans else 0)
+    else:
+        print(f"Unknown command: {command}. Use upgrade, status or check.")
+        exit(2)
@@ -0,0 +1,233 @@
+"""Shared dispatcher for OpenAI model calls.
+
+Every vision call goes through one ModelDispatcher, which:
+
+    - caps concurrent requests with a semaphore (MODEL_MAX_CONCURRENCY)
+    - spaces requests with a token bucket (MODEL_RATE_PER_SECOND, bursts of
+      MODEL_RATE_BURST)
+    - retries rate limits, timeouts, connection errors and 5xx responses with
+      jittered exponential backoff (up to MODEL_MAX_ATTEMPTS attempts)
+    - gives up after MODEL_DEADLINE_SECONDS, counting waiting, retries and the
+      requests themselves
+
+A call that cannot finish raises ModelUnavailableError, which the routes
+report as 503 instead of 500. Calls are blocking, so they are made from the
+threadpool or the upload job workers.
+
+Point OPENAI_BASE_URL at an OpenAI-compatible server to test against a fake
+endpoint. Run this file directly to load test the dispatcher against a local
+fake that rate limits a share of its requests.
+"""
+
+import time
+from collections import deque
+from threading import BoundedSemaphore, Condition, Lock
+
+import openai
+from tenacity import RetryError, Retrying, retry_if_exception_type, stop_after_attempt, stop_before_delay, wait_random_exponential
+
+import environment
+
+MODEL_MAX_CONCURRENCY_DEFAULT = 8
+MODEL_RATE_PER_SECOND_DEFAULT = 5
+MODEL_RATE_BURST_DEFAULT = 10
+MODEL_MAX_ATTEMPTS_DEFAULT = 4
+MODEL_DEADLINE_SECONDS_DEFAULT = 60
+RETRY_WAIT_MULTIPLIER_SECONDS = 0.5
+RETRY_WAIT_MAX_SECONDS = 10
+# Number of recent calls kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class ModelUnavailableError(Exception):
+    """Raised when a model call cannot complete before its deadline or retry limit."""
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, in bursts of up to capacity."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._condition = Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        """Take a token, waiting up to timeout seconds for one. Returns whether one was taken."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+                if now + wait > deadline:
+                    return False
+                self._condition.wait(wait)
+
+
+class ModelDispatcher:
+    """Runs model calls under a concurrency cap, a rate limit, retries and a deadline."""
+
+    def __init__(self, max_concurrency: int, rate_per_second: float, burst: int, max_attempts: int, deadline_seconds: float):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.deadline_seconds = deadline_seconds
+        self._semaphore = BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(rate_per_second, burst)
+        self._lock = Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._calls = 0
+        self._retries = 0
+        self._failures = 0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def _attempt(self, create, kwargs: dict, deadline: float):
+        with self._lock:
+            self._waiting += 1
+        try:
+            admitted = self._bucket.acquire(deadline - time.monotonic())
+            admitted = admitted and self._semaphore.acquire(timeout=max(deadline - time.monotonic(), 0))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not admitted:
+            raise ModelUnavailableError("Timed out waiting for a model request slot.")
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            # The request itself may not outlive the deadline either
+            return create(**kwargs, timeout=max(deadline - time.monotonic(), 0.1))
+        finally:
+            self._semaphore.release()
+            with self._lock:
+                self._in_flight -= 1
+
+    def call(self, create, **kwargs):
+        """Call create(**kwargs, timeout=...), e.g. client.chat.completions.create, and return its result."""
+        start = time.monotonic()
+        deadline = start + self.deadline_seconds
+        retrying = Retrying(
+            retry=retry_if_exception_type(RETRYABLE_ERRORS),
+            wait=wait_random_exponential(multiplier=RETRY_WAIT_MULTIPLIER_SECONDS, max=RETRY_WAIT_MAX_SECONDS),
+            stop=stop_after_attempt(self.max_attempts) | stop_before_delay(self.deadline_seconds),
+            before_sleep=lambda _: self._count_retry(),
+        )
+        try:
+            return retrying(self._attempt, create, kwargs, deadline)
+        except RetryError as e:
+            with self._lock:
+                self._failures += 1
+            raise ModelUnavailableError(f"The model is unavailable: {e.last_attempt.exception()}")
+        except ModelUnavailableError:
+            with self._lock:
+                self._failures += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls += 1
+                self._latencies.append(time.monotonic() - start)
+
+    def _count_retry(self):
+        with self._lock:
+            self._retries += 1
+
+    def stats(self) -> dict:
+        """Get the queue depth, retry counters and latency percentiles of model calls."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+
+            def percentile(p: float) -> float:
+                return latencies[min(int(p * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+            return {
+                "waiting": self._waiting,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "calls": self._calls,
+                "retries": self._retries,
+                "failures": self._failures,
+                "latency_p50_seconds": percentile(0.5),
+                "latency_p95_seconds": percentile(0.95),
+                "latency_max_seconds": latencies[-1] if latencies else 0.0,
+            }
+
+
+_dispatcher: ModelDispatcher | None = None
+_dispatcher_lock = Lock()
+
+
+def get_dispatcher() -> ModelDispatcher:
+    """Get the process-wide model dispatcher, creating it on first use."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = ModelDispatcher(
+                max_concurrency=int(environment.get_optional("MODEL_MAX_CONCURRENCY", MODEL_MAX_CONCURRENCY_DEFAULT)),
+                rate_per_second=float(environment.get_optional("MODEL_RATE_PER_SECOND", MODEL_RATE_PER_SECOND_DEFAULT)),
+                burst=int(environment.get_optional("MODEL_RATE_BURST", MODEL_RATE_BURST_DEFAULT)),
+                max_attempts=int(environment.get_optional("MODEL_MAX_ATTEMPTS", MODEL_MAX_ATTEMPTS_DEFAULT)),
+                deadline_seconds=float(environment.get_optional("MODEL_DEADLINE_SECONDS", MODEL_DEADLINE_SECONDS_DEFAULT)),
+            )
+        return _dispatcher
+
+
+if __name__ == "__main__":
+    import json
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from threading import Thread
+
+    # A fake chat completions endpoint that rate limits a quarter of its requests
+    class FakeOpenAI(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(0.2)
+            if random.random() < 0.25:
+                status, body = 429, {"error": {"message": "Rate limited", "type": "rate_limit_error"}}
+            else:
+                status, body = 200, {
+                    "id": "fake", "object": "chat.completion", "created": 0, "model": "fake",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "[]"}}],
+                }
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenAI)
+    Thread(target=server.serve_forever, daemon=True).start()
+    client = openai.OpenAI(api_key="fake", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    dispatcher = ModelDispatcher(max_concurrency=4, rate_per_second=20, burst=5, max_attempts=4, deadline_seconds=10)
+
+    def request(_):
+        try:
+            dispatcher.call(client.chat.completions.create, model="fake", messages=[{"role": "user", "content": "hi"}])
+            return True
+        except ModelUnavailableError:
+            return False
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        succeeded = sum(pool.map(request, range(100)))
+    server.shutdown()
+    print(f"{succeeded}/100 calls succeeded")
+    print(json.dumps(dispatcher.stats(), indent=2))
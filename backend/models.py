@@ -1,15 +1,19 @@
 """SQLmodel ORM models for the database.
 
 Run this file directly to reset the database.
+Use migrations.py to apply changes to a live database instead.
 """
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship, create_engine
 from typing import Optional, List
 from datetime import datetime
-import time
+
+import ids
 
 def make_id():
-    return int(time.time() * 10)
+    """Get a new collision-free primary key."""
+    return ids.next_id()
 
 ##### User #####
 
@@ -28,17 +32,31 @@ class UserPublicFull(UserPublic):
     outfits: List["Outfit"] = []
     resale_listings: List["ResaleListing"] = []
 
+class UserPublicSelected(UserPublic):
+    """A user with only the relationships asked for, or only their counts.
+
+    Relationships that were not asked for are left out of the response.
+    """
+    clothing_items: Optional[List["ClothingItem"]] = None
+    outfits: Optional[List["Outfit"]] = None
+    resale_listings: Optional[List["ResaleListing"]] = None
+    counts: Optional[dict[str, int]] = None
+
 class UserUpdate(UserBase):
     """Model for updating an existing user."""
     name: Optional[str] = None
 
 class User(UserBase, table=True):
     """User model for the database, including relationships to other tables."""
+    __table_args__ = (Index("ix_user_login_token", "login_token"),)
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     email: str = Field(unique=True)
     password_salt_and_hash: str
     login_token: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Bumped by every change to the user's clothing items; see facets.py
+    closet_version: int = 0
 
     clothing_items: List["ClothingItem"] = Relationship(back_populates="user")
     outfits: List["Outfit"] = Relationship(back_populates="user")
@@ -82,6 +100,11 @@ class ClothingItemUpdate(ClothingItemBase):
     user_id: Optional[int] = None
 
 class ClothingItem(ClothingItemBase, table=True):
+    __table_args__ = (
+        Index("ix_clothingitem_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_clothingitem_s3url", "s3url"),
+    )
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     user_id: int = Field(foreign_key="user.id")
@@ -121,6 +144,11 @@ class OutfitUpdate(OutfitBase):
     # clothing_item_ids: Optional[List[int]] = None  
 
 class Outfit(OutfitBase, table=True):
+    __table_args__ = (
+        Index("ix_outfit_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_outfit_s3url", "s3url"),
+    )
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     name: Optional[str] = None
@@ -131,6 +159,11 @@ class Outfit(OutfitBase, table=True):
 
 # The relationship table for connecting outfits to clothing items
 class OutfitItem(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_outfititem_outfit_id_clothing_item_id", "outfit_id", "clothing_item_id"),
+        Index("ix_outfititem_clothing_item_id_outfit_id", "clothing_item_id", "outfit_id"),
+    )
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     outfit_id: int = Field(foreign_key="outfit.id")
     clothing_item_id: int = Field(foreign_key="clothingitem.id")
@@ -138,6 +171,20 @@ class OutfitItem(SQLModel, table=True):
     outfit: Optional[Outfit] = Relationship(back_populates="items")
     clothing_item: Optional[ClothingItem] = Relationship(back_populates="outfits")
 
+# Clothing item fields summarized per outfit in OutfitAttribute
+OUTFIT_ATTRIBUTE_FIELDS = ("category", "brand", "size", "color", "style")
+
+# One distinct field value among an outfit's items, so outfits can be filtered
+# without joining through OutfitItem to ClothingItem.
+# Kept in sync by database.refresh_outfit_attributes.
+class OutfitAttribute(SQLModel, table=True):
+    __table_args__ = (Index("ix_outfitattribute_user_id_field_value", "user_id", "field", "value", "outfit_id"),)
+
+    outfit_id: int = Field(foreign_key="outfit.id", primary_key=True)
+    field: str = Field(primary_key=True)
+    value: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+
 ##### ResaleListing #####
 
 
@@ -169,6 +216,8 @@ class ResaleListingUpdate(ResaleListingBase):
     sold_on: Optional[datetime] = None
 
 class ResaleListing(ResaleListingBase, table=True):
+    __table_args__ = (Index("ix_resalelisting_clothing_item_id", "clothing_item_id"),)
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     clothing_item_id: int = Field(foreign_key="clothingitem.id")
@@ -230,11 +279,127 @@ class OutfitWearHistoryPublic(OutfitWearHistoryBase):
     outfit: Optional["Outfit"] = None
 
 class OutfitWearHistory(OutfitWearHistoryBase, table=True):
+    __table_args__ = (
+        Index("ix_outfitwearhistory_outfit_id_date", "outfit_id", "date"),
+        Index("ix_outfitwearhistory_date_id", "date", "id"),
+        Index("ix_outfitwearhistory_user_id_date_id", "user_id", "date", "id"),
+    )
+
     id: Optional[int] = Field(default_factory=make_id, primary_key=True)
     outfit_id: int = Field(foreign_key="outfit.id")
+    # The outfit's owner, copied here so a user's history pages off one index
+    user_id: Optional[int] = Field(default=None, foreign_key="user.id")
     outfit: Optional[Outfit] = Relationship(back_populates="outfit_wear_history")
 
 
+##### UserSelfie #####
+class UserSelfieBase(SQLModel):
+    image_url: str
+    description: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class UserSelfie(UserSelfieBase, table=True):
+    __table_args__ = (
+        Index("ix_userselfie_user_id_created_at", "user_id", "created_at", "id"),
+        Index("ix_userselfie_image_url", "image_url"),
+    )
+
+    id: Optional[int] = Field(default_factory=make_id, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    user: Optional["User"] = Relationship(back_populates="user_selfies")
+
+
+##### UploadJob #####
+
+class UploadJobPublic(SQLModel):
+    """Public model for UploadJob, used to poll the progress of an upload."""
+    id: int
+    kind: str
+    status: str
+    s3_url: str
+    result: Optional[list] = None
+    error: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+class UploadJob(SQLModel, table=True):
+    """A photo waiting to be parsed in the background.
+
+    status moves from queued to running, then to succeeded or failed.
+    vision_url is the downscaled copy of the photo that the model parses.
+    result holds the JSON-encoded parsed items once the job succeeds.
+    """
+    __table_args__ = (
+        Index("ix_uploadjob_status_updated_at", "status", "updated_at"),
+        Index("ix_uploadjob_s3_url", "s3_url"),
+    )
+
+    id: Optional[int] = Field(default_factory=make_id, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    kind: str
+    status: str = "queued"
+    s3_url: str
+    vision_url: Optional[str] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+##### StoredImage #####
+
+class StoredImage(SQLModel, table=True):
+    """An image in S3, keyed by the SHA-256 of its content.
+
+    Uploads are stored under a key derived from the digest, so a photo that
+    was uploaded before is found here instead of being stored again.
+    vision_url is its downscaled copy for the model, if one was made.
+    """
+    digest: str = Field(primary_key=True)
+    s3_url: str
+    vision_url: Optional[str] = None
+    size: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ParseCacheEntry(SQLModel, table=True):
+    """A vision model parse result, keyed by image digest, model and prompt version.
+
+    result is the parsed JSON. last_used_at orders eviction; see parse_cache.py.
+    """
+    __table_args__ = (Index("ix_parsecacheentry_last_used_at", "last_used_at"),)
+
+    digest: str = Field(primary_key=True)
+    model: str = Field(primary_key=True)
+    prompt_version: str = Field(primary_key=True)
+    result: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_used_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class IdWorkerLease(SQLModel, table=True):
+    """A worker ID held by a running process, so no two processes generate the same IDs.
+
+    See ids.py. Leases are renewed while the process runs and can be taken
+    over once expires_at has passed.
+    """
+    worker_id: int = Field(primary_key=True)
+    owner: str
+    expires_at: datetime
+
+
+def reset_database(engine):
+    """Drop every table and recreate it at the latest schema."""
+    import migrations
+
+    SQLModel.metadata.drop_all(engine)
+    # schema_migrations is not a model; left in place, upgrade would skip everything
+    migrations.forget_applied(engine)
+    SQLModel.metadata.create_all(engine)
+    # Apply the migrations that create_all does not cover, e.g. trigram indexes
+    migrations.upgrade(engine)
+
+
 # Drop all tables and recreate them
 if __name__ == "__main__":
     import dotenv
@@ -248,16 +413,4 @@ if __name__ == "__main__":
         exit(0)
 
     engine = create_engine(os.environ.get("DATABASE_URL"), echo=True)
-    SQLModel.metadata.drop_all(engine)
-    SQLModel.metadata.create_all(engine)
-
-##### UserSelfie #####
-class UserSelfieBase(SQLModel):
-    image_url: str
-    description: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class UserSelfie(UserSelfieBase, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
-    user: Optional["User"] = Relationship(back_populates="user_selfies")
+    reset_database(engine)
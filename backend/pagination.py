@@ -0,0 +1,69 @@
+"""Keyset pagination for list endpoints.
+
+Pages are ordered newest first by a (timestamp, id) pair and each page
+starts strictly after the last row of the previous one, so every page is an
+index range scan no matter how deep the client pages. The position is
+handed to clients as an opaque cursor in the X-Next-Cursor response header;
+it is absent on the last page.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+from sqlmodel import Session
+
+import constants
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Query parameters of a paginated endpoint, for use with Depends()."""
+
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(None, description="Cursor from the previous page's X-Next-Cursor header."),
+        limit: int = Query(constants.DEFAULT_PAGE_SIZE, ge=1, le=constants.MAX_PAGE_SIZE),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Encode the position of a row as an opaque cursor."""
+    raw = json.dumps([sort_value.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Decode a cursor made by encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+
+
+def order_after(query, sort_column, id_column, cursor: str | None):
+    """Order a query newest first, starting after the row a cursor points to."""
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.where(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+    return query.order_by(sort_column.desc(), id_column.desc())
+
+
+def paginate(db: Session, query, sort_column, id_column, page: PageParams, response: Response) -> list:
+    """Run one page of a query ordered newest first, setting the next cursor header."""
+    query = order_after(query, sort_column, id_column, page.cursor).limit(page.limit + 1)
+    rows = db.exec(query).all()
+
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows
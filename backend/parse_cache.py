@@ -0,0 +1,142 @@
+"""Durable cache of vision model parse results.
+
+A parse is a paid, multi-second model call, and the same photo is often
+parsed again: re-uploads by another user, retried jobs, re-ingesting after a
+failed database write. Results are stored in the ParseCacheEntry table keyed
+by the SHA-256 digest of the image sent to the model, the model and the
+prompt version, so any caller that knows the digest skips the call. Uploads
+are sent as downscaled copies, so that is the copy's digest, not the
+original's: copies made with other vision settings are parsed afresh.
+
+Given the caller's session, the cache reads and writes in its transaction,
+which the caller commits; the lookup is committed before the model call so
+no pooled connection is held through it.
+
+Bump a prompt's version whenever its text or output format changes, so stale
+results are never reused. The table holds at most PARSE_CACHE_MAX_ENTRIES
+rows; the least recently used are evicted.
+
+Run this file directly:
+
+    python parse_cache.py stats   # number of cached results
+    python parse_cache.py evict   # evict down to the size limit now
+"""
+
+import json
+import sys
+from datetime import datetime
+from threading import Lock
+from typing import Callable
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete, func, select
+
+import database
+import environment
+from models import ParseCacheEntry
+
+PARSE_CACHE_MAX_ENTRIES_DEFAULT = 100_000
+# Eviction needs an ordered scan, so it runs once per this many new entries
+PARSE_CACHE_EVICT_EVERY = 100
+
+_lock = Lock()
+_inserts_since_eviction = 0
+hits = 0
+misses = 0
+
+
+def max_entries() -> int:
+    """Get the maximum number of cached parse results."""
+    return int(environment.get_optional("PARSE_CACHE_MAX_ENTRIES", PARSE_CACHE_MAX_ENTRIES_DEFAULT))
+
+
+def get(digest: str, model: str, prompt_version: str, session: Session | None = None):
+    """Get a cached parse result, or None, marking it as recently used."""
+    global hits, misses
+    with database.unit_of_work(session) as db:
+        entry = db.get(ParseCacheEntry, (digest, model, prompt_version))
+        if entry is not None:
+            entry.last_used_at = datetime.utcnow()
+            db.add(entry)
+    with _lock:
+        if entry is None:
+            misses += 1
+            return None
+        hits += 1
+    return json.loads(entry.result)
+
+
+def put(digest: str, model: str, prompt_version: str, result, session: Session | None = None):
+    """Cache a parse result, evicting old entries now and then."""
+    global _inserts_since_eviction
+    entry = ParseCacheEntry(digest=digest, model=model, prompt_version=prompt_version, result=json.dumps(result))
+    try:
+        with database.unit_of_work(session) as db, db.begin_nested():
+            db.add(entry)
+    except IntegrityError:
+        # A concurrent parse of the same image got there first
+        return
+
+    with _lock:
+        _inserts_since_eviction += 1
+        due = _inserts_since_eviction >= PARSE_CACHE_EVICT_EVERY
+        if due:
+            _inserts_since_eviction = 0
+    if due:
+        evict(session=session)
+
+
+def get_or_parse(digest: str | None, model: str, prompt_version: str, parse: Callable[[], object], session: Session | None = None):
+    """Get a cached parse result, or run parse() and cache what it returns.
+
+    Without a digest the image cannot be identified, so parse() always runs.
+    """
+    if digest is None:
+        return parse()
+    result = get(digest, model, prompt_version, session)
+    if result is None:
+        if session is not None:
+            database.release_connection(session)
+        result = parse()
+        put(digest, model, prompt_version, result, session)
+    return result
+
+
+def evict(limit: int | None = None, session: Session | None = None) -> int:
+    """Delete the least recently used entries beyond the size limit. Returns how many were deleted."""
+    limit = max_entries() if limit is None else limit
+    with database.unit_of_work(session) as db:
+        cutoff = db.exec(
+            select(ParseCacheEntry.last_used_at)
+            .order_by(ParseCacheEntry.last_used_at.desc())
+            .offset(limit)
+            .limit(1)
+        ).first()
+        if cutoff is None:
+            return 0
+        return db.exec(delete(ParseCacheEntry).where(ParseCacheEntry.last_used_at <= cutoff)).rowcount
+
+
+def stats() -> dict:
+    """Get the in-process hit and miss counters of the cache."""
+    with _lock:
+        lookups = hits + misses
+        return {
+            "maxsize": max_entries(),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "stats":
+        with database.get_session() as session:
+            count = session.exec(select(func.count()).select_from(ParseCacheEntry)).one()
+        print(f"{count} cached parse results (limit {max_entries()}).")
+    elif command == "evict":
+        print(f"Evicted {evict()} cached parse results.")
+    else:
+        print(f"Unknown command: {command}. Use stats or evict.")
+        exit(2)
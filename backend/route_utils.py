@@ -1,23 +1,48 @@
 """Various utility functions for FastAPI routes"""
 
 from fastapi import HTTPException
+from sqlmodel import Session
 
 import database as database
 import constants as constants
+from caching import CountingTTLCache
+from models import UserPublic
 
 import re
 
-def enforce_logged_in(authorization: str):
-    """Check if the user is logged in by checking the authorization header."""
+# Login token -> UserPublic, so repeated requests from a session skip the database.
+# Login tokens are never rotated or revoked, so an entry can only go stale when
+# its user is renamed. invalidate_user clears the worker that made the change;
+# every other worker keeps the old name for at most LOGIN_CACHE_TTL_SECONDS.
+login_cache = CountingTTLCache(
+    maxsize=constants.LOGIN_CACHE_MAX_SIZE,
+    ttl=constants.LOGIN_CACHE_TTL_SECONDS,
+)
+
+def enforce_logged_in(authorization: str, db: Session | None = None):
+    """Check if the user is logged in by checking the authorization header.
+
+    Pass the request's session as db so a cache miss reuses its connection.
+    """
     token = authorization[7:]
     if token == "":
         raise HTTPException(status_code=401, detail="Not logged in.")
-    user = database.get_user_by_login_token(token)
+    user = login_cache.get(token)
+    if user is not None:
+        return user
+    user = database.get_user_by_login_token(token, session=db)
     if user is None:
         raise HTTPException(status_code=400, detail="Bad login token.")
+    user = UserPublic.model_validate(user)
+    login_cache.set(token, user)
     return user
 
 
+def invalidate_user(user_id: int):
+    """Forget every cached login token that belongs to a user, in this process."""
+    return login_cache.pop_where(lambda token, user: user.id == user_id)
+
+
 def validate_login_strings(email: str, password: str, name: str|None = None):
     """Validate the login strings for signup and login requests."""
     # Check field lengths
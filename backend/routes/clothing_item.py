@@ -5,11 +5,12 @@ from sqlmodel import select
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi import Header
 from pydantic import BaseModel
-import boto3
 #import chromadb
-import environment
-from urllib.parse import urlparse
-import chromadb
+
+from clients import ClientRegistry, get_clients
+from facets import clear_facets, invalidate_facets
+import upload_pipeline
+from upload_pipeline import clothing_item_metadata
 
 
 from models import ClothingItem, ClothingItemBase, ClothingItemPublicFull
@@ -18,8 +19,10 @@ from models import ClothingItem, ClothingItemBase, ClothingItemPublicFull
 router = APIRouter()
 
 from sqlalchemy.orm import Session, selectinload
+from sqlmodel import delete
+import database
 from database import get_db
-from models import ClothingItem
+from models import ClothingItem, OutfitAttribute, StoredImage
 
 
 @router.get("/clothing_items/{item_id}", response_model=ClothingItemPublicFull)
@@ -36,80 +39,70 @@ def get_clothing_item(item_id: int, db: Session = Depends(get_db)):
 def create_clothing_item(item: ClothingItemBase, db: Session = Depends(get_db)):
     db_item = ClothingItem.model_validate(item)
     db.add(db_item)
+    invalidate_facets(db_item.user_id, db)
     db.commit()
     db.refresh(db_item)
     return db_item
 
 @router.patch("/clothing_items/{item_id}", response_model=ClothingItemPublicFull)
-def update_clothing_item(item_id: int, item_update: ClothingItem, db: Session = Depends(get_db)):
+def update_clothing_item(item_id: int, item_update: ClothingItem, db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
     item = db.get(ClothingItem, item_id)
     if not item:
         raise HTTPException(status_code=404, detail="Clothing item not found")
+    previous_user_id = item.user_id
     item_data = item_update.model_dump(exclude_unset=True)
     item.sqlmodel_update(item_data)
     db.add(item)
+    database.refresh_outfit_attributes(database.get_outfit_ids_containing([item.id], session=db), session=db)
+    for user_id in {previous_user_id, item.user_id}:
+        invalidate_facets(user_id, db)
     db.commit()
     db.refresh(item)
+
+    # Keep the metadata used to filter vector queries in sync
+    clients.vectors.update_metadata("clothing_items", ids=[str(item.id)], metadatas=[clothing_item_metadata(item)])
     return item
 
 @router.delete("/clothing_items/{item_id}")
-def delete_clothing_item(item_id: int, db: Session = Depends(get_db)):
+def delete_clothing_item(item_id: int, db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
     item = db.get(ClothingItem, item_id)
     s3url = item.s3url if item else None
     if not item:
         raise HTTPException(status_code=404, detail="Clothing item not found")
+    outfit_ids = database.get_outfit_ids_containing([item.id], session=db)
     db.delete(item)
+    db.flush()
+    database.refresh_outfit_attributes(outfit_ids, session=db)
+    invalidate_facets(item.user_id, db)
     db.commit()
 
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="clothing_items")
-    collection.delete(ids=[str(item.id)])
-
-    aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-    aws_region = environment.get("AWS_DEFAULT_REGION")
-    bucket_name = "hack-fitcheck"
-
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region,
-    )
-    parsed_url = urlparse(s3url)
+    clients.vectors.delete("clothing_items", ids=[str(item.id)], user_id=item.user_id)
 
-    key = parsed_url.path.lstrip("/") 
+    # Identical uploads share one object, so keep it while anything else shows it
     try:
-        s3_client.delete_object(Bucket=bucket_name, Key=key)
+        if upload_pipeline.release_image(clients, s3url, db):
+            print("deleted from s3")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete item from S3: {e}")
-    print("deleted from s3")
     return {"message": "Clothing item deleted successfully."}
 
 
 
 @router.delete("/clear_clothing_items", status_code=204)
-def clear_clothing_items(db: Session = Depends(get_db)):
+def clear_clothing_items(db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
     clothing_items = db.query(ClothingItem).all()
     for item in clothing_items:
         db.delete(item)
+    db.execute(delete(OutfitAttribute))
+    # The whole bucket is emptied below
+    db.execute(delete(StoredImage))
+    clear_facets(db)
     db.commit()
 
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="clothing_items")
-    client.delete_collection(name="clothing_items")
+    clients.vectors.clear("clothing_items")
 
-    aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-    aws_region = environment.get("AWS_DEFAULT_REGION")
     bucket_name = "hack-fitcheck"
-
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region,
-    )
+    s3_client = clients.s3
 
     # Clear all items in S3
     response = s3_client.list_objects_v2(Bucket=bucket_name)
@@ -1,21 +1,26 @@
-import boto3
-from fastapi import APIRouter, File, HTTPException, UploadFile, Header, Depends
+from fastapi import APIRouter, File, HTTPException, UploadFile, Header, Depends, Query, Response
 from models import ClothingItem, ClothingItemBase, ClothingItemPublicFull
 from pydantic import BaseModel
 import json
 from sqlmodel import SQLModel, Field, Session, create_engine, select
 from database import get_db
-from models import ClothingItem, Outfit, OutfitItem, UserSelfie
+from models import ClothingItem, Outfit, OutfitAttribute, OutfitItem, UserSelfie
 from route_utils import enforce_logged_in
+from pagination import PageParams, order_after, paginate
+from streaming import stream_ndjson
+import facets
 from typing import List, Optional
-import chromadb
+from clients import ClientRegistry, get_clients
+from vector_store import VectorStore
 import database
-import environment 
-from sqlalchemy import distinct
+from sqlalchemy import and_, distinct, func, or_
 
 # FastAPI router
 router = APIRouter()
 
+# Opt-in NDJSON streaming of every row from the cursor on, ignoring limit
+STREAM_QUERY = Query(False, description="Stream every matching row as NDJSON instead of returning one page.")
+
 class FilterRequest(BaseModel):
     category: Optional[List[str]] = []
     brand: Optional[List[str]] = []
@@ -26,9 +31,9 @@ class FilterRequest(BaseModel):
 
 @router.post("/by-field")
 def post_by_field(
-    request: FilterRequest, db: Session = Depends(get_db), authorization: str = Header(...)
+    request: FilterRequest, response: Response, page: PageParams = Depends(), stream: bool = STREAM_QUERY, db: Session = Depends(get_db), authorization: str = Header(...)
 ):
-    current_user = enforce_logged_in(authorization)
+    current_user = enforce_logged_in(authorization, db)
     
     query = select(ClothingItem).where(ClothingItem.user_id == current_user.id)
     if request.category:
@@ -46,41 +51,42 @@ def post_by_field(
     if request.tag:
         query = query.where(ClothingItem.tag.in_(request.tag))
         
-    items = db.exec(query).all()
-    
-    return items
+    if stream:
+        return stream_ndjson(order_after(query, ClothingItem.created_at, ClothingItem.id, page.cursor))
+    return paginate(db, query, ClothingItem.created_at, ClothingItem.id, page, response)
 
 @router.post("/outfits-by-field")
 def post_by_field_outfit(
-    request: FilterRequest, db: Session = Depends(get_db), authorization: str = Header(...)
+    request: FilterRequest, response: Response, page: PageParams = Depends(), db: Session = Depends(get_db), authorization: str = Header(...)
 ):
-    current_user = enforce_logged_in(authorization)
-    
-    query = select(Outfit).join(OutfitItem, Outfit.id == OutfitItem.outfit_id).join(ClothingItem, OutfitItem.clothing_item_id == ClothingItem.id).where(Outfit.user_id == current_user.id).distinct(Outfit.id) 
+    current_user = enforce_logged_in(authorization, db)
     
-    
-    if request.category:
-        query = query.where(ClothingItem.category.in_(request.category))
-    if request.brand:
-        query = query.where(ClothingItem.brand.in_(request.brand))
-    if request.size:
-        query = query.where(ClothingItem.size.in_(request.size))
-    if request.color:
-        query = query.where(ClothingItem.color.in_(request.color))
-    if request.tag:
-        query = query.where(ClothingItem.tag.in_(request.tag))
+    # Outfits whose items cover every filter, found in the per-outfit
+    # attribute summary: one indexed lookup per filter value, grouped by outfit
+    filters = {field: values for field, values in request.model_dump().items() if values}
+    query = select(Outfit).where(Outfit.user_id == current_user.id)
+    if filters:
+        matching_outfit_ids = (
+            select(OutfitAttribute.outfit_id)
+            .where(
+                OutfitAttribute.user_id == current_user.id,
+                or_(*(and_(OutfitAttribute.field == field, OutfitAttribute.value.in_(values)) for field, values in filters.items())),
+            )
+            .group_by(OutfitAttribute.outfit_id)
+            .having(func.count(distinct(OutfitAttribute.field)) == len(filters))
+        )
+        query = query.where(Outfit.id.in_(matching_outfit_ids))
+    return paginate(db, query, Outfit.created_at, Outfit.id, page, response)
 
-    # 4) Execute and return the matching outfits
-    outfits = db.exec(query).all()
-    print("____________________________")
-    print("Matching outfits:")
-    print(outfits)
-    print("____________________________")
-    return outfits
+@router.get("/facets")
+def get_closet_facets(authorization: str = Header(...), db: Session = Depends(get_db)):
+    """Get every distinct category, brand, size, color and style in the closet with its item count."""
+    current_user = enforce_logged_in(authorization, db)
+    return facets.get_facets(current_user.id, db)
 
 @router.get("/unique-values/{field}")
 def get_unique_values_by_field(field: str, authorization: str = Header(...), db: Session = Depends(get_db)):
-    current_user = enforce_logged_in(authorization)
+    current_user = enforce_logged_in(authorization, db)
     query = select(ClothingItem).where(ClothingItem.user_id == current_user.id)
     
     if hasattr(ClothingItem, field):
@@ -94,102 +100,71 @@ def get_unique_values_by_field(field: str, authorization: str = Header(...), db:
 class SearchRequest(BaseModel):
     query: str  # The search query text
 
-@router.post("/search")
-def search(request: SearchRequest, authorization: str = Header(...), db: Session = Depends(get_db)):
-    current_user = enforce_logged_in(authorization)
 
-    # Initialize ChromaDB client
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="clothing_items")
+def hydrate_vector_hits(db: Session, model, user_id: int, results: dict, max_distance: float) -> list:
+    """Fetch the user's rows for vector hits closer than max_distance in one query, keeping their ranking."""
+    hit_ids = [
+        int(item_id)
+        for item_id, distance in zip(results['ids'][0], results['distances'][0])
+        if distance < max_distance and item_id.isdigit()
+    ]
+    if not hit_ids:
+        return []
+    rows = db.exec(select(model).where(model.user_id == user_id, model.id.in_(hit_ids))).all()
+    rows_by_id = {row.id: row for row in rows}
+    return [rows_by_id[item_id] for item_id in dict.fromkeys(hit_ids) if item_id in rows_by_id]
+
 
+def contains_text(column, text: str):
+    """Case-insensitive substring match that the trigram indexes can serve."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return column.ilike(f"%{escaped}%", escape="\\")
 
-    # Query ChromaDB for similar items
+
+def search_rows(db: Session, vectors: VectorStore, collection: str, model, user_id: int, query: str, max_distance: float) -> list:
+    """Rank the user's rows by vector similarity, then append lexical matches from SQL."""
+    # Query the vector store for similar items
     try:
-        results = collection.query(
-            query_texts=[request.query], 
-            n_results=5  
-        )
+        results = vectors.query(collection, texts=[query], n_results=5, user_id=user_id)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chroma query failed: {e}")
-
-    # Parse the results from ChromaDB
-    matching_items = []
-    matching_ids = set()
-    for result in range(len(results['ids'][0])):
-        if results['distances'][0][result] < 20:
-            item_id = results['ids'][0][result]
-        # Fetch the clothing item from the database using the ID
-            item = db.query(ClothingItem).where(ClothingItem.user_id == current_user.id).filter(ClothingItem.id == item_id).first()
-            if item and item_id not in matching_ids:
-                matching_ids.add(item.id)
-                matching_items.append(item)
-
-    for item in db.query(ClothingItem).where(ClothingItem.user_id == current_user.id).where(ClothingItem.id not in matching_ids).all():
-        if request.query.lower() in item.description.lower() and (item.id not in matching_ids):
-            matching_ids.add(item.id)
-            matching_items.append(item)
-
-    matching_items = list(matching_items)
-    print("____________________________")
-    print("Matching items from ChromaDB:")
-    print(matching_items)
-    print("____________________________")
+        raise HTTPException(status_code=500, detail=f"Vector query failed: {e}")
 
+    matching_items = hydrate_vector_hits(db, model, user_id, results, max_distance)
+    matching_ids = [item.id for item in matching_items]
+
+    lexical_query = select(model).where(model.user_id == user_id, contains_text(model.description, query))
+    if matching_ids:
+        lexical_query = lexical_query.where(model.id.not_in(matching_ids))
+    matching_items.extend(db.exec(lexical_query).all())
     return matching_items
 
 
+@router.post("/search")
+def search(request: SearchRequest, authorization: str = Header(...), db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
+    current_user = enforce_logged_in(authorization, db)
 
-@router.post("/search-outfits")
-def search(request: SearchRequest, authorization: str = Header(...), db: Session = Depends(get_db)):
-    current_user = enforce_logged_in(authorization)
+    return search_rows(db, clients.vectors, "clothing_items", ClothingItem, current_user.id, request.query, max_distance=20)
 
-    # Initialize ChromaDB client
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="outfits")
 
+@router.post("/search-outfits")
+def search_outfits(request: SearchRequest, authorization: str = Header(...), db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
+    current_user = enforce_logged_in(authorization, db)
 
-    # Query ChromaDB for similar items
-    try:
-        results = collection.query(
-            query_texts=[request.query], 
-            n_results=5  
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chroma query failed: {e}")
-
-    matching_items = []
-    matching_ids = set()
-    for result in range(len(results['ids'][0])):
-        if results['distances'][0][result] < 1:
-            item_id = results['ids'][0][result]
-            item = db.query(Outfit).where(Outfit.user_id == current_user.id).filter(Outfit.id == item_id).first()
-            if item and item_id not in matching_ids:
-                matching_ids.add(item.id)
-                matching_items.append(item)
-
-    for item in db.query(Outfit).where(Outfit.user_id == current_user.id).where(Outfit.id not in matching_ids).all():
-        if request.query.lower() in item.description.lower() and (item.id not in matching_ids):
-            matching_ids.add(item.id)
-            matching_items.append(item)
-
-    matching_items = list(matching_items)
-    return matching_items
+    return search_rows(db, clients.vectors, "outfits", Outfit, current_user.id, request.query, max_distance=1)
 
 
 @router.get("/clothing-items")
-def get_clothing_items(authorization: str = Header(...), db: Session = Depends(get_db)):
-    current_user = enforce_logged_in(authorization)
+def get_clothing_items(response: Response, page: PageParams = Depends(), stream: bool = STREAM_QUERY, authorization: str = Header(...), db: Session = Depends(get_db)):
+    current_user = enforce_logged_in(authorization, db)
     
     query = select(ClothingItem).where(ClothingItem.user_id == current_user.id)
-    items = db.exec(query).all()
-
-    return items
+    if stream:
+        return stream_ndjson(order_after(query, ClothingItem.created_at, ClothingItem.id, page.cursor))
+    return paginate(db, query, ClothingItem.created_at, ClothingItem.id, page, response)
 
 @router.get("/user-selfies")
-def get_user_selfies(authorization: str = Header(...), db: Session = Depends(get_db)):
-    current_user = enforce_logged_in(authorization)
+def get_user_selfies(response: Response, page: PageParams = Depends(), authorization: str = Header(...), db: Session = Depends(get_db)):
+    current_user = enforce_logged_in(authorization, db)
     
     query = select(UserSelfie).where(UserSelfie.user_id == current_user.id)
-    selfies = db.exec(query).all()
-
-    return selfies
\ No newline at end of file
+    return paginate(db, query, UserSelfie.created_at, UserSelfie.id, page, response)
\ No newline at end of file
@@ -1,15 +1,20 @@
 """Routes for image upload and parsing."""
 
-import boto3
-from fastapi import APIRouter, File, HTTPException, UploadFile, Header
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Header
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import environment
+from sqlmodel import Session, select
+from clients import ClientRegistry, get_clients, get_registry
 from clothes_addition import parse_clothing_items, parse_outfit
 import database
-import uuid
-from s3connection import add_image_obj
-import chromadb
+from database import get_db
+import io
+from models import UserSelfie
 from route_utils import enforce_logged_in
+import image_processing
+import jobs
+from model_dispatch import ModelUnavailableError
+import upload_pipeline
 
 # FastAPI router
 router = APIRouter()
@@ -23,156 +28,116 @@ class ParsedRequest(BaseModel):
 
 @router.post("/parse_image")
 def post_parse_image(request: StandardRequest):
-    return parse_clothing_items(request.message)
-
-@router.post("/upload-new-image")
-async def upload_image(file: UploadFile = File(...), authorization: str = Header(...)):
-    current_user = enforce_logged_in(authorization)
-
-    # Get AWS credentials from environment
-    aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-    aws_region = environment.get("AWS_DEFAULT_REGION")
-    bucket_name = "hack-fitcheck"
-
-    # Initialize S3 client
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region,
-    )
+    try:
+        return parse_clothing_items(request.message)
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=f"Image parsing is unavailable, please try again: {e}")
+
+async def store_upload(clients: ClientRegistry, file: UploadFile, db: Session) -> tuple[str, str, bool]:
+    """Store an uploaded photo and its downscaled copy for the model in S3.
+
+    Returns both URLs and whether the same photo had already been stored, in
+    which case nothing is uploaded again.
+    """
+    digest, size = await run_in_threadpool(upload_pipeline.hash_file, file.file)
+    stored = await run_in_threadpool(upload_pipeline.find_stored_image, digest, db)
+    if stored is not None and stored.vision_url is not None:
+        return stored.s3_url, stored.vision_url, True
+
+    data = await file.read()
+    try:
+        vision_image = await image_processing.make_vision_image(data)
+    except image_processing.InvalidImageError:
+        raise HTTPException(status_code=400, detail="The uploaded file is not a supported image.")
 
-    # Derive file name and upload the file to S3
-    file_name = f"{uuid.uuid4()}_{file.filename}"
-    upload_result = add_image_obj(file.file, bucket_name, file_name)
-    s3_url = f"https://{bucket_name}.s3.amazonaws.com/{file_name}"
     try:
-        parsed_items = parse_clothing_items(s3_url)
+        if stored is not None:
+            s3_url = stored.s3_url
+        else:
+            s3_url = await run_in_threadpool(upload_pipeline.store_image, clients, io.BytesIO(data), file.filename, digest)
+        vision_url = await run_in_threadpool(upload_pipeline.store_vision_image, clients, vision_image)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Image parsing failed: {e}")
-    
-    # Add clothing items to the cockroach database
-    saved_items = []
-    for item in parsed_items:
-        clothing = database.add_clothing_item(
-            user_id=current_user.id,
-            description=item["cloth_description"],
-            size=item["cloth_size"],
-            color=item["cloth_color"],
-            s3url=s3_url,
-            style=None,
-            brand=None,
-            category=item["cloth_type"].capitalize(),  
-        )
-
-        saved_items.append({
-            "id": str(clothing.id),
-            "category": clothing.category,
-            'description': clothing.description,
-        })
-
-    # Upload parsed items to ChromaDB
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection('clothing_items')
-
-    collection.add(
-        documents=[item['description'] + item['size'] + item['color'] + item['style'] + item['brand'] + item['category'] for item in saved_items],
-        ids=[item['id'] for item in saved_items], 
-    )
+        raise HTTPException(status_code=500, detail=f"S3 upload failed: {e}")
+    await run_in_threadpool(upload_pipeline.record_stored_image, digest, s3_url, vision_url, size, db)
+    return s3_url, vision_url, stored is not None
+
+@router.post("/upload-new-image", status_code=202)
+async def upload_image(file: UploadFile = File(...), authorization: str = Header(...), db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
+    # Every blocking stage runs in the threadpool so the event loop keeps serving other requests
+    current_user = await run_in_threadpool(enforce_logged_in, authorization, db)
+
+    s3_url, vision_url, already_stored = await store_upload(clients, file, db)
+
+    # The same photo again: point at the earlier job and the items it created
+    if already_stored:
+        job = await run_in_threadpool(jobs.find_reusable_job, current_user.id, "clothing", s3_url, db)
+        if job is not None:
+            return {
+                "message": "This photo was already uploaded",
+                "s3_url": s3_url,
+                "job_id": str(job.id),
+                "status": job.status,
+            }
+
+    queue = jobs.get_queue()
+    if queue.full():
+        raise HTTPException(status_code=503, detail="Too many uploads in progress. Please try again.")
+
+    # Parsing, saving and indexing the items happens in the background
+    job = await run_in_threadpool(jobs.create_job, current_user.id, "clothing", s3_url, db, vision_url)
+    try:
+        queue.submit(job.id)
+    except jobs.JobQueueFullError:
+        # The queue filled up while the job was recorded; fail it so a re-upload is not pointed at it
+        await run_in_threadpool(jobs.fail_job, job.id, "The upload queue was full.", db)
+        raise HTTPException(status_code=503, detail="Too many uploads in progress. Please try again.")
 
     return {
-        "message": "Upload and parse successful",
+        "message": "Upload successful, parsing in progress",
         "s3_url": s3_url,
-        "parsed_items": saved_items,
+        "job_id": str(job.id),
+        "status": job.status,
     }
 
 @router.post("/upload-new-outfit")
-async def upload_outfit(file: UploadFile = File(...), authorization: str = Header(...)):
-    current_user = enforce_logged_in(authorization)
-
-    # Get AWS credentials from environment
-    aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-    aws_region = environment.get("AWS_DEFAULT_REGION")
-    bucket_name = "hack-fitcheck"
-
-    # Initialize S3 client
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region,
-    )
-
-    # Derive file name and upload the file to S3
-    file_name = f"{uuid.uuid4()}_{file.filename}"
-    upload_result = add_image_obj(file.file, bucket_name, file_name)
-    s3_url = f"https://{bucket_name}.s3.amazonaws.com/{file_name}"
+async def upload_outfit(file: UploadFile = File(...), authorization: str = Header(...), db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
+    # Every blocking stage runs in the threadpool so the event loop keeps serving other requests
+    current_user = await run_in_threadpool(enforce_logged_in, authorization, db)
+
+    s3_url, vision_url, already_stored = await store_upload(clients, file, db)
+
+    # The same photo again: return the outfit that was made from it
+    if already_stored:
+        found = await run_in_threadpool(upload_pipeline.find_uploaded_outfit, current_user.id, s3_url, db)
+        if found is not None:
+            _, clothing_item_ids = found
+            return {
+                "message": "This outfit was already uploaded",
+                "s3_url": s3_url,
+                "parsed_items": [{"id": clothing_item_id} for clothing_item_id in clothing_item_ids],
+            }
     
+    # Commit the stored image and don't hold a pooled connection through the multi-second model call
+    await run_in_threadpool(database.release_connection, db)
     try:
-        # Parse the clothing items from the image
-        parsed_items = parse_clothing_items(s3_url)
-        description = parse_outfit(s3_url)
+        # One model call returns the clothing items and the outfit description, reusing earlier parses of the same copy
+        digest = upload_pipeline.digest_from_url(vision_url)
+        parsed = await run_in_threadpool(parse_outfit, vision_url, clients.openai, digest, db)
+        parsed_items, description = parsed["items"], parsed["description"]
+    except ModelUnavailableError as e:
+        raise HTTPException(status_code=503, detail=f"Image parsing is unavailable, please try again: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image parsing failed: {e}")
     
-    # Add outfit to the cockroach database
-    saved_items = []
-
-    # Create a ChromaDB client to search for existing items
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="clothing_items")
-
-    add_items = []
-
-    for item in parsed_items:
-        results = collection.query(
-            query_texts=[item["cloth_description"]],
-            n_results=3,
-        )
-        for result in results['ids'][0]:
-            clothing_item = database.get_clothing_item_by_id(result)
-            if clothing_item is None or clothing_item.user_id != current_user.id:
-                continue
-            else:
-                add_items.append(result)
-                break
-
-        for add in add_items:
-            saved_items.append({
-                "id": str(add),
-            })
-
-        add_items = []
-    
-    print(saved_items)
-    outfit = database.add_outfit(
-        user_id=current_user.id,
-        description=description,
-        s3url=s3_url,
-        clothing_item_ids=[str(item['id']) for item in saved_items],
-    )   
+    # Search ChromaDB for the user's existing items that appear in the outfit
+    clothing_item_ids = await run_in_threadpool(upload_pipeline.match_outfit_items, clients, current_user.id, parsed_items, db)
+    saved_items = [{"id": str(clothing_item_id)} for clothing_item_id in clothing_item_ids]
     
-    # Create OutfitItem entries to link clothing items with the outfit
-    for item in saved_items:
-        database.add_outfit_item(
-            outfit_id=outfit.id,
-            clothing_item_id=item['id']
-        )
-    
-    # Mark the associated ClothingItem as worn
-    for item in saved_items:
-        database.mark_clothing_item_worn(item['id'])
+    # Add outfit to the cockroach database
+    outfit = await run_in_threadpool(upload_pipeline.save_outfit, current_user.id, description, s3_url, clothing_item_ids, db)
     
     # Upload the outfit to ChromaDB
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection('outfits')
-
-    collection.add(
-        documents=[outfit.description],
-        ids=[str(outfit.id)], 
-    )
+    await run_in_threadpool(upload_pipeline.index_outfit, clients, outfit)
 
     return {
         "message": "Upload and parse successful",
@@ -181,9 +146,8 @@ async def upload_outfit(file: UploadFile = File(...), authorization: str = Heade
     }
 
 @router.post('/chroma-upload')
-def chroma_upload(request: StandardRequest):
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name=request.db_name)
+def chroma_upload(request: StandardRequest, clients: ClientRegistry = Depends(get_clients)):
+    collection = clients.chroma.get_or_create_collection(name=request.db_name)
 
     collection.add(
         documents=[doc['cloth_description'] for doc in request.parsed],
@@ -195,9 +159,8 @@ def chroma_upload(request: StandardRequest):
     }
 
 @router.post('/chroma-query')
-def chroma_query(request: StandardRequest):
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
-    collection = client.get_or_create_collection(name="test")
+def chroma_query(request: StandardRequest, clients: ClientRegistry = Depends(get_clients)):
+    collection = clients.chroma.get_or_create_collection(name="test")
     results = collection.query(
         query_texts=[request.message],
         n_results=3,
@@ -209,8 +172,8 @@ def chroma_query(request: StandardRequest):
     }
 
 @router.get('/chroma-clear-all')
-def chroma_clear_all():
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
+def chroma_clear_all(clients: ClientRegistry = Depends(get_clients)):
+    client = clients.chroma
 
     try:
         collection_names = client.list_collections()  # Now returns List[str] in v0.6.0
@@ -228,7 +191,7 @@ def chroma_clear_all():
 
 
 if __name__ == '__main__':
-    client = chromadb.HttpClient(host=environment.get('CHROMA_DB_ADDRESS'), port=8000)
+    client = get_registry().chroma
     collection = client.get_or_create_collection(name="clothing_items")
     results = collection.query(
         query_texts=['any clothes'],
@@ -238,32 +201,33 @@ if __name__ == '__main__':
     print(results)
 
 @router.post("/upload-user-selfie")
-def upload_user_selfie(file: UploadFile = File(...), authorization: str = Header(...)):
-    current_user = enforce_logged_in(authorization)
-
-    aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-    aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-    aws_region = environment.get("AWS_DEFAULT_REGION")
-    bucket_name = "hack-fitcheck" 
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key,
-        aws_secret_access_key=aws_secret_key,
-        region_name=aws_region,
-    )
-
-    file_name = f"{uuid.uuid4()}_{file.filename}"
-
-    try:
-        s3_client.upload_fileobj(file.file, bucket_name, file_name)
-        s3_url = f"https://{bucket_name}.s3.amazonaws.com/{file_name}"
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"S3 upload failed: {e}")
+def upload_user_selfie(file: UploadFile = File(...), authorization: str = Header(...), db: Session = Depends(get_db), clients: ClientRegistry = Depends(get_clients)):
+    current_user = enforce_logged_in(authorization, db)
+
+    digest, size = upload_pipeline.hash_file(file.file)
+    stored = upload_pipeline.find_stored_image(digest, db)
+    if stored is not None:
+        # The same photo again: reuse the stored object, and the selfie if this user has it
+        s3_url = stored.s3_url
+        existing = db.exec(select(UserSelfie).where(UserSelfie.image_url == s3_url, UserSelfie.user_id == current_user.id).limit(1)).first()
+        if existing is not None:
+            return {
+                "message": "Selfie already uploaded",
+                "s3_url": s3_url,
+                "user_selfie_id": existing.id,
+            }
+    else:
+        try:
+            s3_url = upload_pipeline.store_image(clients, file.file, file.filename, digest)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"S3 upload failed: {e}")
+        upload_pipeline.record_stored_image(digest, s3_url, None, size, db)
 
     description = f"Selfie uploaded by user {current_user.id}" 
     
     try:
-        user_selfie = database.add_user_selfie(current_user.id, s3_url, description)
+        user_selfie = database.add_user_selfie(current_user.id, s3_url, description, session=db)
+        db.commit()
         return {
             "message": "Selfie uploaded successfully",
             "s3_url": s3_url,
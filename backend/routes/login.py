@@ -1,10 +1,11 @@
 """Routes for user login and signup."""
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from route_utils import validate_login_strings
-from auth import verify_password
+from auth import KdfBusyError, derive_password_async, verify_password_async
 import database as database
 from models import User
 
@@ -28,8 +29,10 @@ class LoginStatus(BaseModel):
         if success and user is None:
             raise ValueError("User must be provided if success is True.")
 
+KDF_BUSY_DETAIL = "Too many login attempts in progress. Please try again."
+
 @router.post("/login", response_model=LoginStatus)
-def post_login(request: LoginRequest):
+async def post_login(request: LoginRequest):
     """Handle user login."""
     error = validate_login_strings(request.email, request.password)
     if error is not None:
@@ -37,12 +40,16 @@ def post_login(request: LoginRequest):
         return LoginStatus(success=False, error=error["error"])
 
     # Get user
-    user = database.get_user_by_email(request.email, True)
+    user = await run_in_threadpool(database.get_user_by_email, request.email, True)
     if not user:
         return LoginStatus(success=False, error="User not found.")
     
     # Check password
-    if not verify_password(request.password, user.password_salt_and_hash):
+    try:
+        password_ok = await verify_password_async(request.password, user.password_salt_and_hash)
+    except KdfBusyError:
+        raise HTTPException(status_code=503, detail=KDF_BUSY_DETAIL)
+    if not password_ok:
         return LoginStatus(success=False, error="Incorrect password.")
     
     return LoginStatus(
@@ -57,21 +64,25 @@ class SignupRequest(BaseModel):
     password: str
 
 @router.post("/signup", response_model=LoginStatus)
-def post_signup(request: SignupRequest):
+async def post_signup(request: SignupRequest):
     """Handle user signup."""
     error = validate_login_strings(request.email, request.password, request.name)
     if error:
         return LoginStatus(success=False, error=error["error"])
     
     # Check if user already exists
-    if database.get_user_by_email(request.email):
+    if await run_in_threadpool(database.get_user_by_email, request.email):
         return LoginStatus(
             success=False,
             error="Email already registered. Please log in."
         )
     
     # Create user
-    user = database.create_user(request.name, request.email, request.password)
+    try:
+        password_salt_and_hash = await derive_password_async(request.password)
+    except KdfBusyError:
+        raise HTTPException(status_code=503, detail=KDF_BUSY_DETAIL)
+    user = await run_in_threadpool(database.create_user, request.name, request.email, password_salt_and_hash)
     return LoginStatus(
         success=True,
         user=user
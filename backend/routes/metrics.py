@@ -0,0 +1,63 @@
+"""Routes for runtime metrics."""
+
+from fastapi import APIRouter
+
+from auth import kdf_stats
+from database import pool_stats
+from embeddings import query_cache
+from facets import facet_cache
+from jobs import get_queue
+from model_dispatch import get_dispatcher
+import parse_cache
+from route_utils import login_cache
+
+# FastAPI router
+router = APIRouter()
+
+
+@router.get("/metrics/login-cache")
+def get_login_cache_metrics():
+    """Get hit/miss counters for the login token cache."""
+    return login_cache.stats()
+
+
+@router.get("/metrics/query-embedding-cache")
+def get_query_embedding_cache_metrics():
+    """Get hit/miss counters for the search query embedding cache."""
+    return query_cache.stats()
+
+
+@router.get("/metrics/facet-cache")
+def get_facet_cache_metrics():
+    """Get hit/miss counters for the closet facet cache."""
+    return facet_cache.stats()
+
+
+@router.get("/metrics/parse-cache")
+def get_parse_cache_metrics():
+    """Get hit/miss counters for the vision parse result cache."""
+    return parse_cache.stats()
+
+
+@router.get("/metrics/model")
+def get_model_metrics():
+    """Get queue depth, retry and latency statistics for model calls."""
+    return get_dispatcher().stats()
+
+
+@router.get("/metrics/kdf")
+def get_kdf_metrics():
+    """Get the load on the password hashing process pool."""
+    return kdf_stats()
+
+
+@router.get("/metrics/db-pool")
+def get_db_pool_metrics():
+    """Get checkout and wait-time statistics for the database connection pool."""
+    return pool_stats()
+
+
+@router.get("/metrics/jobs")
+def get_job_metrics():
+    """Get the depth of the background upload job queue."""
+    return get_queue().stats()
@@ -9,8 +9,10 @@ router = APIRouter()
 
 
 from sqlalchemy.orm import Session
+from sqlmodel import delete, update
+import database
 from database import get_db
-from models import OutfitBase, OutfitItem, OutfitPublic, OutfitPublicFull, OutfitUpdate, Outfit
+from models import OutfitAttribute, OutfitBase, OutfitItem, OutfitPublic, OutfitPublicFull, OutfitUpdate, Outfit, OutfitWearHistory
 
 
 @router.get("/outfits/{outfit_id}", response_model=OutfitPublicFull)
@@ -44,6 +46,10 @@ def update_outfit(outfit_id: int, outfit_update: OutfitUpdate, db: Session = Dep
     #         db.add(outfit_item)
     outfit.sqlmodel_update(outfit_data)
     db.add(outfit)
+    db.flush()
+    # The summary rows and wear history carry the outfit's owner
+    database.refresh_outfit_attributes([outfit.id], session=db)
+    db.execute(update(OutfitWearHistory).where(OutfitWearHistory.outfit_id == outfit.id).values(user_id=outfit.user_id))
     db.commit()
     db.refresh(outfit)
     return outfit
@@ -53,6 +59,7 @@ def delete_outfit(outfit_id: int, db: Session = Depends(get_db)):
     outfit = db.get(Outfit, outfit_id)
     if not outfit:
         raise HTTPException(status_code=404, detail="Outfit not found")
+    db.execute(delete(OutfitAttribute).where(OutfitAttribute.outfit_id == outfit.id))
     db.delete(outfit)
     db.commit()
     return
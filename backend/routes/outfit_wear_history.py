@@ -1,21 +1,25 @@
 """Routes for wear history management."""
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
 from sqlmodel import select
 from sqlalchemy.orm import Session, selectinload
 from database import get_db
-from models import OutfitWearHistory, OutfitWearHistoryBase, OutfitWearHistoryPublic
+from models import Outfit, OutfitWearHistory, OutfitWearHistoryBase, OutfitWearHistoryPublic
+from pagination import PageParams, paginate
+from route_utils import enforce_logged_in
 from typing import List
 
 # FastAPI router
 router = APIRouter()
 
 @router.get("/outfit_wear_history/", response_model=List[OutfitWearHistoryPublic])
-def get_all_wear_history(db: Session = Depends(get_db)):
-    histories = db.exec(select(OutfitWearHistory).options(
+def get_all_wear_history(response: Response, page: PageParams = Depends(), authorization: str = Header(...), db: Session = Depends(get_db)):
+    current_user = enforce_logged_in(authorization, db)
+
+    query = select(OutfitWearHistory).where(OutfitWearHistory.user_id == current_user.id).options(
         selectinload(OutfitWearHistory.outfit)
-    )).all()
-    return histories
+    )
+    return paginate(db, query, OutfitWearHistory.date, OutfitWearHistory.id, page, response)
 
 @router.get("/outfit_wear_history/{history_id}", response_model=OutfitWearHistoryPublic)
 def get_wear_history(history_id: int, db: Session = Depends(get_db)):
@@ -28,7 +32,10 @@ def get_wear_history(history_id: int, db: Session = Depends(get_db)):
 
 @router.post("/outfit_wear_history/", response_model=OutfitWearHistoryPublic)
 def create_wear_history(history: OutfitWearHistoryBase, db: Session = Depends(get_db)):
-    db_history = OutfitWearHistory.model_validate(history)
+    outfit = db.get(Outfit, history.outfit_id)
+    if not outfit:
+        raise HTTPException(status_code=404, detail="Outfit not found")
+    db_history = OutfitWearHistory.model_validate(history, update={"user_id": outfit.user_id})
     db.add(db_history)
     db.commit()
     db.refresh(db_history)
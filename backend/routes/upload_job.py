@@ -0,0 +1,31 @@
+"""Routes for polling background upload jobs."""
+
+import json
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlmodel import Session
+
+from database import get_db
+from models import UploadJob, UploadJobPublic
+from route_utils import enforce_logged_in
+
+# FastAPI router
+router = APIRouter()
+
+
+@router.get("/jobs/{job_id}", response_model=UploadJobPublic)
+def get_job(job_id: int, authorization: str = Header(...), db: Session = Depends(get_db)):
+    current_user = enforce_logged_in(authorization, db)
+    job = db.get(UploadJob, job_id)
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return UploadJobPublic(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        s3_url=job.s3_url,
+        result=json.loads(job.result) if job.result else None,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
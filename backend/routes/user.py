@@ -1,37 +1,100 @@
 """Routes for user management."""
 
-from fastapi import APIRouter, Header, HTTPException, Depends
-from sqlmodel import select
+from typing import Optional
 
-from route_utils import enforce_logged_in
+from fastapi import APIRouter, Header, HTTPException, Depends, Query
+from sqlalchemy.orm import Session, selectinload
+from sqlmodel import func, select
+
+from database import get_db
+from route_utils import enforce_logged_in, invalidate_user
+from streaming import stream_ndjson_sections
 
-from models import User, UserPublic, UserPublicFull, UserUpdate
+from models import User, UserPublic, UserPublicFull, UserPublicSelected, UserUpdate
 
 # FastAPI router
 router = APIRouter()
 
 @router.get("/users/me", response_model=UserPublic)
-def get_me(authorization: str = Header(...)):
-    current_user = enforce_logged_in(authorization)
+def get_me(authorization: str = Header(...), db: Session = Depends(get_db)):
+    current_user = enforce_logged_in(authorization, db)
     return current_user
 
 
-from sqlalchemy.orm import Session, selectinload
-from database import get_db
-from models import User, ClothingItem, Outfit, OutfitItem, ResaleListing, UserPublic, WearHistory
+from models import User, ClothingItem, Outfit, OutfitItem, ResaleListing, UserPublic, WearHistory, OutfitWearHistory, UserSelfie
+
+@router.get("/users/me/export")
+def export_me(authorization: str = Header(...), db: Session = Depends(get_db)):
+    """Stream everything stored for the current user as NDJSON lines of {"type", "data"}."""
+    current_user = enforce_logged_in(authorization, db)
+    user_id = current_user.id
+    user_outfit_ids = select(Outfit.id).where(Outfit.user_id == user_id)
+
+    return stream_ndjson_sections([
+        ("user", select(User.id, User.name, User.email, User.created_at).where(User.id == user_id)),
+        ("clothing_item", select(ClothingItem).where(ClothingItem.user_id == user_id).order_by(ClothingItem.id)),
+        ("outfit", select(Outfit).where(Outfit.user_id == user_id).order_by(Outfit.id)),
+        ("outfit_item", select(OutfitItem).where(OutfitItem.outfit_id.in_(user_outfit_ids)).order_by(OutfitItem.id)),
+        ("outfit_wear_history", select(OutfitWearHistory).where(OutfitWearHistory.user_id == user_id).order_by(OutfitWearHistory.id)),
+        ("resale_listing", select(ResaleListing).where(ResaleListing.user_id == user_id).order_by(ResaleListing.id)),
+        ("user_selfie", select(UserSelfie).where(UserSelfie.user_id == user_id).order_by(UserSelfie.id)),
+    ], filename="fitcheck-export.ndjson")
+
+
+# Relationships of a user that GET /users/{user_id} can include
+USER_RELATIONSHIPS = {
+    "clothing_items": (User.clothing_items, ClothingItem),
+    "outfits": (User.outfits, Outfit),
+    "resale_listings": (User.resale_listings, ResaleListing),
+}
+
+
+def parse_include(include: Optional[str]) -> list[str]:
+    """Parse a comma-separated include parameter. Leaving it out includes everything."""
+    if include is None:
+        return list(USER_RELATIONSHIPS)
+    # Keep the caller's order, without repeats
+    names = list(dict.fromkeys(name.strip() for name in include.split(",") if name.strip()))
+    unknown = [name for name in names if name not in USER_RELATIONSHIPS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot include {', '.join(unknown)}. Choose from {', '.join(USER_RELATIONSHIPS)}.")
+    return names
+
+
+@router.get("/users/{user_id}", response_model=UserPublicSelected, response_model_exclude_unset=True)
+def get_user(
+    user_id: int,
+    include: Optional[str] = Query(None, description="Comma-separated relationships to return. All of them by default."),
+    counts: bool = Query(False, description="Return the number of each included relationship instead of its rows."),
+    db: Session = Depends(get_db),
+):
+    """Get a user with the included relationships, or with a counts object mapping each one to its number of rows."""
+    names = parse_include(include)
+
+    if counts:
+        # One round trip: the user row plus a scalar count subquery per relationship
+        count_columns = [
+            select(func.count()).select_from(USER_RELATIONSHIPS[name][1]).where(USER_RELATIONSHIPS[name][1].user_id == User.id).scalar_subquery().label(name)
+            for name in names
+        ]
+        row = db.exec(select(User, *count_columns).where(User.id == user_id)).first()
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
+        data = UserPublic.model_validate(row[0]).model_dump()
+        data["counts"] = {name: count for name, count in zip(names, row[1:])}
+        return data
 
-@router.get("/users/{user_id}", response_model=UserPublicFull)
-def get_user(user_id: int, db: Session = Depends(get_db)):
     user = db.exec(select(User).where(User.id == user_id).options(
-        selectinload(User.clothing_items)
-        .selectinload(ClothingItem.wear_history)
-        , selectinload(User.outfits)
-        , selectinload(User.resale_listings)
-        )).first()
+        *(selectinload(USER_RELATIONSHIPS[name][0]) for name in names)
+    )).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    print(f"Retrieved user with ID {user.id}")
-    return user
+
+    # Only the keys set here are returned; touching another relationship would lazy-load it
+    data = UserPublic.model_validate(user).model_dump()
+    for name in names:
+        data[name] = [row.model_dump() for row in getattr(user, name)]
+    return data
 
 
 @router.patch("/users/{user_id}", response_model=UserPublicFull)
@@ -44,5 +107,6 @@ def update_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_user(user.id)
     return user
 
@@ -1,21 +1,9 @@
 
-import boto3
 import os
-import environment
 
-# Get AWS credentials from environment
-aws_access_key = environment.get("AWS_ACCESS_KEY_ID")
-aws_secret_key = environment.get("AWS_SECRET_ACCESS_KEY")
-aws_region = environment.get("AWS_DEFAULT_REGION")
-bucket_name = "hack-fitcheck"
+from clients import get_registry
 
-# Initialize S3 client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=aws_access_key,
-    aws_secret_access_key=aws_secret_key,
-    region_name=aws_region,
-)
+bucket_name = "hack-fitcheck"
 
 def add_image(local_file_path, s3_file_key=None):
     """
@@ -32,14 +20,14 @@ def add_image(local_file_path, s3_file_key=None):
         s3_file_key = os.path.basename(local_file_path)
 
     try:
-        s3_client.upload_file(local_file_path, bucket_name, s3_file_key)
+        get_registry().s3.upload_file(local_file_path, bucket_name, s3_file_key)
         return True, f"✅ File successfully uploaded to 's3://{bucket_name}/{s3_file_key}'"
     except Exception as e:
         return False, f"❌ Upload failed: {str(e)}"
 
 def add_image_obj(file, bucket_name, s3_file_key):
     try:
-        s3_client.upload_fileobj(file, bucket_name, s3_file_key)
+        get_registry().s3.upload_fileobj(file, bucket_name, s3_file_key)
         return True, f"✅ File successfully uploaded to 's3://{bucket_name}/{s3_file_key}'"
     except Exception as e:
         return False, f"❌ Upload failed: {str(e)}"
@@ -56,7 +44,7 @@ def get_image(s3_file_key, local_file_path=None):
         local_file_path = s3_file_key
 
     try:
-        s3_client.download_file(bucket_name, s3_file_key, local_file_path)
+        get_registry().s3.download_file(bucket_name, s3_file_key, local_file_path)
         return True, f"✅ File successfully downloaded to '{local_file_path}'"
     except Exception as e:
         return False, f"❌ Download failed: {str(e)}"
@@ -68,7 +56,7 @@ def delete_image(s3_file_key):
     :return: bool, str: Success status and message
     """
     try:
-        s3_client.delete_object(Bucket=bucket_name, Key=s3_file_key)
+        get_registry().s3.delete_object(Bucket=bucket_name, Key=s3_file_key)
         return True, f"✅ File '{s3_file_key}' successfully deleted from bucket"
     except Exception as e:
         return False, f"❌ Delete failed: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,50 @@
+"""Streaming NDJSON responses for large listings and exports.
+
+FastAPI's default response renders a whole list of models into one JSON
+document, so memory grows with the closet and nothing is sent until the
+last row is encoded. The responses here instead read rows from the database
+cursor in batches and send each one as a line of orjson-encoded JSON as soon
+as it is read.
+
+The response body is read after the route's dependencies are torn down, so
+each stream opens its own database session.
+"""
+
+from typing import Iterator
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+import database
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Rows fetched from the database cursor at a time
+STREAM_BATCH_SIZE = 500
+
+
+def encode_row(row, kind: str | None = None) -> bytes:
+    """Encode a model or a row of columns as one NDJSON line, optionally tagged with its kind."""
+    data = row.model_dump() if hasattr(row, "model_dump") else row._asdict()
+    if kind is not None:
+        data = {"type": kind, "data": data}
+    return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def iter_ndjson(sections: list[tuple[str | None, object]]) -> Iterator[bytes]:
+    """Run each (kind, query) in turn and yield its rows as NDJSON lines."""
+    with database.get_session() as session:
+        for kind, query in sections:
+            rows = session.exec(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+            for row in rows:
+                yield encode_row(row, kind)
+
+
+def stream_ndjson(query) -> StreamingResponse:
+    """Stream the rows of a query as NDJSON."""
+    return StreamingResponse(iter_ndjson([(None, query)]), media_type=NDJSON_MEDIA_TYPE)
+
+
+def stream_ndjson_sections(sections: list[tuple[str, object]], filename: str | None = None) -> StreamingResponse:
+    """Stream the rows of several queries as NDJSON lines of {"type": kind, "data": row}."""
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(iter_ndjson(sections), media_type=NDJSON_MEDIA_TYPE, headers=headers)
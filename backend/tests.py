@@ -1,5 +1,39 @@
+import asyncio
+import hashlib
+import io
+import json
+from datetime import datetime, timedelta
+
 import environment
 import chromadb
+import httpx
+import numpy as np
+import openai
+import pytest
+from PIL import Image
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import inspect, text
+from sqlmodel import select
+
+import auth
+import clothes_addition
+import database
+import facets
+import ids
+import image_processing
+import jobs
+import migrations
+import model_dispatch
+import models
+import pagination
+import parse_cache
+import route_utils
+from routes import clothing_item, filter, outfit_wear_history, user as user_routes
+import upload_pipeline
+import vector_store as vector_stores
+from clients import ClientRegistry
+from vector_store import EmbeddedVectorStore
 
 def test_chroma():
     '''
@@ -18,5 +52,766 @@ def test_chroma():
 
     print(results)
 
+##### Login cache #####
+
+def test_login_cache_skips_database(make_user, session, monkeypatch):
+    """A repeated login token is answered from the cache."""
+    user = make_user("Ada")
+    user_id, token = user.id, user.login_token
+    route_utils.login_cache.clear()
+    lookups = []
+    get_user_by_login_token = database.get_user_by_login_token
+    monkeypatch.setattr(database, "get_user_by_login_token", lambda *args, **kwargs: lookups.append(args) or get_user_by_login_token(*args, **kwargs))
+
+    first = route_utils.enforce_logged_in(f"Bearer {token}", session)
+    second = route_utils.enforce_logged_in(f"Bearer {token}", session)
+
+    assert first.id == second.id == user_id
+    assert first.name == "Ada"
+    assert len(lookups) == 1
+
+
+def test_login_cache_rejects_bad_tokens(make_user, session):
+    """Missing and unknown tokens are rejected, and unknown ones are not cached."""
+    make_user()
+    route_utils.login_cache.clear()
+    with pytest.raises(HTTPException) as missing:
+        route_utils.enforce_logged_in("Bearer ", session)
+    assert missing.value.status_code == 401
+    for _ in range(2):
+        with pytest.raises(HTTPException) as unknown:
+            route_utils.enforce_logged_in("Bearer not-a-token", session)
+        assert unknown.value.status_code == 400
+    assert route_utils.login_cache.stats()["size"] == 0
+
+
+def test_invalidate_user_forgets_cached_tokens(make_user, session):
+    """invalidate_user drops only the given user's entries."""
+    tokens = {user.id: user.login_token for user in (make_user("Ada"), make_user("Grace"))}
+    ada_id, grace_id = tokens
+    route_utils.login_cache.clear()
+    for token in tokens.values():
+        route_utils.enforce_logged_in(f"Bearer {token}", session)
+
+    assert route_utils.invalidate_user(ada_id) == 1
+    assert route_utils.login_cache.get(tokens[ada_id]) is None
+    assert route_utils.login_cache.get(tokens[grace_id]).id == grace_id
+
+
+##### Password hashing pool #####
+
+def test_password_hashing_runs_in_spawned_pool(monkeypatch):
+    """Passwords derive and verify in a process pool started with spawn."""
+    monkeypatch.setenv("KDF_MAX_WORKERS", "1")
+
+    async def derive_and_verify():
+        salt_and_hash = await auth.derive_password_async("hunter2")
+        return (
+            salt_and_hash,
+            await auth.verify_password_async("hunter2", salt_and_hash),
+            await auth.verify_password_async("hunter3", salt_and_hash),
+        )
+
+    try:
+        salt_and_hash, right, wrong = asyncio.run(derive_and_verify())
+        assert auth.get_executor()._mp_context.get_start_method() == "spawn"
+    finally:
+        auth.shutdown_executor()
+    assert right and not wrong
+    assert auth.verify_password("hunter2", salt_and_hash)
+    assert auth.kdf_stats()["pending"] == 0
+
+
+def test_password_hashing_refuses_work_when_busy(monkeypatch):
+    """Hashes beyond KDF_MAX_PENDING are refused instead of queued."""
+    monkeypatch.setenv("KDF_MAX_PENDING", "0")
+    with pytest.raises(auth.KdfBusyError):
+        asyncio.run(auth.derive_password_async("hunter2"))
+    assert auth.kdf_stats()["pending"] == 0
+
+
+##### Migrations #####
+
+def test_migrations_apply_once(engine):
+    """upgrade applies every migration once and records it."""
+    assert migrations.pending_migrations(engine) == []
+    assert migrations.applied_versions(engine) == {m.version for m in migrations.MIGRATIONS}
+    assert migrations.upgrade(engine) == []
+
+
+def test_migrations_are_idempotent(engine):
+    """Every migration runs again cleanly on a schema that already has its changes."""
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM schema_migrations"))
+    assert [m.version for m in migrations.upgrade(engine)] == [m.version for m in migrations.MIGRATIONS]
+
+
+def test_failed_migration_is_rolled_back(engine, make_user, monkeypatch):
+    """A migration that raises leaves no changes and is not recorded."""
+    user = make_user("Ada")
+
+    def broken(connection):
+        connection.execute(text('UPDATE "user" SET name = \'Half done\''))
+        raise RuntimeError("broken migration")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [migrations.Migration(1000, "Broken", broken)])
+    with pytest.raises(RuntimeError):
+        migrations.upgrade(engine)
+    assert 1000 not in migrations.applied_versions(engine)
+    assert database.get_user_by_id(user.id).name == "Ada"
+
+
+def test_stamp_marks_migrations_applied(engine, monkeypatch):
+    """stamp records pending migrations without running them."""
+    def never(connection):
+        raise AssertionError("stamp ran a migration")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [migrations.Migration(1000, "Stamped", never)])
+    migrations.stamp(engine)
+    assert migrations.pending_migrations(engine) == []
+
+
+def test_hot_queries_use_indexes(engine):
+    """No hot query does a full table scan on the migrated schema."""
+    assert migrations.check_full_scans(engine) == {}
+
+
+##### IDs #####
+
+def decode_id(id: int) -> tuple[int, int, int]:
+    """Split an ID into its (milliseconds, worker, sequence) fields."""
+    return (
+        id >> (ids.WORKER_BITS + ids.SEQUENCE_BITS),
+        (id >> ids.SEQUENCE_BITS) & ids.MAX_WORKER_ID,
+        id & ids.MAX_SEQUENCE,
+    )
+
+
+def test_ids_are_unique_increasing_and_exact_in_javascript():
+    """IDs from one generator strictly increase, carry its worker ID and fit in 53 bits."""
+    generator = ids.IdGenerator(worker_id=ids.MAX_WORKER_ID)
+    issued = [generator.next_id() for _ in range(10_000)]
+    assert issued == sorted(set(issued))
+    assert all(id < 2**53 for id in issued)
+    assert {decode_id(id)[1] for id in issued} == {ids.MAX_WORKER_ID}
+
+
+def test_ids_wait_for_the_next_millisecond_when_the_sequence_runs_out(monkeypatch):
+    """More IDs than the sequence holds in one millisecond spill into the next one."""
+    calls = []
+    # The clock advances one millisecond every 100 readings
+    monkeypatch.setattr(ids, "_now_ms", lambda: ids.EPOCH_MS + 1000 + len(calls.append(None) or calls) // 100)
+    generator = ids.IdGenerator(worker_id=0)
+    issued = [generator.next_id() for _ in range(ids.MAX_SEQUENCE + 2)]
+    assert len(set(issued)) == len(issued)
+    assert decode_id(issued[-1])[0] > decode_id(issued[0])[0]
+    assert decode_id(issued[-1])[2] == 0
+
+
+def test_ids_never_go_backwards_with_the_clock(monkeypatch):
+    """A clock stepping back is waited out instead of reusing timestamps."""
+    readings = iter([5000, 4000, 4500, 5000, 5000])
+    monkeypatch.setattr(ids, "_now_ms", lambda: next(readings))
+    monkeypatch.setattr(ids.time, "sleep", lambda seconds: None)
+    generator = ids.IdGenerator(worker_id=0)
+    first, second = generator.next_id(), generator.next_id()
+    assert second > first
+
+
+def test_configured_worker_id_is_validated(monkeypatch):
+    """ID_WORKER_ID must fit in the worker bits."""
+    monkeypatch.setenv("ID_WORKER_ID", str(ids.MAX_WORKER_ID + 1))
+    with pytest.raises(ValueError):
+        ids.configured_worker_id()
+    monkeypatch.setenv("ID_WORKER_ID", "7")
+    assert ids.configured_worker_id() == 7
+
+
+def test_worker_leases_are_unique_and_released(engine, session):
+    """Processes lease different worker IDs, and a released one is leased again."""
+    first, second = ids.WorkerLease(), ids.WorkerLease()
+    try:
+        assert first.worker_id != second.worker_id
+        first.release()
+        third = ids.WorkerLease()
+        assert third.worker_id == first.worker_id
+        third.release()
+    finally:
+        second.release()
+    assert session.exec(select(models.IdWorkerLease)).all() == []
+
+
+def test_expired_worker_leases_are_taken_over(engine, session, monkeypatch):
+    """A lease its owner stopped renewing is taken over."""
+    monkeypatch.setattr(ids, "MAX_WORKER_ID", 0)
+    abandoned = ids.WorkerLease()
+    with pytest.raises(RuntimeError):
+        ids.WorkerLease()
+
+    lease = session.get(models.IdWorkerLease, abandoned.worker_id)
+    lease.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    session.add(lease)
+    session.commit()
+
+    successor = ids.WorkerLease()
+    try:
+        assert successor.worker_id == abandoned.worker_id
+        assert session.get(models.IdWorkerLease, successor.worker_id, populate_existing=True).owner == successor.owner
+    finally:
+        abandoned._stop.set()
+        successor.release()
+
+
+##### Upload jobs #####
+
+PHOTO_URL = "https://hack-fitcheck.s3.amazonaws.com/photo.jpg"
+PARSED_SHIRT = {"cloth_type": "shirt", "cloth_size": "medium", "cloth_color": "blue", "cloth_description": "a blue shirt with a white logo"}
+
+
+def test_create_job_rejects_unknown_kinds(make_user, session):
+    """Only kinds with a handler can be queued."""
+    user = make_user()
+    with pytest.raises(ValueError):
+        jobs.create_job(user.id, "sock", PHOTO_URL, session)
+    assert jobs.create_job(user.id, "clothing", PHOTO_URL, session).status == jobs.JOB_QUEUED
+
+
+def test_job_runs_once(make_user, session, clients, monkeypatch):
+    """A job is claimed once, saves and indexes its items and records them as its result."""
+    monkeypatch.setattr(upload_pipeline, "parse_clothing_items", lambda *args, **kwargs: [PARSED_SHIRT])
+    user = make_user()
+    job = jobs.create_job(user.id, "clothing", PHOTO_URL, session)
+
+    assert jobs.run_job(job.id, clients)
+    assert not jobs.run_job(job.id, clients)
+
+    job = session.get(models.UploadJob, job.id, populate_existing=True)
+    assert (job.status, job.attempts) == (jobs.JOB_SUCCEEDED, 1)
+    [summary] = json.loads(job.result)
+    assert summary["category"] == "Shirt"
+    assert clients.vectors.existing_ids("clothing_items", [summary["id"]], user.id) == {summary["id"]}
+
+
+def test_job_that_cannot_index_its_items_keeps_none(make_user, session, clients, monkeypatch):
+    """Items saved by a job whose indexing fails are deleted, so a retry cannot duplicate them."""
+    def broken_add(*args, **kwargs):
+        raise RuntimeError("vector store is down")
+
+    monkeypatch.setattr(upload_pipeline, "parse_clothing_items", lambda *args, **kwargs: [PARSED_SHIRT])
+    monkeypatch.setattr(clients.vectors, "add", broken_add)
+    user = make_user()
+    job = jobs.create_job(user.id, "clothing", PHOTO_URL, session)
+
+    assert jobs.run_job(job.id, clients)
+
+    job = session.get(models.UploadJob, job.id, populate_existing=True)
+    assert (job.status, job.error) == (jobs.JOB_FAILED, "vector store is down")
+    assert session.exec(select(models.ClothingItem)).all() == []
+
+
+def test_recover_jobs_requeues_stale_jobs(make_user, session):
+    """Jobs abandoned while running are queued again, and queued jobs come back oldest first."""
+    user = make_user()
+    now = datetime.utcnow()
+    queued, stale, running = (
+        models.UploadJob(user_id=user.id, kind="clothing", s3_url=PHOTO_URL, status=status, created_at=now + timedelta(seconds=i), updated_at=updated_at)
+        for i, (status, updated_at) in enumerate([
+            (jobs.JOB_QUEUED, now),
+            (jobs.JOB_RUNNING, now - jobs.JOB_STALE_AFTER - timedelta(minutes=1)),
+            (jobs.JOB_RUNNING, now),
+        ])
+    )
+    session.add_all([queued, stale, running])
+    session.commit()
+
+    assert jobs.recover_jobs(10) == [queued.id, stale.id]
+    assert jobs.recover_jobs(1) == [queued.id]
+    assert session.get(models.UploadJob, running.id, populate_existing=True).status == jobs.JOB_RUNNING
+
+
+def test_fail_job(make_user, session):
+    """fail_job marks a job that will not run as failed."""
+    job = jobs.create_job(make_user().id, "clothing", PHOTO_URL, session)
+    jobs.fail_job(job.id, "The upload queue was full.", session)
+    job = session.get(models.UploadJob, job.id, populate_existing=True)
+    assert (job.status, job.error) == (jobs.JOB_FAILED, "The upload queue was full.")
+    assert not jobs.run_job(job.id)
+
+
+def test_job_queue_skips_duplicates_and_refuses_overflow():
+    """A job already in the queue is not queued twice, and a full queue raises."""
+    queue = jobs.JobQueue(concurrency=1, max_size=1)
+    queue.submit(1)
+    queue.submit(1)
+    with pytest.raises(jobs.JobQueueFullError):
+        queue.submit(2)
+    assert queue.stats()["queued"] == 1
+
+
+def test_job_queue_drains_a_backlog_larger_than_itself(make_user, session, clients, monkeypatch):
+    """Polling picks up every queued job, even ones that never fit in the queue."""
+    monkeypatch.setitem(jobs.JOB_HANDLERS, "clothing", lambda clients, job, session: {"job": job.id})
+    user = make_user()
+    job_ids = [jobs.create_job(user.id, "clothing", PHOTO_URL, session).id for _ in range(5)]
+
+    def succeeded():
+        with database.get_session() as session:
+            return session.exec(select(models.UploadJob.id).where(models.UploadJob.status == jobs.JOB_SUCCEEDED)).all()
+
+    async def drain():
+        queue = jobs.JobQueue(concurrency=2, max_size=2, clients=clients, poll_seconds=0.01)
+        await queue.start()
+        try:
+            for _ in range(500):
+                if len(succeeded()) == len(job_ids):
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+    asyncio.run(drain())
+    assert sorted(succeeded()) == sorted(job_ids)
+
+
+##### Image release #####
+
+class DeletedObjects(list):
+    """An S3 client stand-in that records the keys it is asked to delete."""
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.append(Key)
+
+
+def test_images_in_use_by_unfinished_jobs_are_kept(make_user, session):
+    """An image is deleted only once no job that will parse it or its vision copy is queued or running."""
+    user = make_user()
+    digest = "ab" * 32
+    s3_url = upload_pipeline.object_url(f"{digest}.jpg")
+    vision_url = upload_pipeline.object_url(f"vision/{digest}.jpg")
+    upload_pipeline.record_stored_image(digest, s3_url, vision_url, 100, session)
+    job = jobs.create_job(user.id, "clothing", s3_url, session, vision_url)
+    deleted = DeletedObjects()
+    clients = ClientRegistry(s3=deleted)
+
+    assert not upload_pipeline.release_image(clients, s3_url, session)
+    job.status = jobs.JOB_RUNNING
+    job.s3_url = PHOTO_URL
+    session.add(job)
+    session.commit()
+    assert not upload_pipeline.release_image(clients, s3_url, session)
+    assert deleted == []
+
+    job.status = jobs.JOB_SUCCEEDED
+    session.add(job)
+    session.commit()
+    assert upload_pipeline.release_image(clients, s3_url, session)
+    assert deleted == [f"{digest}.jpg", f"vision/{digest}.jpg"]
+    assert session.get(models.StoredImage, digest) is None
+
+
+##### Parse cache #####
+
+def counting_parse(results: list):
+    """A parse function that records each call and returns its count."""
+    def parse():
+        results.append(len(results) + 1)
+        return {"parse": len(results)}
+    return parse
+
+
+def test_parse_cache_reuses_results(engine, session):
+    """A digest, model and prompt version is parsed once; without a digest every call parses."""
+    calls = []
+    parse = counting_parse(calls)
+
+    assert parse_cache.get_or_parse("a" * 64, "model", "prompt/1", parse, session) == {"parse": 1}
+    assert parse_cache.get_or_parse("a" * 64, "model", "prompt/1", parse, session) == {"parse": 1}
+    assert parse_cache.get_or_parse("a" * 64, "model", "prompt/2", parse, session) == {"parse": 2}
+    assert parse_cache.get_or_parse(None, "model", "prompt/1", parse, session) == {"parse": 3}
+    assert parse_cache.get_or_parse(None, "model", "prompt/1", parse, session) == {"parse": 4}
+
+
+def test_parse_cache_evicts_least_recently_used(engine, session):
+    """Eviction keeps the most recently used entries, counting reads as use."""
+    for age, digest in enumerate(("old", "older", "oldest")):
+        parse_cache.put(digest, "model", "prompt/1", [digest], session)
+        session.get(models.ParseCacheEntry, (digest, "model", "prompt/1")).last_used_at = datetime(2025, 1, 1) - timedelta(days=age)
+    session.commit()
+    assert parse_cache.get("oldest", "model", "prompt/1", session) == ["oldest"]
+
+    assert parse_cache.evict(limit=2, session=session) == 1
+    assert parse_cache.get("older", "model", "prompt/1", session) is None
+    assert parse_cache.get("old", "model", "prompt/1", session) == ["old"]
+    assert parse_cache.evict(limit=2, session=session) == 0
+
+
+def test_parse_cache_evicts_as_it_fills(engine, session, monkeypatch):
+    """Every PARSE_CACHE_EVICT_EVERY new entries, the cache is cut back to its size limit."""
+    monkeypatch.setattr(parse_cache, "PARSE_CACHE_EVICT_EVERY", 2)
+    monkeypatch.setattr(parse_cache, "_inserts_since_eviction", 0)
+    monkeypatch.setenv("PARSE_CACHE_MAX_ENTRIES", "1")
+
+    parse_cache.put("first", "model", "prompt/1", [], session)
+    assert session.exec(select(models.ParseCacheEntry)).all() != []
+    parse_cache.put("second", "model", "prompt/1", [], session)
+    assert len(session.exec(select(models.ParseCacheEntry)).all()) == 1
+
+
+class UploadedObjects(dict):
+    """An S3 client stand-in that keeps the objects uploaded to it by key."""
+
+    def upload_fileobj(self, file, bucket: str, key: str, ExtraArgs: dict | None = None):
+        self[key] = file.read()
+
+
+def test_parses_are_cached_per_vision_copy(make_user, session, clients, monkeypatch):
+    """Copies of one photo made with different vision settings are parsed separately."""
+    photo = io.BytesIO()
+    Image.new("RGB", (64, 48), "blue").save(photo, format="PNG")
+    uploaded = UploadedObjects()
+    clients = ClientRegistry(s3=uploaded, openai=object(), vectors=clients.vectors)
+    vision_urls = [
+        upload_pipeline.store_vision_image(clients, image_processing.prepare_vision_image(photo.getvalue(), max_dimension, image_format))
+        for max_dimension, image_format in ((32, "JPEG"), (16, "JPEG"), (32, "WEBP"))
+    ]
+    assert len(set(vision_urls)) == 3
+    for url in vision_urls:
+        data = uploaded[url.split(".amazonaws.com/", 1)[1]]
+        assert upload_pipeline.digest_from_url(url) == hashlib.sha256(data).hexdigest()
+
+    parsed_urls = []
+
+    def parse(url, client):
+        parsed_urls.append(url)
+        return [PARSED_SHIRT]
+
+    monkeypatch.setattr(clothes_addition, "_parse_clothing_items", parse)
+    user = make_user()
+    for vision_url in vision_urls + vision_urls:
+        upload_pipeline.process_clothing_upload(clients, user.id, PHOTO_URL, session, vision_url=vision_url)
+    assert parsed_urls == vision_urls
+
+
+##### Model dispatch #####
+
+def flaky_create(failures: int, error: Exception):
+    """A model call that raises error on its first failures attempts, then returns the timeouts it was given."""
+    timeouts = []
+
+    def create(**kwargs):
+        timeouts.append(kwargs["timeout"])
+        if len(timeouts) <= failures:
+            raise error
+        return timeouts
+    return create
+
+
+CONNECTION_ERROR = openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    """A dispatcher allowing 3 attempts in 5 seconds, without waiting between them."""
+    monkeypatch.setattr(model_dispatch, "RETRY_WAIT_MULTIPLIER_SECONDS", 0.001)
+    return model_dispatch.ModelDispatcher(max_concurrency=2, rate_per_second=1000, burst=10, max_attempts=3, deadline_seconds=5)
+
+
+def test_dispatcher_retries_transient_errors(dispatcher):
+    """Connection errors are retried, and each attempt's timeout ends by the deadline."""
+    timeouts = dispatcher.call(flaky_create(2, CONNECTION_ERROR), model="fake")
+
+    assert len(timeouts) == 3
+    assert all(0 < timeout <= 5 for timeout in timeouts)
+    assert timeouts == sorted(timeouts, reverse=True)
+    stats = dispatcher.stats()
+    assert (stats["calls"], stats["retries"], stats["failures"], stats["in_flight"]) == (1, 2, 0, 0)
+
+
+def test_dispatcher_gives_up_after_max_attempts(dispatcher):
+    """A call failing every attempt raises ModelUnavailableError; other errors are not retried."""
+    create = flaky_create(3, CONNECTION_ERROR)
+    with pytest.raises(model_dispatch.ModelUnavailableError):
+        dispatcher.call(create)
+    with pytest.raises(ValueError):
+        dispatcher.call(flaky_create(1, ValueError("bad request")))
+
+    stats = dispatcher.stats()
+    assert (stats["calls"], stats["retries"], stats["failures"]) == (2, 2, 1)
+
+
+def test_dispatcher_deadline_covers_waiting_for_the_rate_limit():
+    """A call that cannot get a request slot before its deadline fails without being made."""
+    dispatcher = model_dispatch.ModelDispatcher(max_concurrency=2, rate_per_second=0.1, burst=1, max_attempts=3, deadline_seconds=0.2)
+    create = flaky_create(0, CONNECTION_ERROR)
+    timeouts = dispatcher.call(create)
+
+    start = datetime.now()
+    with pytest.raises(model_dispatch.ModelUnavailableError):
+        dispatcher.call(create)
+    assert datetime.now() - start < timedelta(seconds=1)
+    assert len(timeouts) == 1
+    assert dispatcher.stats()["failures"] == 1
+
+
+##### Database reset #####
+
+def test_reset_reapplies_every_migration(engine, make_user, session, monkeypatch):
+    """Resetting a populated database empties it and re-creates what only migrations create."""
+    def add_migration_only_index(connection):
+        migrations.create_index(connection, "ix_test_clothingitem_description", "clothingitem", ["description"])
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [migrations.Migration(1000, "Migration-only index", add_migration_only_index)])
+    migrations.upgrade(engine)
+    user = make_user()
+    database.add_clothing_item(user.id, "a blue shirt", "M", "blue", PHOTO_URL, None, None, "Shirt", session)
+    session.commit()
+
+    models.reset_database(engine)
+
+    assert session.exec(select(models.User)).all() == []
+    assert migrations.pending_migrations(engine) == []
+    assert "ix_test_clothingitem_description" in {index["name"] for index in inspect(engine).get_indexes("clothingitem")}
+
+
+##### Vector stores #####
+
+def add_closet(vector_store):
+    """Store a few clothing items for users 1 and 2."""
+    vector_store.add(
+        "clothing_items",
+        ids=["1", "2", "3", "4"],
+        documents=["blue denim jacket", "red wool sweater", "black leather boots", "blue denim jeans"],
+        metadatas=[{"user_id": 1, "color": "blue"}, {"user_id": 1, "color": "red"}, {"user_id": 1, "color": "black"}, {"user_id": 2, "color": "blue"}],
+    )
+
+
+def test_vector_query_finds_only_the_users_nearest_items(vector_store):
+    """Queries rank a user's own items by similarity and never return another user's."""
+    add_closet(vector_store)
+    results = vector_store.query("clothing_items", texts=["denim jacket", "wool sweater"], n_results=2, user_id=1)
+    assert [ids[0] for ids in results["ids"]] == ["1", "2"]
+    assert all(len(ids) == 2 and "4" not in ids for ids in results["ids"])
+    assert all(distances == sorted(distances) for distances in results["distances"])
+    assert vector_store.query("clothing_items", texts=["denim"], n_results=5, user_id=2)["ids"] == [["4"]]
+    assert vector_store.query("clothing_items", texts=["denim"], n_results=5, user_id=3)["ids"] == [[]]
+
+
+def test_vector_update_metadata_moves_items_between_users(vector_store):
+    """Changing an item's user_id makes it searchable by its new owner only."""
+    add_closet(vector_store)
+    vector_store.update_metadata("clothing_items", ids=["2", "1"], metadatas=[{"user_id": 1, "color": "green"}, {"user_id": 2, "color": "blue"}])
+
+    assert vector_store.query("clothing_items", texts=["denim jacket"], n_results=1, user_id=2)["ids"] == [["1"]]
+    assert "1" not in vector_store.query("clothing_items", texts=["denim jacket"], n_results=3, user_id=1)["ids"][0]
+    assert vector_store.existing_ids("clothing_items", ["1", "2", "5"]) == {"1", "2"}
+    assert sorted(vector_store.query("clothing_items", texts=["denim"], n_results=5, user_id=2)["ids"][0]) == ["1", "4"]
+
+
+def test_vector_delete_and_clear(vector_store):
+    """delete removes only the given IDs, and clear empties the collection."""
+    add_closet(vector_store)
+    vector_store.delete("clothing_items", ids=["1"], user_id=1)
+    assert vector_store.existing_ids("clothing_items", ["1", "2", "3", "4"]) == {"2", "3", "4"}
+    vector_store.clear("clothing_items")
+    assert vector_store.existing_ids("clothing_items", ["1", "2", "3", "4"]) == set()
+
+
+def test_embedded_store_sees_other_processes_writes(tmp_path, fake_embeddings):
+    """A store reloads a partition another store on the same path has changed."""
+    first, second = (EmbeddedVectorStore(str(tmp_path)) for _ in range(2))
+    add_closet(first)
+    assert second.existing_ids("clothing_items", ["1"], user_id=1) == {"1"}
+    second.delete("clothing_items", ids=["1"], user_id=1)
+    first.update_metadata("clothing_items", ids=["2"], metadatas=[{"user_id": 2}])
+    assert first.existing_ids("clothing_items", ["1", "2", "3"], user_id=1) == {"3"}
+    assert second.existing_ids("clothing_items", ["2", "4"], user_id=2) == {"2", "4"}
+
+
+def test_hnsw_search_matches_brute_force(monkeypatch):
+    """Above HNSW_THRESHOLD, search returns the exact nearest neighbours on a small index."""
+    monkeypatch.setattr(vector_stores, "HNSW_THRESHOLD", 50)
+    vectors = np.random.default_rng(0).standard_normal((200, 16)).astype(np.float32)
+    partition = vector_stores._Partition([str(i) for i in range(200)], vectors, [{} for _ in range(200)])
+    positions, distances = partition.search(vectors[:10] + 0.001, 3)
+    assert partition.hnsw is not None
+    assert [row[0] for row in positions] == list(range(10))
+    brute_force = np.sort(((vectors[:10, None, :] + 0.001 - vectors[None, :, :]) ** 2).sum(axis=2), axis=1)[:, :3]
+    assert np.allclose(distances, brute_force, atol=1e-3)
+
+
+##### Pagination #####
+
+def api(*routers) -> TestClient:
+    """A test client for an app serving only the given routers."""
+    app = FastAPI()
+    for router in routers:
+        app.include_router(router)
+    return TestClient(app)
+
+
+def fetch_all_pages(client: TestClient, method: str, url: str, token: str, limit: int, **kwargs) -> list[list[dict]]:
+    """Follow X-Next-Cursor from the first page to the last, like the frontend does."""
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit} | ({"cursor": cursor} if cursor else {})
+        response = client.request(method, url, params=params, headers={"Authorization": f"Bearer {token}"}, **kwargs)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    """A cursor decodes to the position it was made from, and garbage is a 400."""
+    position = (datetime(2025, 3, 1, 12, 30, 15, 250), 2**52)
+    assert pagination.decode_cursor(pagination.encode_cursor(*position)) == position
+    with pytest.raises(HTTPException) as invalid:
+        pagination.decode_cursor("not a cursor")
+    assert invalid.value.status_code == 400
+
+
+def test_pages_cover_every_row_once_newest_first(make_user, session):
+    """Paging visits each of the user's items once, breaking timestamp ties by ID."""
+    user, other = make_user("Ada"), make_user("Grace")
+    token = user.login_token
+    same_time = datetime(2025, 1, 1)
+    items = [
+        models.ClothingItem(user_id=user.id, category="Shirt", description=f"item {i}", created_at=same_time if i < 3 else same_time + timedelta(days=i))
+        for i in range(7)
+    ]
+    session.add_all(items + [models.ClothingItem(user_id=other.id, category="Shirt", description="someone else's")])
+    session.commit()
+
+    pages = fetch_all_pages(api(filter.router), "POST", "/by-field", token, limit=3, json={})
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    newest_first = sorted(items, key=lambda item: (item.created_at, item.id), reverse=True)
+    assert [row["id"] for page in pages for row in page] == [item.id for item in newest_first]
+
+
+def test_wear_history_pages_only_the_users_outfits(make_user, session):
+    """A user's wear history pages through their own outfits only."""
+    user, other = make_user("Ada"), make_user("Grace")
+    token = user.login_token
+    outfits = [models.Outfit(user_id=owner.id, description="outfit") for owner in (user, other)]
+    session.add_all(outfits)
+    session.flush()
+    session.add_all(
+        models.OutfitWearHistory(outfit_id=outfit.id, user_id=outfit.user_id, date=datetime(2025, 1, 1) + timedelta(days=day))
+        for outfit in outfits for day in range(5)
+    )
+    session.commit()
+
+    pages = fetch_all_pages(api(outfit_wear_history.router), "GET", "/outfit_wear_history/", token, limit=2)
+
+    rows = [row for page in pages for row in page]
+    assert len(rows) == 5
+    assert {row["outfit_id"] for row in rows} == {outfits[0].id}
+    assert [row["date"] for row in rows] == sorted((row["date"] for row in rows), reverse=True)
+
+
+##### User aggregate #####
+
+USER_FIELDS = {"id", "name", "email", "created_at"}
+
+
+def test_get_user_returns_only_included_relationships(make_user, session):
+    """include= picks the relationships returned, with every field of their rows."""
+    user = make_user("Ada")
+    item = database.add_clothing_item(user.id, "a blue shirt", "M", "blue", PHOTO_URL, None, None, "Shirt", session)
+    session.commit()
+    client = api(user_routes.router)
+
+    body = client.get(f"/users/{user.id}", params={"include": "clothing_items"}).json()
+    assert body.keys() == USER_FIELDS | {"clothing_items"}
+    assert body["clothing_items"] == [json.loads(item.model_dump_json())]
+    assert client.get(f"/users/{user.id}").json().keys() == USER_FIELDS | {"clothing_items", "outfits", "resale_listings"}
+    assert client.get(f"/users/{user.id}", params={"include": "closet"}).status_code == 400
+    assert client.get(f"/users/{user.id + 1}").status_code == 404
+
+
+def test_get_user_counts(make_user, session):
+    """counts=true returns the number of rows of each included relationship, in the order asked for."""
+    user = make_user("Ada")
+    for color in ("blue", "red"):
+        database.add_clothing_item(user.id, f"a {color} shirt", "M", color, PHOTO_URL, None, None, "Shirt", session)
+    session.commit()
+
+    body = api(user_routes.router).get(f"/users/{user.id}", params={"include": "outfits,clothing_items,outfits", "counts": "true"}).json()
+    assert body.keys() == USER_FIELDS | {"counts"}
+    assert list(body["counts"].items()) == [("outfits", 0), ("clothing_items", 2)]
+
+
+def test_get_user_schema_describes_both_shapes():
+    """The OpenAPI schema of GET /users/{user_id} has optional relationships and counts."""
+    app = FastAPI()
+    app.include_router(user_routes.router)
+    schema = app.openapi()
+    response = schema["paths"]["/users/{user_id}"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert response == {"$ref": "#/components/schemas/UserPublicSelected"}
+    properties = schema["components"]["schemas"]["UserPublicSelected"]["properties"]
+    assert {"clothing_items", "outfits", "resale_listings", "counts"} <= properties.keys()
+
+
+##### Facets #####
+
+def category_counts(user_id: int, session) -> dict[str, int]:
+    """The user's facet counts of categories, as a new request would see them."""
+    session.commit()
+    return {row["value"]: row["count"] for row in facets.get_facets(user_id, session)["category"]}
+
+
+def test_facets_are_cached_until_the_closet_changes(make_user, session):
+    """Counting again is skipped until an item is added through the API."""
+    user = make_user("Ada")
+    database.add_clothing_item(user.id, "a blue shirt", "M", "blue", PHOTO_URL, None, None, "Shirt", session)
+    session.commit()
+    facets.facet_cache.clear()
+
+    assert category_counts(user.id, session) == {"Shirt": 1}
+    hits = facets.facet_cache.hits
+    assert category_counts(user.id, session) == {"Shirt": 1}
+    assert facets.facet_cache.hits == hits + 1
+
+    response = api(clothing_item.router).post("/clothing_items/", json={"user_id": user.id, "category": "Pants", "s3url": PHOTO_URL})
+    assert response.status_code == 200
+    assert category_counts(user.id, session) == {"Pants": 1, "Shirt": 1}
+
+
+def test_facets_see_writes_made_by_other_workers(engine, make_user, session):
+    """A write committed elsewhere invalidates the counts cached here, but not other users' counts."""
+    user, other = make_user("Ada"), make_user("Grace")
+    facets.facet_cache.clear()
+    assert category_counts(user.id, session) == {}
+    assert category_counts(other.id, session) == {}
+
+    # Another worker has its own session and would invalidate only its own cache
+    with database.get_session() as elsewhere:
+        elsewhere.add(models.ClothingItem(user_id=user.id, category="Shirt"))
+        facets.invalidate_facets(user.id, elsewhere)
+        elsewhere.commit()
+
+    assert category_counts(user.id, session) == {"Shirt": 1}
+    hits = facets.facet_cache.hits
+    assert category_counts(other.id, session) == {}
+    assert facets.facet_cache.hits == hits + 1
+
+
+def test_invalidation_is_undone_with_its_transaction(make_user, session):
+    """The version bump is part of the write, so a rolled back write leaves the cache valid."""
+    user = make_user("Ada")
+    facets.facet_cache.clear()
+    assert category_counts(user.id, session) == {}
+
+    session.add(models.ClothingItem(user_id=user.id, category="Shirt"))
+    facets.invalidate_facets(user.id, session)
+    session.rollback()
+
+    hits = facets.facet_cache.hits
+    assert category_counts(user.id, session) == {}
+    assert facets.facet_cache.hits == hits + 1
+
+
 if __name__ == '__main__':
     test_chroma()
\ No newline at end of file
@@ -0,0 +1,286 @@
+"""Blocking stages of the image and outfit upload pipelines.
+
+Each stage is a plain function that does S3, database or vector store I/O, so the
+async upload routes can run it off the event loop with run_in_threadpool.
+"""
+
+import hashlib
+import io
+import os
+import re
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, or_, select
+
+import database
+from clients import ClientRegistry
+from facets import invalidate_facets
+from clothes_addition import parse_clothing_items
+from image_processing import VisionImage
+from models import ClothingItem, Outfit, OutfitItem, StoredImage, UploadJob, UserSelfie
+
+BUCKET_NAME = "hack-fitcheck"
+HASH_CHUNK_SIZE = 1024 * 1024
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+def hash_file(file) -> tuple[str, int]:
+    """Get the SHA-256 hex digest and size of a file, reading it in chunks, then rewind it."""
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def content_key(digest: str, filename: str | None) -> str:
+    """Get the S3 key of an upload from its digest, keeping the file extension."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    return f"{digest}{extension}"
+
+
+def object_url(key: str) -> str:
+    """Get the public URL of an S3 object."""
+    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
+
+
+def digest_from_url(url: str) -> str | None:
+    """Get the content digest of an image from its S3 URL, or None for images stored before content addressing."""
+    stem = os.path.splitext(url.rsplit("/", 1)[-1])[0]
+    return stem if DIGEST_PATTERN.fullmatch(stem) else None
+
+
+def find_stored_image(digest: str, session: Session) -> StoredImage | None:
+    """Get the stored image with a digest, if it was uploaded before."""
+    return session.get(StoredImage, digest)
+
+
+def record_stored_image(digest: str, s3_url: str, vision_url: str | None, size: int, session: Session) -> StoredImage:
+    """Add an image to the index, or fill in its vision_url, leaving the commit to the caller.
+
+    Safe against concurrent identical uploads.
+    """
+    existing = session.get(StoredImage, digest)
+    if existing is None:
+        stored = StoredImage(digest=digest, s3_url=s3_url, vision_url=vision_url, size=size)
+        try:
+            with session.begin_nested():
+                session.add(stored)
+        except IntegrityError:
+            # Another request stored the same image first; the objects are identical
+            pass
+        return stored
+    if existing.vision_url is None and vision_url is not None:
+        existing.vision_url = vision_url
+        session.add(existing)
+        session.flush()
+    return existing
+
+
+def store_image(clients: ClientRegistry, file, filename: str, digest: str) -> str:
+    """Upload an image file to S3 under its content key and return its URL."""
+    file_name = content_key(digest, filename)
+    clients.s3.upload_fileobj(file, BUCKET_NAME, file_name)
+    return object_url(file_name)
+
+
+def image_in_use(s3_url: str, session: Session, stored: StoredImage | None = None) -> bool:
+    """Check whether any clothing item, outfit or selfie still shows an image, or an unfinished job will parse it.
+
+    stored is the image's StoredImage, whose vision copy unfinished jobs may parse too.
+    """
+    # jobs imports this module
+    from jobs import JOB_QUEUED, JOB_RUNNING
+
+    parsed_urls = [s3_url] + ([stored.s3_url] if stored is not None else [])
+    vision_urls = [stored.vision_url] if stored is not None and stored.vision_url else []
+    active_jobs = select(UploadJob.id).where(
+        UploadJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+        or_(UploadJob.s3_url.in_(parsed_urls), UploadJob.vision_url.in_(vision_urls)),
+    )
+    return any(session.exec(query.limit(1)).first() is not None for query in (
+        select(ClothingItem.id).where(ClothingItem.s3url == s3_url),
+        select(Outfit.id).where(Outfit.s3url == s3_url),
+        select(UserSelfie.id).where(UserSelfie.image_url == s3_url),
+        active_jobs,
+    ))
+
+
+def release_image(clients: ClientRegistry, s3_url: str, session: Session) -> bool:
+    """Delete an image and its vision copy from S3 once nothing uses it. Returns whether it was deleted."""
+    if not s3_url:
+        return False
+    digest = digest_from_url(s3_url)
+    stored = session.get(StoredImage, digest) if digest is not None else None
+    if image_in_use(s3_url, session, stored):
+        return False
+    key = s3_url.rsplit("/", 1)[-1]
+
+    clients.s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+    if stored is not None:
+        if stored.vision_url:
+            clients.s3.delete_object(Bucket=BUCKET_NAME, Key=stored.vision_url.split(".amazonaws.com/", 1)[-1])
+        session.delete(stored)
+        session.commit()
+    return True
+
+
+def store_vision_image(clients: ClientRegistry, image: VisionImage) -> str:
+    """Upload the vision model's copy of an image and return its URL.
+
+    The copy is keyed by its own digest, which changes with the vision
+    settings, so parses cached under it are never reused for a different copy.
+    """
+    file_name = f"vision/{hashlib.sha256(image.data).hexdigest()}.{image.extension}"
+    clients.s3.upload_fileobj(io.BytesIO(image.data), BUCKET_NAME, file_name, ExtraArgs={"ContentType": image.content_type})
+    return object_url(file_name)
+
+
+def clothing_item_document(item: ClothingItem) -> str:
+    """Get the text that is embedded in Chroma for a clothing item."""
+    fields = [item.description, item.size, item.color, item.style, item.brand, item.category]
+    return "".join(field or "" for field in fields)
+
+
+def clothing_item_metadata(item: ClothingItem) -> dict:
+    """Get the Chroma metadata for a clothing item, used to filter queries by user."""
+    metadata = {"user_id": item.user_id, "category": item.category, "color": item.color}
+    # Chroma rejects None metadata values
+    return {key: value for key, value in metadata.items() if value is not None}
+
+
+def outfit_metadata(outfit: Outfit) -> dict:
+    """Get the Chroma metadata for an outfit, used to filter queries by user."""
+    return {"user_id": outfit.user_id}
+
+
+def save_clothing_items(user_id: int, s3_url: str, parsed_items: list, session: Session) -> list[ClothingItem]:
+    """Insert the clothing items parsed from an image and commit them."""
+    items = []
+    for item in parsed_items:
+        items.append(database.add_clothing_item(
+            user_id=user_id,
+            description=item["cloth_description"],
+            size=item["cloth_size"],
+            color=item["cloth_color"],
+            s3url=s3_url,
+            style=None,
+            brand=None,
+            category=item["cloth_type"].capitalize(),
+            session=session,
+        ))
+    invalidate_facets(user_id, session)
+    session.commit()
+    return items
+
+
+def discard_clothing_items(clients: ClientRegistry, user_id: int, items: list[ClothingItem], session: Session):
+    """Delete just saved clothing items and any vectors stored for them, and commit."""
+    for item in items:
+        session.delete(item)
+    invalidate_facets(user_id, session)
+    session.commit()
+    try:
+        clients.vectors.delete("clothing_items", ids=[str(item.id) for item in items], user_id=user_id)
+    except Exception as e:
+        print(f"Could not delete vectors of discarded clothing items: {e}")
+
+
+def index_clothing_items(clients: ClientRegistry, items: list[ClothingItem]):
+    """Add clothing items to the vector collection used for search."""
+    clients.vectors.add(
+        "clothing_items",
+        ids=[str(item.id) for item in items],
+        documents=[clothing_item_document(item) for item in items],
+        metadatas=[clothing_item_metadata(item) for item in items],
+    )
+
+
+def clothing_item_summary(item: ClothingItem) -> dict:
+    """Get the fields of a new clothing item that are returned to the client."""
+    return {
+        "id": str(item.id),
+        "category": item.category,
+        "description": item.description,
+    }
+
+
+def process_clothing_upload(clients: ClientRegistry, user_id: int, s3_url: str, session: Session, vision_url: str | None = None) -> list[dict]:
+    """Parse a stored clothing photo, save the items it contains and index them.
+
+    The model is sent vision_url, the downscaled copy, when there is one. An
+    earlier parse of the same image as sent to the model is reused. The session's connection goes
+    back to the pool during the model call. Items that cannot be indexed are
+    deleted again before the error is raised.
+    """
+    database.release_connection(session)
+    url = vision_url or s3_url
+    parsed_items = parse_clothing_items(url, clients.openai, digest=digest_from_url(url), session=session)
+    items = save_clothing_items(user_id, s3_url, parsed_items, session)
+    try:
+        index_clothing_items(clients, items)
+    except Exception:
+        # Otherwise retrying the job or uploading the photo again would save them twice
+        discard_clothing_items(clients, user_id, items, session)
+        raise
+    return [clothing_item_summary(item) for item in items]
+
+
+def match_outfit_items(clients: ClientRegistry, user_id: int, parsed_items: list, session: Session) -> list[str]:
+    """Find the user's closest existing clothing item for each parsed garment.
+
+    All garments are matched with one vector query and one ownership query.
+    """
+    if not parsed_items:
+        return []
+    results = clients.vectors.query(
+        "clothing_items",
+        texts=[item["cloth_description"] for item in parsed_items],
+        n_results=3,
+        user_id=user_id,
+    )
+
+    candidate_ids = {int(result) for results_ids in results['ids'] for result in results_ids if result.isdigit()}
+    owned_ids = {item.id for item in database.get_user_clothing_items_by_ids(user_id, list(candidate_ids), session=session)}
+
+    matched_ids = []
+    for results_ids in results['ids']:
+        for result in results_ids:
+            if result.isdigit() and int(result) in owned_ids:
+                matched_ids.append(result)
+                break
+    return matched_ids
+
+
+def find_uploaded_outfit(user_id: int, s3_url: str, session: Session) -> tuple[Outfit, list[str]] | None:
+    """Get a user's outfit made from an image, with its clothing item IDs, if there is one."""
+    outfit = session.exec(select(Outfit).where(Outfit.s3url == s3_url, Outfit.user_id == user_id).limit(1)).first()
+    if outfit is None:
+        return None
+    clothing_item_ids = session.exec(select(OutfitItem.clothing_item_id).where(OutfitItem.outfit_id == outfit.id)).all()
+    return outfit, [str(clothing_item_id) for clothing_item_id in clothing_item_ids]
+
+
+def save_outfit(user_id: int, description, s3_url: str, clothing_item_ids: list[str], session: Session) -> Outfit:
+    """Insert an outfit, link its clothing items and mark them worn in one commit."""
+    outfit = database.create_outfit_with_items(
+        user_id=user_id,
+        description=description,
+        s3url=s3_url,
+        clothing_item_ids=[int(clothing_item_id) for clothing_item_id in clothing_item_ids],
+        session=session,
+    )
+    session.commit()
+    return outfit
+
+
+def index_outfit(clients: ClientRegistry, outfit: Outfit):
+    """Add an outfit to the vector collection used for search."""
+    clients.vectors.add(
+        "outfits",
+        ids=[str(outfit.id)],
+        documents=[outfit.description],
+        metadatas=[outfit_metadata(outfit)],
+    )
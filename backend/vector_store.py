@@ -0,0 +1,356 @@
+"""Vector stores used for clothing item and outfit similarity search.
+
+Two backends share the VectorStore interface, selected with VECTOR_STORE:
+
+    chroma    (default) the remote Chroma server at CHROMA_DB_ADDRESS
+    embedded  in-process, per-user embedding matrices stored under
+              VECTOR_STORE_PATH (default: vector_data)
+
+The embedded store searches a user's vectors by brute force with NumPy, and
+switches to an HNSW index from chroma-hnswlib once a user has more than
+HNSW_THRESHOLD vectors. Distances are squared L2, like Chroma's default.
+Every web process may use the same VECTOR_STORE_PATH on one machine; writes
+are serialized with file locks.
+
+Both backends embed query texts through embeddings.embed_queries, so repeated
+searches reuse a cached embedding.
+
+Query results use Chroma's shape: {"ids": [[...]], "distances": [[...]]},
+one inner list per query text.
+
+Run this file directly to benchmark the embedded search offline.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+from contextlib import ExitStack, contextmanager
+from threading import Lock
+
+import hnswlib
+import numpy as np
+
+import embeddings
+
+HNSW_THRESHOLD = 2000
+HNSW_EF_CONSTRUCTION = 200
+HNSW_M = 16
+# Fixed, since changing it on a shared index would race with other searches
+HNSW_EF_SEARCH = 100
+
+
+class VectorStore:
+    """Interface shared by the vector store backends."""
+
+    def add(self, collection: str, ids: list[str], documents: list[str], metadatas: list[dict]):
+        """Embed and store documents. Every metadata dict must include user_id."""
+        raise NotImplementedError
+
+    def update_metadata(self, collection: str, ids: list[str], metadatas: list[dict]):
+        """Replace the metadata of stored vectors."""
+        raise NotImplementedError
+
+    def existing_ids(self, collection: str, ids: list[str], user_id: int | None = None) -> set[str]:
+        """Get which of the given IDs have a stored vector."""
+        raise NotImplementedError
+
+    def delete(self, collection: str, ids: list[str], user_id: int):
+        """Delete stored vectors belonging to a user."""
+        raise NotImplementedError
+
+    def clear(self, collection: str):
+        """Delete every vector in a collection."""
+        raise NotImplementedError
+
+    def query(self, collection: str, texts: list[str], n_results: int, user_id: int) -> dict:
+        """Find a user's nearest vectors to each text."""
+        raise NotImplementedError
+
+
+class ChromaVectorStore(VectorStore):
+    """Vector store backed by a Chroma client, filtering by user_id metadata."""
+
+    def __init__(self, chroma):
+        self.chroma = chroma
+
+    def _collection(self, collection: str):
+        return self.chroma.get_or_create_collection(name=collection)
+
+    def add(self, collection, ids, documents, metadatas):
+        if ids:
+            self._collection(collection).add(ids=ids, documents=documents, metadatas=metadatas)
+
+    def update_metadata(self, collection, ids, metadatas):
+        if ids:
+            self._collection(collection).update(ids=ids, metadatas=metadatas)
+
+    def existing_ids(self, collection, ids, user_id=None):
+        return set(self._collection(collection).get(ids=ids, include=[])["ids"])
+
+    def delete(self, collection, ids, user_id):
+        self._collection(collection).delete(ids=ids)
+
+    def clear(self, collection):
+        self.chroma.delete_collection(name=collection)
+
+    def query(self, collection, texts, n_results, user_id):
+        results = self._collection(collection).query(
+            query_embeddings=embeddings.embed_queries(texts),
+            n_results=n_results,
+            where={"user_id": user_id},
+        )
+        return {"ids": results["ids"], "distances": results["distances"]}
+
+
+class _Partition:
+    """One user's vectors in one collection."""
+
+    def __init__(self, ids: list[str], vectors: np.ndarray, metadatas: list[dict]):
+        self.ids = ids
+        self.vectors = vectors
+        self.metadatas = metadatas
+        self.positions = {item_id: i for i, item_id in enumerate(ids)}
+        self.hnsw = None
+        self._hnsw_lock = Lock()
+        # Identifies the file this was loaded from; see EmbeddedVectorStore._stamp
+        self.stamp: tuple[int, int] | None = None
+
+    def search(self, queries: np.ndarray, n_results: int) -> tuple[np.ndarray, np.ndarray]:
+        """Get (positions, squared L2 distances) of the nearest vectors to each query."""
+        k = min(n_results, len(self.ids))
+        if len(self.ids) > HNSW_THRESHOLD:
+            # Searches run outside the store's lock, so only publish a fully built index
+            with self._hnsw_lock:
+                if self.hnsw is None:
+                    hnsw = hnswlib.Index(space="l2", dim=self.vectors.shape[1])
+                    hnsw.init_index(max_elements=len(self.ids), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+                    hnsw.add_items(self.vectors, np.arange(len(self.ids)))
+                    hnsw.set_ef(HNSW_EF_SEARCH)
+                    self.hnsw = hnsw
+            return self.hnsw.knn_query(queries, k=k)
+
+        distances = (
+            (queries ** 2).sum(axis=1)[:, None]
+            + (self.vectors ** 2).sum(axis=1)[None, :]
+            - 2 * queries @ self.vectors.T
+        )
+        nearest = np.argsort(distances, axis=1)[:, :k]
+        return nearest, np.take_along_axis(distances, nearest, axis=1)
+
+
+class EmbeddedVectorStore(VectorStore):
+    """In-process vector store holding one embedding matrix per user and collection.
+
+    Several processes may share VECTOR_STORE_PATH: writes hold an exclusive
+    lock file around read-modify-write, and a cached matrix is reloaded once
+    another process has replaced its file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._partitions: dict[tuple[str, int], _Partition] = {}
+
+    def _file(self, collection: str, user_id: int) -> str:
+        return os.path.join(self.path, collection, f"{user_id}.npz")
+
+    @contextmanager
+    def _file_lock(self, collection: str, user_id: int):
+        """Hold an exclusive lock on a partition across processes."""
+        file = self._file(collection, user_id)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(f"{file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _file_locks(self, collection: str, user_ids: set[int]):
+        """Hold the locks of several partitions, always taken in the same order."""
+        with ExitStack() as stack:
+            for user_id in sorted(user_ids):
+                stack.enter_context(self._file_lock(collection, user_id))
+            yield
+
+    def _user_ids(self, collection: str) -> list[int]:
+        """Get the users with a stored partition in a collection."""
+        directory = os.path.join(self.path, collection)
+        return [
+            int(name[:-4])
+            for name in (os.listdir(directory) if os.path.isdir(directory) else [])
+            if name.endswith(".npz") and ".tmp" not in name
+        ]
+
+    def _owners(self, collection: str, ids: list[str], likely_user_ids: list[int]) -> dict[str, int]:
+        """Get the user whose partition holds each stored ID, looking in the likely ones first."""
+        owners = {}
+        for user_id in dict.fromkeys(likely_user_ids):
+            for item_id in set(ids) & set(self._load(collection, user_id).ids):
+                owners[item_id] = user_id
+        missing = set(ids) - owners.keys()
+        for user_id in self._user_ids(collection) if missing else []:
+            for item_id in missing & set(self._load(collection, user_id).ids):
+                owners[item_id] = user_id
+        return owners
+
+    @staticmethod
+    def _stamp(file: str) -> tuple[int, int] | None:
+        # Every save replaces the file, so a new inode or mtime means another writer
+        try:
+            stat = os.stat(file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self, collection: str, user_id: int) -> _Partition:
+        key = (collection, user_id)
+        file = self._file(collection, user_id)
+        stamp = self._stamp(file)
+        cached = self._partitions.get(key)
+        if cached is not None and cached.stamp == stamp:
+            return cached
+        if stamp is not None:
+            with np.load(file) as data:
+                partition = _Partition(
+                    ids=[str(item_id) for item_id in data["ids"]],
+                    vectors=data["vectors"],
+                    metadatas=json.loads(str(data["metadatas"])),
+                )
+        else:
+            partition = _Partition([], np.zeros((0, 0), dtype=np.float32), [])
+        partition.stamp = stamp
+        self._partitions[key] = partition
+        return partition
+
+    def _save(self, collection: str, user_id: int, partition: _Partition):
+        file = self._file(collection, user_id)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # Write then rename so a crash never leaves a half-written file
+        temporary = f"{file}.tmp.npz"
+        np.savez(temporary, ids=np.array(partition.ids), vectors=partition.vectors, metadatas=json.dumps(partition.metadatas))
+        os.replace(temporary, file)
+        partition.stamp = self._stamp(file)
+        self._partitions[(collection, user_id)] = partition
+
+    def add(self, collection, ids, documents, metadatas):
+        if not ids:
+            return
+        vectors = embeddings.embed(documents)
+        by_user: dict[int, list[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_user.setdefault(metadata["user_id"], []).append(i)
+
+        with self._lock:
+            for user_id, rows in by_user.items():
+                with self._file_lock(collection, user_id):
+                    partition = self._load(collection, user_id)
+                    new_ids = [ids[i] for i in rows]
+                    keep = [i for i, item_id in enumerate(partition.ids) if item_id not in set(new_ids)]
+                    current = partition.vectors[keep] if keep else np.zeros((0, vectors.shape[1]), dtype=np.float32)
+                    self._save(collection, user_id, _Partition(
+                        ids=[partition.ids[i] for i in keep] + new_ids,
+                        vectors=np.vstack([current, vectors[rows]]),
+                        metadatas=[partition.metadatas[i] for i in keep] + [metadatas[i] for i in rows],
+                    ))
+
+    def update_metadata(self, collection, ids, metadatas):
+        with self._lock:
+            # A vector whose user_id changes moves to the new owner's partition
+            owners = self._owners(collection, ids, [metadata["user_id"] for metadata in metadatas])
+            moves: dict[tuple[int, int], list[tuple[str, dict]]] = {}
+            for item_id, metadata in zip(ids, metadatas):
+                if item_id in owners:
+                    moves.setdefault((owners[item_id], metadata["user_id"]), []).append((item_id, metadata))
+
+            for (old_user_id, new_user_id), updates in moves.items():
+                with self._file_locks(collection, {old_user_id, new_user_id}):
+                    partition = self._load(collection, old_user_id)
+                    found = [(partition.positions[item_id], metadata) for item_id, metadata in updates if item_id in partition.positions]
+                    if not found:
+                        continue
+                    if old_user_id == new_user_id:
+                        new_metadatas = list(partition.metadatas)
+                        for position, metadata in found:
+                            new_metadatas[position] = metadata
+                        self._save(collection, old_user_id, _Partition(partition.ids, partition.vectors, new_metadatas))
+                        continue
+
+                    moved = [position for position, _ in found]
+                    moved_ids = {partition.ids[position] for position in moved}
+                    target = self._load(collection, new_user_id)
+                    keep = [i for i, item_id in enumerate(target.ids) if item_id not in moved_ids]
+                    current = target.vectors[keep] if keep else np.zeros((0, partition.vectors.shape[1]), dtype=np.float32)
+                    # Add before removing, so a crash in between loses nothing
+                    self._save(collection, new_user_id, _Partition(
+                        ids=[target.ids[i] for i in keep] + [partition.ids[position] for position in moved],
+                        vectors=np.vstack([current, partition.vectors[moved]]),
+                        metadatas=[target.metadatas[i] for i in keep] + [metadata for _, metadata in found],
+                    ))
+                    rest = [i for i in range(len(partition.ids)) if i not in set(moved)]
+                    self._save(collection, old_user_id, _Partition(
+                        ids=[partition.ids[i] for i in rest],
+                        vectors=partition.vectors[rest],
+                        metadatas=[partition.metadatas[i] for i in rest],
+                    ))
+
+    def existing_ids(self, collection, ids, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return set(ids) & set(self._load(collection, user_id).ids)
+            found = set()
+            for partition_user_id in self._user_ids(collection):
+                found |= set(ids) & set(self._load(collection, partition_user_id).ids)
+            return found
+
+    def delete(self, collection, ids, user_id):
+        with self._lock, self._file_lock(collection, user_id):
+            partition = self._load(collection, user_id)
+            keep = [i for i, item_id in enumerate(partition.ids) if item_id not in set(ids)]
+            if len(keep) == len(partition.ids):
+                return
+            self._save(collection, user_id, _Partition(
+                ids=[partition.ids[i] for i in keep],
+                vectors=partition.vectors[keep],
+                metadatas=[partition.metadatas[i] for i in keep],
+            ))
+
+    def clear(self, collection):
+        with self._lock:
+            for key in [key for key in self._partitions if key[0] == collection]:
+                del self._partitions[key]
+            shutil.rmtree(os.path.join(self.path, collection), ignore_errors=True)
+
+    def query(self, collection, texts, n_results, user_id):
+        queries = embeddings.embed_queries(texts)
+        with self._lock:
+            partition = self._load(collection, user_id)
+        if not partition.ids:
+            return {"ids": [[] for _ in texts], "distances": [[] for _ in texts]}
+        positions, distances = partition.search(queries, n_results)
+        return {
+            "ids": [[partition.ids[p] for p in row] for row in positions],
+            "distances": [[float(d) for d in row] for row in distances],
+        }
+
+
+if __name__ == "__main__":
+    import time
+
+    # Offline benchmark on random unit vectors, no model or server needed
+    rng = np.random.default_rng(0)
+    dim = 384
+    for size in (100, 1000, 10000):
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        partition = _Partition([str(i) for i in range(size)], vectors, [{} for _ in range(size)])
+        queries = vectors[:20] + 0.01
+        partition.search(queries[:1], 5)  # build the HNSW index outside the timing
+        start = time.perf_counter()
+        for query in queries:
+            partition.search(query[None, :], 5)
+        elapsed = (time.perf_counter() - start) / len(queries)
+        backend = "hnsw" if size > HNSW_THRESHOLD else "numpy"
+        print(f"{size:>6} vectors ({backend}): {elapsed * 1000:.3f} ms per query")
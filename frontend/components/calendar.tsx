@@ -1,5 +1,6 @@
 import { useState, useEffect } from "react";
 import OOTDModal from "@/components/ootd-modal";
+import { fetchAllPages } from "@/lib/pagination";
 import Image from "next/image";
 
 interface Outfit {
@@ -23,11 +24,7 @@ export default function OOTDCalendar() {
   useEffect(() => {
     const fetchWearHistory = async () => {
       try {
-        const response = await fetch('/api/outfit_wear_history');
-        if (!response.ok) {
-          throw new Error('Failed to fetch wear history');
-        }
-        const data = await response.json();
+        const data = await fetchAllPages<any>('/api/outfit_wear_history');
         console.log('Wear history data:', data);
         setOutfits(data.map((item: any) => ({
           date: new Date(item.date).toISOString().split('T')[0],
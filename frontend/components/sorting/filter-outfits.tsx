@@ -10,6 +10,7 @@ import {
 } from "@/components/imported-ui/sheet";
 import ProductFilters from "./product-filters";
 import ProductCard from "./item-card";
+import { fetchAllPages } from "@/lib/pagination";
 import Image from "next/image";
 
 interface ClothingItem {
@@ -65,12 +66,11 @@ export default function FilterOutfits() {
     });
 
     try {
-      const res = await fetch("/api/outfits-by-field", {
+      const outfits = await fetchAllPages<Outfit>("/api/outfits-by-field", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(selectedFilters),
       });
-      const outfits: Outfit[] = await res.json();
       setFilteredOutfits(outfits);
     } catch (err) {
       console.error("reset error:", err);
@@ -81,12 +81,11 @@ export default function FilterOutfits() {
   useEffect(() => {
     const load = async () => {
       try {
-        const res = await fetch("/api/outfits-by-field", {
+        const outfits = await fetchAllPages<Outfit>("/api/outfits-by-field", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify(selectedFilters),
         });
-        const outfits: Outfit[] = await res.json();
         setFilteredOutfits(outfits);
       } catch (err) {
         console.error("filter error:", err);
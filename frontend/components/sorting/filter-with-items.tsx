@@ -10,6 +10,7 @@ import {
 } from "@/components/imported-ui/sheet";
 import ProductFilters from "./product-filters";
 import ProductCard from "./item-card";
+import { fetchAllPages } from "@/lib/pagination";
 import Image from "next/image";
 
 interface ClothingItem {
@@ -52,7 +53,7 @@ export default function FilterWithItems() {
     });
 
     try {
-      const response = await fetch("/api/by-field", {
+      const data = await fetchAllPages<ClothingItem>("/api/by-field", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -65,7 +66,6 @@ export default function FilterWithItems() {
           tag: [],
         }),
       });
-      const data = await response.json();
       setFilteredItems(data);
     } catch (error) {
       console.error("Error resetting items:", error);
@@ -76,14 +76,13 @@ export default function FilterWithItems() {
   useEffect(() => {
     const fetchFilteredItems = async () => {
       try {
-        const response = await fetch("/api/by-field", {
+        const data = await fetchAllPages<ClothingItem>("/api/by-field", {
           method: "POST",
           headers: {
             "Content-Type": "application/json",
           },
           body: JSON.stringify(selectedFilters),
         });
-        const data = await response.json();
         console.log("Filtered items:", data); // Log the filtered items
         setFilteredItems(data);
       } catch (error) {
@@ -37,15 +37,18 @@ export default function ProductFilters({
         const fields = ["category", "brand", "size", "color"];
         const options: Record<string, string[]> = {};
 
+        // One request returns the values of every field with their item counts
+        const response = await fetch("/api/facets", {
+          method: "GET",
+          headers: {
+            "Content-Type": "application/json"
+          },
+        });
+        const data = await response.json();
         for (let field of fields) {
-          const response = await fetch(`/api/unique-values/${field}`, {
-            method: "GET",
-            headers: {
-              "Content-Type": "application/json"
-            },
-          });
-          const data = await response.json();
-          options[field] = data || [];
+          options[field] = (data?.[field] || []).map(
+            (facet: { value: string; count: number }) => facet.value
+          );
         }
 
         console.log("Fetched filter options:", options);
@@ -0,0 +1,24 @@
+// Backend list endpoints return one page at a time and put the cursor of
+// the next page in the X-Next-Cursor header. The largest page the backend
+// serves, to keep round trips down.
+const PAGE_SIZE = 500;
+
+// Fetch every page of a paginated endpoint and return all rows in order.
+export async function fetchAllPages<T>(url: string, init?: RequestInit): Promise<T[]> {
+  const rows: T[] = [];
+  let cursor: string | null = null;
+  do {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    if (cursor) {
+      params.set("cursor", cursor);
+    }
+    const separator = url.includes("?") ? "&" : "?";
+    const response = await fetch(`${url}${separator}${params.toString()}`, init);
+    if (!response.ok) {
+      throw new Error(`Failed to fetch ${url}: ${response.status}`);
+    }
+    rows.push(...(await response.json()));
+    cursor = response.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return rows;
+}
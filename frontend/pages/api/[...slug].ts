@@ -18,8 +18,14 @@ export default async function handler(req: NextApiRequest, res: NextApiResponse)
         return res.status(400).json({ error: 'No slug provided' });
     }
 
-    // Construct the backend URL
-    const url = new URL(join(...slug), process.env.BACKEND_URL).toString();
+    // Construct the backend URL, keeping query parameters such as the page cursor
+    const backendUrl = new URL(join(...slug), process.env.BACKEND_URL);
+    for (const [key, value] of Object.entries(req.query)) {
+        if (key !== 'slug' && typeof value === 'string') {
+            backendUrl.searchParams.set(key, value);
+        }
+    }
+    const url = backendUrl.toString();
     console.log(`Passing request to ${url}`);
 
     // Prepare headers
@@ -57,6 +63,12 @@ export default async function handler(req: NextApiRequest, res: NextApiResponse)
         // Get the response data
         const data = await response.json();
 
+        // Forward the cursor of the next page, if any
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        if (nextCursor) {
+            res.setHeader('X-Next-Cursor', nextCursor);
+        }
+
         // Forward the status code and data
         return res.status(response.status).json(data);
     } catch (error) {
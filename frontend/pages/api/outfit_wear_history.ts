@@ -13,8 +13,28 @@ export default async function handler(
     // Remove trailing slash if it exists
     backendUrl = backendUrl.replace(/\/$/, '');
     
-    console.log('Fetching wear history from:', `${backendUrl}/outfit_wear_history/`);
-    const response = await fetch(`${backendUrl}/outfit_wear_history/`);
+    // Wear history is scoped to the logged in user
+    const loginToken = req.cookies.login_token;
+    if (!loginToken) {
+      return res.status(401).json({ error: 'Not logged in' });
+    }
+
+    // Forward the page cursor and size, if any
+    const params = new URLSearchParams();
+    for (const key of ['cursor', 'limit']) {
+      const value = req.query[key];
+      if (typeof value === 'string') {
+        params.set(key, value);
+      }
+    }
+    const query = params.toString() ? `?${params.toString()}` : '';
+
+    console.log('Fetching wear history from:', `${backendUrl}/outfit_wear_history/${query}`);
+    const response = await fetch(`${backendUrl}/outfit_wear_history/${query}`, {
+      headers: {
+        'Authorization': `Bearer ${loginToken}`
+      }
+    });
     
     if (!response.ok) {
       const errorText = await response.text();
@@ -51,6 +71,10 @@ export default async function handler(
     const validOutfits = outfitsWithDetails.filter((outfit: any) => outfit !== null);
     
     console.log('Successfully fetched wear history with outfit details:', validOutfits);
+    const nextCursor = response.headers.get('X-Next-Cursor');
+    if (nextCursor) {
+      res.setHeader('X-Next-Cursor', nextCursor);
+    }
     return res.status(200).json(validOutfits);
   } catch (error) {
     console.error('Error in wear history API:', error);
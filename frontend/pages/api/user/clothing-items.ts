@@ -39,7 +39,7 @@ export default async function handler(
     console.log('User data:', userData);
     
     // Now fetch the user's clothing items using their ID
-    const clothingResponse = await fetch(`${baseUrl}/users/${userData.id}`, {
+    const clothingResponse = await fetch(`${baseUrl}/users/${userData.id}?include=clothing_items`, {
       headers: {
         'Authorization': `Bearer ${loginToken}`
       }
@@ -6,6 +6,7 @@ import Footer from "../components/footer";
 import Navbar from "../components/navbar";
 import DarkButton from "@/components/tags-and-buttons/dark-button";
 import CameraModal from "@/components/cameramodal";
+import { fetchAllPages } from "@/lib/pagination";
 
 interface ClothingItem {
   brand: string;
@@ -180,15 +181,10 @@ export default function AddItem() {
   // Fetch clothing items for the user
   useEffect(() => {
     const fetchClothingItems = async () => {
-      const res = await fetch("/api/clothing-items", {
-        method: "GET",
-      });
-
-      if (res.ok) {
-        const data = await res.json();
-        setClothingItems(data);
-      } else {
-        console.error("Failed to fetch clothing items");
+      try {
+        setClothingItems(await fetchAllPages<ClothingItem>("/api/clothing-items"));
+      } catch (error) {
+        console.error("Failed to fetch clothing items", error);
       }
     };
 
@@ -197,15 +193,10 @@ export default function AddItem() {
 
   useEffect(() => {
     const fetchUserSelfies = async () => {
-      const res = await fetch("/api/user-selfies", {
-        method: "GET",
-      });
-
-      if (res.ok) {
-        const data = await res.json();
-        setUserSelfies(data);
-      } else {
-        console.error("Failed to fetch user selfies");
+      try {
+        setUserSelfies(await fetchAllPages<UserSelfie>("/api/user-selfies"));
+      } catch (error) {
+        console.error("Failed to fetch user selfies", error);
       }
     };
 